@@ -1,33 +1,57 @@
 """Serial ports data logger."""
 import signal
+import threading
 
 import config
 from config import logger
+from columnar import ColumnarDataLogger
 from datalog import InfluxDataLogger, RotatingFileDataLogger
+from metrics import start_metrics_server
 from serial_reader import SerialPortManager
 
 
 def main():
     """Main application entry point."""
 
-    # create the data logger, this will also create the influxdb client
+    # the Sentry SDK is slow to import, initialize it while starting up
+    threading.Thread(target=config.init_sentry, name="SentryInit", daemon=True).start()
+
+    # create the data logger, the influxdb client is created in the background
     # InfluxDataLogger will exit the app if the token is not provided
     influx_data_logger = InfluxDataLogger()
-
-    # create the file datalogger to write the received data as CSV files
-    # with daily rotation.
-    file_data_logger = RotatingFileDataLogger()
+    threading.Thread(target=influx_data_logger.connect, name="InfluxConnect", daemon=True).start()
 
     # create the serial port manager, that will be responsible for
     # monitoring available serial ports, starting and stopping the
     # threads for each port, and reading data from the ports
-    port_manager = SerialPortManager()
+    if config.WORKER_PROCESSES > 0:
+        # for large box counts, the ports are read by worker processes
+        # and the supervisor feeds their readings to the data handlers
+        from supervisor import Supervisor
+        port_manager = Supervisor()
+    else:
+        port_manager = SerialPortManager()
     port_manager.add_data_handler(influx_data_logger)
-    port_manager.add_data_handler(file_data_logger)
+
+    # create the file datalogger to write the received data as JSON lines
+    # with daily rotation.
+    if config.FILE_LOG_ENABLED:
+        port_manager.add_data_handler(RotatingFileDataLogger())
+
+    # create the columnar datalogger to write compressed daily files per box
+    if config.COLUMNAR_LOG_ENABLED:
+        port_manager.add_data_handler(ColumnarDataLogger())
+
+    # serve the pipeline metrics, e.g. to spot saturated sinks
+    start_metrics_server()
+
     port_manager.start()
 
     # setup signal handler to stop the port manager on SIGINT
     def signal_handler(sig, frame):
+        if port_manager.stop_event.is_set():
+            # already stopping
+            return
         logger.info("Caught signal, stopping serial port manager...")
         port_manager.stop()
         logger.info("Stopped serial port manager, app shutdown.")
@@ -36,10 +60,16 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
 
-    # Notify systemd that the service is ready
+    # Notify systemd that the service is ready, with FAST_START as soon as
+    # the pipeline runs, the ports are started as they respond
     # Do this only if running as a systemd service
     config.notify_systemd(config.NOTIFY_READY)
 
+    # keep the main thread until a signal stops the app, the interpreter
+    # shutdown starts when it returns and the monitor could no longer
+    # start the port probes
+    port_manager.stop_event.wait()
+
 
 if __name__ == '__main__':
     main()
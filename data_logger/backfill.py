@@ -0,0 +1,208 @@
+"""Backfill the readings of the data logs into Influx.
+
+Streams the JSON lines files written by RotatingFileDataLogger (data.log
+and its rotated copies) through their sparse index, converts the readings
+like InfluxDataLogger does, with the recorded receive time, and writes
+them in large gzip-compressed batches from several threads. The points
+already in Influx for the same box and time are skipped, so a backfill
+can be run again, e.g. after an interrupted one.
+
+The readings logged before the port threads stamped them with their
+receive time have a ts taken when the line was written to the file,
+while their points in Influx got the time of the write to Influx. The two
+don't match, so those points are not found as existing and are written
+again, next to the originals. Backfill these logs only for the time
+ranges missing in Influx.
+
+Example, box 5 and 6 for the second week of October::
+
+    python backfill.py --box 5 --box 6 --start 2026-10-06 --end 2026-10-13
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import config
+from config import logger
+from datalog import InfluxDataLogger
+from query import LogIndex, _parse_time, data_log_files, query
+
+# widest ns timestamp range, for a backfill of all the data logs
+MIN_TS = 0
+MAX_TS = 2 ** 63 - 1
+
+
+def _ts_us(value: datetime) -> int:
+    """Timestamp of an Influx time in microseconds, the precision of datetime."""
+    delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+class Backfill:
+    """Backfill of the data logs, see the module docstring."""
+
+    def __init__(
+            self,
+            log_path: str = config.DATA_LOG_PATH,
+            batch_size: int = 10000,
+            workers: int = 4,
+            max_retries: int = config.INFLUX_MAX_RETRIES,
+            retry_backoff: float = config.INFLUX_RETRY_BACKOFF,
+            dry_run: bool = False,
+    ):
+        self.log_path = log_path
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.dry_run = dry_run
+        # the converter and client of the live data logger, without the
+        # background writer, the aggregation and the spool
+        self.data_logger = InfluxDataLogger(batching=False, spool_enabled=False, aggregate_window=0, gzip=True)
+        self.lock = threading.Lock()
+        self.stats = {"read": 0, "existing": 0, "invalid": 0, "written": 0, "failed": 0, "batches": 0}
+
+    def scan_logs(self, start_ts: int, end_ts: int, boxes: set | None) -> tuple[set, int, int]:
+        """Index the data logs, returning the box IDs and the ts range to backfill."""
+        found_boxes = set()
+        min_ts, max_ts = None, None
+        for path in data_log_files(self.log_path):
+            index = LogIndex(path)
+            index.update()
+            for entry in index.entries:
+                if entry["min_ts"] is None or entry["max_ts"] < start_ts or entry["min_ts"] > end_ts:
+                    continue
+                entry_boxes = {str(b) for b in entry["boxes"]}
+                if boxes:
+                    entry_boxes &= boxes
+                if not entry_boxes:
+                    continue
+                found_boxes |= entry_boxes
+                min_ts = entry["min_ts"] if min_ts is None else min(min_ts, entry["min_ts"])
+                max_ts = entry["max_ts"] if max_ts is None else max(max_ts, entry["max_ts"])
+        return found_boxes, max(start_ts, min_ts or 0), min(end_ts, max_ts or 0)
+
+    def existing_times(self, box_id: str, start_ts: int, end_ts: int) -> set[int]:
+        """Times of the points of the box already in Influx, in microseconds."""
+        flux = (
+            f'from(bucket: "{self.data_logger.bucket_name}")'
+            f' |> range(start: time(v: {start_ts}), stop: time(v: {end_ts + 1}))'
+            f' |> filter(fn: (r) => r.box_id == "{box_id}")'
+            ' |> keep(columns: ["_time"])'
+            ' |> group()'
+            ' |> distinct(column: "_time")'
+        )
+        query_api = self.data_logger.client.query_api()
+        return {_ts_us(record.get_value()) for record in query_api.query_stream(flux)}
+
+    def write_batch(self, batch: list[str]):
+        """Write a batch, retrying with exponential backoff."""
+        delay = self.retry_backoff
+        for attempt in range(self.max_retries + 1):
+            try:
+                if not self.dry_run:
+                    self.data_logger.write_api.write(bucket=self.data_logger.bucket_name, record=batch)
+                with self.lock:
+                    self.stats["written"] += len(batch)
+                    self.stats["batches"] += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Failed to write {len(batch)} points after {attempt + 1} attempts: {str(e)}")
+                    with self.lock:
+                        self.stats["failed"] += len(batch)
+                    return
+                logger.warning(f"Error writing {len(batch)} points, retrying in {delay} seconds: {str(e)}")
+                time.sleep(delay)
+                delay = min(delay * 2, config.INFLUX_RETRY_MAX_DELAY)
+
+    def run(self, start_ts: int = MIN_TS, end_ts: int = MAX_TS, boxes: set | None = None,
+            skip_existing: bool = True) -> dict:
+        """Backfill the readings between the timestamps, for the given box IDs."""
+        started = time.monotonic()
+        found_boxes, start_ts, end_ts = self.scan_logs(start_ts, end_ts, boxes)
+        if not found_boxes:
+            logger.info("No readings to backfill")
+            return self.stats
+        logger.info(f"Backfilling boxes {sorted(found_boxes)} from {start_ts} to {end_ts}")
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Backfill")
+        existing = {}
+        if skip_existing:
+            futures = {box_id: executor.submit(self.existing_times, box_id, start_ts, end_ts)
+                       for box_id in found_boxes}
+            existing = {box_id: future.result() for box_id, future in futures.items()}
+            logger.info(f"Found {sum(len(t) for t in existing.values())} points already in Influx")
+
+        # bound the batches waiting for a writer, the logs are read faster than they are written
+        pending = threading.BoundedSemaphore(self.workers * 2)
+
+        def submit(batch):
+            pending.acquire()
+            future = executor.submit(self.write_batch, batch)
+            future.add_done_callback(lambda _: pending.release())
+
+        batch = []
+        try:
+            for data in query(self.log_path, start_ts, end_ts, found_boxes):
+                self.stats["read"] += 1
+                ts = int(data.pop("ts"))
+                times = existing.get(str(data["ID"]), ())
+                # Influx times are read back with microsecond precision
+                if ts // 1000 in times or (ts + 500) // 1000 in times:
+                    self.stats["existing"] += 1
+                    continue
+                try:
+                    line = self.data_logger.to_line_protocol(data, ts)
+                except Exception as e:
+                    logger.warning(f"Skipping invalid reading {data}: {str(e)}")
+                    line = None
+                if line is None:
+                    self.stats["invalid"] += 1
+                    continue
+                batch.append(line)
+                if len(batch) >= self.batch_size:
+                    submit(batch)
+                    batch = []
+            if batch:
+                submit(batch)
+        finally:
+            executor.shutdown(wait=True)
+            self.data_logger.close()
+
+        elapsed = time.monotonic() - started
+        self.stats["seconds"] = round(elapsed, 2)
+        self.stats["points_per_sec"] = round(self.stats["written"] / elapsed) if elapsed else 0
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the data logs into Influx.")
+    parser.add_argument("--start", help="start time, ISO-8601 local time, the oldest reading by default")
+    parser.add_argument("--end", help="end time, ISO-8601 local time, the newest reading by default")
+    parser.add_argument("--box", action="append", help="box ID, can be repeated, all boxes by default")
+    parser.add_argument("--path", default=config.DATA_LOG_PATH, help="data log directory")
+    parser.add_argument("--batch-size", type=int, default=10000, help="points per write request")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent write requests")
+    parser.add_argument("--no-skip-existing", action="store_true",
+                        help="write all the points, without checking what Influx already has")
+    parser.add_argument("--dry-run", action="store_true", help="read and convert, but don't write")
+    args = parser.parse_args()
+
+    backfill = Backfill(args.path, batch_size=args.batch_size, workers=args.workers, dry_run=args.dry_run)
+    stats = backfill.run(
+        start_ts=_parse_time(args.start) if args.start else MIN_TS,
+        end_ts=_parse_time(args.end) if args.end else MAX_TS,
+        boxes=set(args.box) if args.box else None,
+        skip_existing=not args.no_skip_existing and not args.dry_run,
+    )
+    logger.info(f"Backfill done: {stats}")
+    if stats["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
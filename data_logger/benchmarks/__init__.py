@@ -0,0 +1,19 @@
+"""Data logger micro-benchmarks.
+
+Run from the data_logger directory, e.g.::
+
+    python -m benchmarks.bench_queue
+
+Importing the package points the app logs and data logs to a temporary
+directory and disables Sentry, so the benchmarks can't pollute a
+production setup.
+"""
+import os
+import tempfile
+
+BENCH_DIR = tempfile.mkdtemp(prefix='box-logger-bench-')
+
+os.environ.setdefault('SENTRY_DSN', '')
+os.environ.setdefault('LOG_FILE_PATH', os.path.join(BENCH_DIR, 'app.log'))
+os.environ.setdefault('DATA_LOG_PATH', os.path.join(BENCH_DIR, 'data_log'))
+os.environ.setdefault('LOGGING_LEVEL', 'WARNING')
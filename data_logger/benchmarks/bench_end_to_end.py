@@ -0,0 +1,212 @@
+"""End-to-end benchmark: simulated boxes through the whole pipeline.
+
+Runs the box simulator in a separate process, on pseudo-terminals, and the
+serial port manager with the Influx data logger writing to a local
+stand-in for InfluxDB, the file data logger and a latency probe sink.
+Measures, over the run after the warmup:
+
+- lines/sec delivered to the sinks,
+- CPU time of the data logger process per line,
+- resident memory growth,
+- serial-to-sink latency percentiles, from the send time the simulated
+  boxes add to the readings.
+
+With --workers the ports are read by the worker processes of the
+supervisor, the CPU time is then the one of the supervisor and its sinks,
+the CPU time of the workers is reported apart.
+
+The results are saved as JSON, named after the git revision, to be
+compared between revisions with benchmarks.compare.
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import benchmarks
+
+# the simulated ports, set up before config is imported
+SIM_DIR = os.path.join(benchmarks.BENCH_DIR, 'ports')
+os.environ.setdefault('PORT_LINKS_GLOB', os.path.join(SIM_DIR, 'box_sim*'))
+os.environ.setdefault('PORTS_RE', 'box_sim')
+os.environ.setdefault('HOTPLUG_BACKEND', 'none')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('PORT_SCAN_INTERVAL', '2')
+os.environ.setdefault('PROBE_TIMEOUT', '3')
+os.environ.setdefault('SINK_SPILL_PATH', os.path.join(benchmarks.BENCH_DIR, 'spill'))
+os.environ.setdefault('INFLUX_SPOOL_PATH', os.path.join(benchmarks.BENCH_DIR, 'influx_spool.db'))
+
+from benchmarks.fake_influx import FakeInfluxServer  # noqa: E402
+from datalog import DataLoggerBase, InfluxDataLogger, RotatingFileDataLogger  # noqa: E402
+from serial_reader import SerialPortManager  # noqa: E402
+from supervisor import Supervisor  # noqa: E402
+
+DATA_LOGGER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class LatencySink(DataLoggerBase):
+    """Data logger recording the serial-to-sink latency of the readings."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.recording = False
+        self.lines = 0
+        self.latencies_ms = []
+
+    def log_results(self, data: dict, ts: int):
+        if not self.recording:
+            return
+        sent_ns = data.get("sent_ns")
+        with self.lock:
+            self.lines += 1
+            if sent_ns:
+                self.latencies_ms.append((time.time_ns() - sent_ns) / 1e6)
+
+    def start_recording(self):
+        with self.lock:
+            self.lines = 0
+            self.latencies_ms = []
+            self.recording = True
+
+    def stop_recording(self) -> tuple[int, list[float]]:
+        with self.lock:
+            self.recording = False
+            return self.lines, sorted(self.latencies_ms)
+
+
+def rss_kb() -> int:
+    """Resident memory of the process."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def process_cpu(pid: int) -> float:
+    """CPU time of another process, in seconds."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DATA_LOGGER_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=DATA_LOGGER_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 3)
+
+
+def start_simulator(args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(DATA_LOGGER_DIR, 'simulator.py'),
+        '--boxes', str(args.boxes), '--link-dir', SIM_DIR, '--interval', str(args.interval),
+        '--garbage-rate', str(args.garbage_rate), '--disconnect-rate', str(args.disconnect_rate),
+        '--timestamps', '--seed', str(args.seed),
+    ]
+    simulator = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if os.path.isdir(SIM_DIR) and len([n for n in os.listdir(SIM_DIR) if not n.endswith('.tmp')]) >= args.boxes:
+            return simulator
+        time.sleep(0.05)
+    simulator.kill()
+    raise RuntimeError("The simulated boxes did not come up")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boxes', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=0.01, help="seconds between the readings of a box")
+    parser.add_argument('--duration', type=float, default=20, help="seconds measured, after the warmup")
+    parser.add_argument('--warmup', type=float, default=5)
+    parser.add_argument('--garbage-rate', type=float, default=0.01)
+    parser.add_argument('--disconnect-rate', type=float, default=0)
+    parser.add_argument('--influx-delay', type=float, default=0, help="seconds added to every Influx write")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0, help="worker processes of the supervisor, 0 for none")
+    parser.add_argument('--output', help="results file, results/end_to_end-<revision>.json by default")
+    args = parser.parse_args()
+
+    influx = FakeInfluxServer(write_delay=args.influx_delay)
+    influx.start()
+    simulator = start_simulator(args)
+    latency_sink = LatencySink()
+    port_manager = Supervisor(processes=args.workers) if args.workers else SerialPortManager()
+    port_manager.add_data_handler(InfluxDataLogger(db_host='127.0.0.1', db_port=influx.port, token='benchmark'))
+    port_manager.add_data_handler(RotatingFileDataLogger())
+    port_manager.add_data_handler(latency_sink)
+    try:
+        port_manager.start()
+        time.sleep(args.warmup)
+
+        rss_start = rss_kb()
+        worker_pids = [worker.process.pid for worker in port_manager.workers] if args.workers else []
+        worker_cpu_start = sum(process_cpu(pid) for pid in worker_pids)
+        cpu_start = time.process_time()
+        wall_start = time.monotonic()
+        latency_sink.start_recording()
+        time.sleep(args.duration)
+        lines, latencies = latency_sink.stop_recording()
+        wall = time.monotonic() - wall_start
+        cpu = time.process_time() - cpu_start
+        worker_cpu = sum(process_cpu(pid) for pid in worker_pids) - worker_cpu_start
+        rss_end = rss_kb()
+        queue_depths = port_manager.queue_depths()
+    finally:
+        port_manager.stop()
+        simulator.send_signal(signal.SIGINT)
+        simulator_stats = json.loads(simulator.communicate(timeout=30)[0] or '{}')
+        influx.stop()
+
+    results = {
+        'revision': git_revision(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'lines': lines,
+        'lines_per_sec': round(lines / wall, 1),
+        'cpu_us_per_line': round(cpu / lines * 1e6, 1) if lines else None,
+        'cpu_fraction': round(cpu / wall, 4),
+        'worker_cpu_us_per_line': round(worker_cpu / lines * 1e6, 1) if lines and args.workers else None,
+        'rss_start_kb': rss_start,
+        'rss_growth_kb': rss_end - rss_start,
+        'latency_ms_p50': round(statistics.median(latencies), 3) if latencies else None,
+        'latency_ms_p90': percentile(latencies, 0.90),
+        'latency_ms_p99': percentile(latencies, 0.99),
+        'latency_ms_max': round(latencies[-1], 3) if latencies else None,
+        'queue_depths_at_end': queue_depths,
+        'influx_points': influx.points,
+        'influx_requests': influx.requests,
+        'simulator': simulator_stats,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"end_to_end-{results['revision']}.json")
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved the results to {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark the conversion of the readings to Influx points, in points/sec.
+
+Compares building a Point field by field, with the two key map lookups per
+field and an error logged for every unknown key, like InfluxDataLogger did
+before, with the per-schema compiled converters straight to line protocol.
+Nothing is sent to Influx, the writes are counted and dropped.
+"""
+import argparse
+import json
+import time
+
+import benchmarks  # noqa: F401, sets up the environment before config is imported
+from config import logger
+from datalog import InfluxDataLogger, json_loads
+from influxdb_client import Point
+
+SAMPLE_LINES = [
+    b'{"ID":5,"co2":612,"%RH":71.2,"RHSP":71,"boxTempC":34.1,"BHSP":35,"waterTempC":41.9,"IHSP":40,"pressure":101325}',
+    b'{"ID":6,"co2":598,"%RH":70.8,"RHSP":71,"boxTempC":33.9,"BHSP":35,"waterTempC":42.1,"IHSP":40,"pressure":101318}',
+    b'{"ID":10001,"co2(ppm)_0":455,"humidity(RH)_0":48.2,"temperature(C)_0":22.4,"pressure(Pa)_0":101322.5}',
+]
+
+
+class NullWriteApi:
+    def __init__(self):
+        self.points = 0
+
+    def write(self, bucket, record):
+        self.points += 1
+
+
+def legacy_point(data_logger: InfluxDataLogger, data: dict, ts: int) -> str:
+    """The conversion done by InfluxDataLogger.log_results before the schema cache."""
+    box_id = data.get("ID")
+    point = Point(data_logger._get_measurement_name(box_id)) \
+        .tag("box_id", box_id) \
+        .time(ts)
+    for key, value in data.items():
+        if key == "ID":
+            continue
+        influx_key = data_logger.INFLUX_KEYS_MAP.get(key)
+        if not influx_key:
+            logger.error(f"Could not find influx key for column: {key}")
+            continue
+        if key in data_logger.INFLUX_KEYS_TYPES:
+            value = data_logger.INFLUX_KEYS_TYPES[key](value)
+        point = point.field(influx_key, value)
+    return point.to_line_protocol()
+
+
+def points_per_second(func, readings: list) -> float:
+    start = time.process_time()
+    for data, ts in readings:
+        func(data, ts)
+    return len(readings) / (time.process_time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--points', type=int, default=100000)
+    args = parser.parse_args()
+
+    data_logger = InfluxDataLogger(token='benchmark', batching=False, aggregate_window=0)
+    data_logger.write_api = NullWriteApi()
+    readings = [(json_loads(SAMPLE_LINES[i % len(SAMPLE_LINES)]), 1_700_000_000_000_000_000 + i)
+                for i in range(args.points)]
+
+    # both paths must write the same points
+    for data, ts in readings[:len(SAMPLE_LINES)]:
+        data_logger.line_prefixes.clear()
+        expected = legacy_point(data_logger, data, ts)
+        schema = data_logger._get_schema(data)
+        line = f"{data_logger._get_line_prefix(data['ID'])[2]}{schema.to_line_fields(data)} {ts}"
+        assert line == expected, (line, expected)
+
+    # the legacy path logs an error per line, mute the logger so the
+    # benchmark output stays readable, it flatters the legacy path
+    logger.disabled = True
+    try:
+        before = points_per_second(lambda data, ts: data_logger.write_api.write(
+            data_logger.bucket_name, legacy_point(data_logger, data, ts)), readings)
+        after = points_per_second(data_logger.log_results, readings)
+    finally:
+        logger.disabled = False
+        data_logger.close()
+
+    print(json.dumps({
+        'legacy_points_per_sec': round(before),
+        'compiled_points_per_sec': round(after),
+        'speedup': round(after / before, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark the serial line splitting: per-line CPU cost at several baud rates.
+
+Compares reading one byte per call, like pyserial's readline() does,
+followed by decode() and strip(), with reading all the waiting bytes in
+one call into a LineBuffer. At higher baud rates more bytes are waiting
+on each read, so the chunked path amortizes better.
+"""
+import argparse
+import io
+import json
+import time
+
+import benchmarks  # noqa: F401, sets up the environment before config is imported
+from serial_reader import LineBuffer
+
+SAMPLE_LINES = [
+    b'{"ID":5,"co2":612,"%RH":71.2,"RHSP":71,"boxTempC":34.1,"BHSP":35,"waterTempC":41.9,"IHSP":40,"pressure":101325}\r\n',
+    b'{"ID":5,"co2":615,"%RH":71.4,"RHSP":71,"boxTempC":34.2,"BHSP":35,"waterTempC":42.0,"IHSP":40,"pressure":101320}\r\n',
+    b'Still waiting for time sync.\r\n',
+]
+
+
+def make_stream(lines: int) -> bytes:
+    return b''.join(SAMPLE_LINES[i % len(SAMPLE_LINES)] for i in range(lines))
+
+
+def readline_path(data: bytes) -> int:
+    """One read call per byte, then decode and strip every line."""
+    stream = io.BytesIO(data)
+    count = 0
+    while True:
+        line = bytearray()
+        while True:
+            c = stream.read(1)
+            if not c:
+                return count
+            line += c
+            if c == b'\n':
+                break
+        if line.decode('utf-8').strip():
+            count += 1
+
+
+def chunked_path(data: bytes, chunk_size: int) -> int:
+    """One read call per chunk, lines split in place, only status lines decoded."""
+    stream = io.BytesIO(data)
+    line_buffer = LineBuffer()
+    count = 0
+
+    def handle(line):
+        nonlocal count
+        if line[:1] == b'{':
+            bytes(line)
+        else:
+            str(line, 'utf-8').strip()
+        count += 1
+
+    while chunk := stream.read(chunk_size):
+        line_buffer.feed(chunk, handle)
+    return count
+
+
+def per_line_us(func, *args) -> float:
+    start = time.process_time()
+    lines = func(*args)
+    return (time.process_time() - start) / lines * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=50000)
+    parser.add_argument('--read-interval', type=float, default=0.01,
+                        help="seconds between the reads, sets how many bytes are waiting")
+    parser.add_argument('--baud-rates', type=int, nargs='+', default=[115200, 460800, 921600, 2000000])
+    args = parser.parse_args()
+
+    data = make_stream(args.lines)
+    results = {'readline_us_per_line': round(per_line_us(readline_path, data), 3)}
+    for baud_rate in args.baud_rates:
+        # 10 bits per byte on the line, 8N1
+        chunk_size = max(1, int(baud_rate / 10 * args.read_interval))
+        results[f'chunked_us_per_line_{baud_rate}'] = round(per_line_us(chunked_path, data, chunk_size), 3)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
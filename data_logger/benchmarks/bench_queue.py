@@ -0,0 +1,75 @@
+"""Benchmark the queue consumer: idle CPU use and enqueue-to-handler latency.
+
+An idle logger should use next to no CPU, the consumer must sleep until
+data arrives instead of polling the queue.
+"""
+import argparse
+import json
+import queue
+import statistics
+import threading
+import time
+
+import benchmarks  # noqa: F401, sets up the environment before config is imported
+from datalog import Reading
+from serial_reader import QueueReadingThread
+
+
+def measure_idle_cpu(idle_seconds: float) -> float:
+    """Return the CPU time used by an idle consumer, as a fraction of one core."""
+    reading_queue = queue.Queue()
+    consumer = QueueReadingThread(reading_queue, [lambda line: None])
+    consumer.start()
+    # let the threads settle
+    time.sleep(0.2)
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    time.sleep(idle_seconds)
+    cpu_used = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+    consumer.stop()
+    return cpu_used / wall
+
+
+def measure_latency(lines: int, interval: float) -> list[float]:
+    """Return the enqueue-to-handler latencies in microseconds."""
+    latencies = []
+    done = threading.Event()
+
+    def handler(line):
+        latencies.append((time.perf_counter_ns() - int(line)) / 1000)
+        if len(latencies) == lines:
+            done.set()
+
+    reading_queue = queue.Queue()
+    consumer = QueueReadingThread(reading_queue, [handler])
+    consumer.start()
+    for _ in range(lines):
+        reading_queue.put(Reading(str(time.perf_counter_ns()), 'bench'))
+        time.sleep(interval)
+    done.wait(10)
+    consumer.stop()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--idle-seconds', type=float, default=3)
+    parser.add_argument('--lines', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=0.001, help="seconds between the lines")
+    args = parser.parse_args()
+
+    idle_cpu = measure_idle_cpu(args.idle_seconds)
+    latencies = sorted(measure_latency(args.lines, args.interval))
+    results = {
+        'idle_cpu_fraction': round(idle_cpu, 4),
+        'latency_us_p50': round(statistics.median(latencies), 1),
+        'latency_us_p99': round(latencies[int(len(latencies) * 0.99) - 1], 1),
+        'latency_us_max': round(latencies[-1], 1),
+        'lines': len(latencies),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""Startup benchmark: import time and time to the first reading.
+
+Measures, in fresh interpreters:
+
+- the import time of the app modules,
+- for app.py started against the box simulator and the local stand-in for
+  InfluxDB, the time from the process start to the serial port manager
+  running (when READY is sent to systemd), to the first reading in the
+  data log and to the first point written to Influx.
+
+The app runs with FAST_START on and off, the simulator is started afresh
+for every run, the boxes boot and ask for the time sync like after a
+reset. The results are saved as JSON, like the end-to-end benchmark.
+"""
+import argparse
+import json
+import os
+import platform
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import benchmarks
+from benchmarks.bench_end_to_end import DATA_LOGGER_DIR, RESULTS_DIR, git_revision, start_simulator
+from benchmarks.fake_influx import FakeInfluxServer
+
+READY_MARKER = "Started serial port manager"
+
+
+def import_time(env: dict, runs: int) -> float:
+    """Median import time of the app modules, in milliseconds."""
+    code = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=DATA_LOGGER_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]) * 1000)
+    return round(statistics.median(times), 1)
+
+
+def wait_for(condition: callable, timeout: float) -> float | None:
+    """Poll the condition, returning the monotonic time it became true."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return time.monotonic()
+        time.sleep(0.005)
+    return None
+
+
+def run_app(env: dict, influx: FakeInfluxServer, data_log: str, timeout: float) -> dict:
+    """Start the app, time its startup milestones and stop it."""
+    ready = threading.Event()
+    points_before = influx.points
+    started = time.monotonic()
+    app = subprocess.Popen([sys.executable, 'app.py'], cwd=DATA_LOGGER_DIR, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    ready_at = []
+
+    def read_log():
+        for line in app.stderr:
+            if READY_MARKER in line and not ready.is_set():
+                ready_at.append(time.monotonic())
+                ready.set()
+
+    reader = threading.Thread(target=read_log, daemon=True)
+    reader.start()
+    try:
+        ready.wait(timeout)
+        first_file = wait_for(lambda: os.path.exists(data_log) and os.path.getsize(data_log) > 0, timeout)
+        first_influx = wait_for(lambda: influx.points > points_before, timeout)
+    finally:
+        app.send_signal(signal.SIGTERM)
+        try:
+            app.wait(30)
+        except subprocess.TimeoutExpired:
+            app.kill()
+            app.wait()
+        reader.join(5)
+
+    def since_start(at):
+        return round(at - started, 3) if at else None
+
+    return {
+        'ready_s': since_start(ready_at[0] if ready_at else None),
+        'first_reading_s': since_start(first_file),
+        'first_influx_point_s': since_start(first_influx),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--boxes', type=int, default=8)
+    parser.add_argument('--interval', type=float, default=10, help="seconds between the readings of a box")
+    parser.add_argument('--runs', type=int, default=3, help="app starts per mode, the medians are reported")
+    parser.add_argument('--import-runs', type=int, default=10)
+    parser.add_argument('--mode', choices=('fast', 'full'), action='append',
+                        help="FAST_START on or off, both by default")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds to wait for each milestone")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="results file, results/startup-<revision>.json by default")
+    args = parser.parse_args()
+    # start_simulator options, a clean run
+    args.garbage_rate = 0
+    args.disconnect_rate = 0
+
+    influx = FakeInfluxServer()
+    influx.start()
+    base_env = dict(
+        os.environ,
+        INFLUXDB_HOST='127.0.0.1',
+        INFLUXDB_PORT=str(influx.port),
+        INFLUXDB_TOKEN='benchmark',
+        # write the first point right away, to time it
+        INFLUX_FLUSH_INTERVAL='0.1',
+        LOGGING_LEVEL='INFO',
+    )
+    results = {
+        'revision': git_revision(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'import_ms': import_time(base_env, args.import_runs),
+    }
+    try:
+        for mode in args.mode or ('fast', 'full'):
+            runs = []
+            for run in range(args.runs):
+                data_log_path = os.path.join(benchmarks.BENCH_DIR, f'data_log_{mode}_{run}')
+                env = dict(base_env, FAST_START=str(mode == 'fast'), DATA_LOG_PATH=data_log_path)
+                simulator = start_simulator(args)
+                try:
+                    runs.append(run_app(env, influx, os.path.join(data_log_path, 'data.log'), args.timeout))
+                finally:
+                    simulator.send_signal(signal.SIGINT)
+                    simulator.communicate(timeout=30)
+            results[mode] = {
+                key: round(statistics.median(r[key] for r in runs), 3) if all(r[key] is not None for r in runs) else None
+                for key in runs[0]
+            }
+    finally:
+        influx.stop()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup-{results['revision']}.json")
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Saved the results to {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
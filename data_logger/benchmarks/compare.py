@@ -0,0 +1,40 @@
+"""Compare two benchmark result files, e.g. of two revisions.
+
+    python -m benchmarks.compare results/end_to_end-abc1234.json results/end_to_end-def5678.json
+"""
+import argparse
+import json
+
+
+def numeric_items(results: dict, prefix: str = ''):
+    """Yield the (dotted key, value) pairs of the numbers in the results."""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from numeric_items(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'':32} {before.get('revision', args.before):>16} {after.get('revision', args.after):>16} {'change':>9}")
+    after_values = dict(numeric_items(after))
+    for key, old in numeric_items(before):
+        if key.startswith('config.') or key not in after_values:
+            continue
+        new = after_values[key]
+        change = f'{(new - old) / old * 100:+.1f}%' if old else ''
+        print(f'{key:32} {old:>16} {new:>16} {change:>9}')
+
+
+if __name__ == '__main__':
+    main()
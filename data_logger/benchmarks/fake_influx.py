@@ -0,0 +1,68 @@
+"""Local stand-in for InfluxDB, accepting and counting the line protocol writes."""
+import gzip
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeInfluxHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.startswith('/api/v2/write'):
+            self._reply(404)
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if self.server.write_delay:
+            time.sleep(self.server.write_delay)
+        self.server.record_write(body)
+        self._reply(204)
+
+    def do_GET(self):
+        # /ping and /health, checked by the client
+        self._reply(204 if self.path.startswith('/ping') else 200)
+
+    def _reply(self, status: int):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeInfluxServer(ThreadingHTTPServer):
+    """HTTP server on a free local port, counting the written points.
+
+    write_delay slows every write down, to simulate a loaded Influx.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, write_delay: float = 0):
+        super().__init__(('127.0.0.1', 0), FakeInfluxHandler)
+        self.write_delay = write_delay
+        self.lock = threading.Lock()
+        self.points = 0
+        self.requests = 0
+        self.bytes = 0
+        self.thread = threading.Thread(target=self.serve_forever, name="FakeInflux", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def record_write(self, body: bytes):
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+            self.points += sum(1 for line in body.split(b'\n') if line.strip())
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
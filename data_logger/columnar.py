@@ -0,0 +1,268 @@
+"""Compact columnar storage for the box readings.
+
+Readings are buffered per box and written as compressed chunks, one
+column per field, to a file per box and day::
+
+    <path>/box_<ID>/<YYYY-MM-DD>.cols
+
+Each chunk is a header followed by the zlib-compressed columns. The
+header holds a magic, the schema version, the row count, the payload
+length and its CRC32. The columns are the timestamps in nanoseconds
+(int64, delta encoded) and one float32 column per schema field, with NaN
+for the fields missing from a reading. All values are little-endian.
+
+Every chunk is fsync-ed when written. The rows buffered over all the
+boxes are kept under one chunk, so a crash loses at most a chunk of
+readings. A torn chunk at the end of a file is cut off before the next
+chunk is appended to it, and skipped on read.
+"""
+from array import array
+from datetime import date, datetime, timedelta
+import math
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import config
+from config import logger
+from datalog import DataLoggerBase
+
+
+# fixed schema of the box readings, new fields need a new schema version
+SCHEMA_VERSION = 1
+SCHEMA_FIELDS = (
+    "co2",
+    "%RH",
+    "RHSP",
+    "boxTempC",
+    "BHSP",
+    "waterTempC",
+    "IHSP",
+    "pressure",
+    "co2(ppm)_0",
+    "humidity(RH)_0",
+    "temperature(C)_0",
+    "pressure(Pa)_0",
+)
+
+CHUNK_MAGIC = b"BXC1"
+CHUNK_HEADER = struct.Struct("<4sHIII")
+FILE_SUFFIX = ".cols"
+
+
+def _to_little_endian(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+class ColumnChunk:
+    """Readings of one box, buffered column by column."""
+
+    def __init__(self, day: date):
+        self.day = day
+        self.created = time.monotonic()
+        self.ts = array("q")
+        self.columns = [array("f") for _ in SCHEMA_FIELDS]
+
+    def __len__(self):
+        return len(self.ts)
+
+    def append(self, data: dict, ts: int):
+        self.ts.append(ts)
+        for field, column in zip(SCHEMA_FIELDS, self.columns):
+            value = data.get(field)
+            try:
+                column.append(float(value) if value is not None else math.nan)
+            except (TypeError, ValueError):
+                column.append(math.nan)
+
+    def encode(self) -> bytes:
+        """Serialize the chunk, header included."""
+        deltas = array("q", self.ts)
+        for i in range(len(deltas) - 1, 0, -1):
+            deltas[i] -= deltas[i - 1]
+        payload = zlib.compress(
+            _to_little_endian(deltas) + b"".join(_to_little_endian(c) for c in self.columns))
+        header = CHUNK_HEADER.pack(CHUNK_MAGIC, SCHEMA_VERSION, len(self.ts), len(payload), zlib.crc32(payload))
+        return header + payload
+
+
+def _read_chunks(f, path: str):
+    """Yield the row count and the payload of the chunks of an open file.
+
+    Stops at the end of the file or at the first torn or corrupted chunk,
+    f is left at the end of the last valid chunk read.
+    """
+    while True:
+        start = f.tell()
+        header = f.read(CHUNK_HEADER.size)
+        if not header:
+            return
+        if len(header) == CHUNK_HEADER.size:
+            magic, version, rows, length, crc = CHUNK_HEADER.unpack(header)
+            payload = f.read(length)
+            if magic == CHUNK_MAGIC and version == SCHEMA_VERSION and len(payload) == length \
+                    and zlib.crc32(payload) == crc:
+                yield rows, payload
+                continue
+        logger.warning(f"Corrupted chunk in {path} at byte {start}, ignoring the rest of the file")
+        f.seek(start)
+        return
+
+
+def valid_length(path: str) -> int:
+    """Length of the valid chunks at the start of a columnar file."""
+    with open(path, "rb") as f:
+        for _ in _read_chunks(f, path):
+            pass
+        return f.tell()
+
+
+def read_columnar_file(path: str):
+    """Yield the rows of a columnar file as (ts, dict of fields) tuples.
+
+    Missing fields are left out of the dicts. Reading stops at the first
+    torn or corrupted chunk.
+    """
+    with open(path, "rb") as f:
+        for rows, payload in _read_chunks(f, path):
+            data = zlib.decompress(payload)
+            ts = _from_little_endian("q", data[:rows * 8])
+            for i in range(1, rows):
+                ts[i] += ts[i - 1]
+            offset = rows * 8
+            columns = []
+            for _ in SCHEMA_FIELDS:
+                columns.append(_from_little_endian("f", data[offset:offset + rows * 4]))
+                offset += rows * 4
+            for i in range(rows):
+                row = {}
+                for field, column in zip(SCHEMA_FIELDS, columns):
+                    value = column[i]
+                    if not math.isnan(value):
+                        row[field] = value
+                yield ts[i], row
+
+
+class ColumnarDataLogger(DataLoggerBase):
+    """Serial data handler, writing compressed columnar chunks per box.
+
+    The boxes share a budget of chunk_rows buffered readings, when it's
+    used up the largest box chunk is written, which staggers the writes of
+    the boxes. A box chunk is also written when it's older than
+    flush_interval seconds or when the day changes. Files older than
+    retention_days are removed once a day.
+    """
+
+    def __init__(
+            self,
+            log_path: str = config.COLUMNAR_LOG_PATH,
+            chunk_rows: int = config.COLUMNAR_CHUNK_ROWS,
+            flush_interval: int = config.COLUMNAR_FLUSH_INTERVAL,
+            retention_days: int = config.COLUMNAR_RETENTION_DAYS,
+    ):
+        logger.info(f"Creating columnar data logger, log path: {log_path}")
+        self.log_path = log_path
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.chunks = {}
+        # files checked for a torn chunk left by a crash, before appending
+        self.checked_files = set()
+        # rows buffered over all the box chunks
+        self.buffered = 0
+        self.lock = threading.Lock()
+        self.last_cleanup = None
+        if not os.path.exists(self.log_path):
+            os.makedirs(self.log_path)
+
+    def log_results(self, data: dict, ts: int):
+        """Buffer the reading, writing out the chunks that are due."""
+        box_id = int(data["ID"])
+        day = datetime.fromtimestamp(ts / 1e9).date()
+        with self.lock:
+            chunk = self.chunks.get(box_id)
+            if chunk is not None and chunk.day != day:
+                # daily rotation
+                self._flush(box_id, chunk)
+                chunk = None
+            if chunk is None:
+                chunk = self.chunks[box_id] = ColumnChunk(day)
+            chunk.append(data, ts)
+            self.buffered += 1
+            if self.buffered >= self.chunk_rows:
+                largest = max(self.chunks, key=lambda i: len(self.chunks[i]))
+                self._flush(largest, self.chunks[largest])
+            # write the chunks of the boxes that went quiet, too
+            now = time.monotonic()
+            for other_id, other in list(self.chunks.items()):
+                if now - other.created >= self.flush_interval:
+                    self._flush(other_id, other)
+        if self.last_cleanup != day:
+            self.last_cleanup = day
+            self.remove_old_files(day)
+
+    def _flush(self, box_id: int, chunk: ColumnChunk):
+        """Append the chunk to its file, must hold the lock."""
+        del self.chunks[box_id]
+        self.buffered -= len(chunk)
+        if not len(chunk):
+            return
+        box_dir = os.path.join(self.log_path, f"box_{box_id}")
+        if not os.path.exists(box_dir):
+            os.makedirs(box_dir)
+        path = os.path.join(box_dir, f"{chunk.day.isoformat()}{FILE_SUFFIX}")
+        if path not in self.checked_files:
+            self.checked_files.add(path)
+            self._truncate_torn_chunk(path)
+        with open(path, "ab") as f:
+            f.write(chunk.encode())
+            f.flush()
+            os.fsync(f.fileno())
+        logger.debug(f"Wrote {len(chunk)} rows to {path}")
+
+    def _truncate_torn_chunk(self, path: str):
+        """Cut off the torn or corrupted chunks at the end of a file.
+
+        The chunks appended after them couldn't be read otherwise.
+        """
+        if not os.path.exists(path):
+            return
+        length = valid_length(path)
+        size = os.path.getsize(path)
+        if length < size:
+            logger.warning(f"Truncating {path} from {size} to {length} bytes, dropping a torn chunk")
+            with open(path, "r+b") as f:
+                f.truncate(length)
+                os.fsync(f.fileno())
+
+    def remove_old_files(self, today: date):
+        """Remove the files older than the retention period."""
+        oldest = (today - timedelta(days=self.retention_days)).isoformat()
+        for box_dir in os.listdir(self.log_path):
+            box_path = os.path.join(self.log_path, box_dir)
+            if not os.path.isdir(box_path):
+                continue
+            for file_name in os.listdir(box_path):
+                if file_name.endswith(FILE_SUFFIX) and file_name[:-len(FILE_SUFFIX)] < oldest:
+                    logger.info(f"Removing {file_name} of {box_dir}, older than {self.retention_days} days")
+                    os.remove(os.path.join(box_path, file_name))
+
+    def close(self):
+        """Write out all the buffered chunks."""
+        with self.lock:
+            for box_id, chunk in list(self.chunks.items()):
+                self._flush(box_id, chunk)
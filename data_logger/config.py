@@ -1,11 +1,22 @@
 """Application configuration."""
 
+import atexit
 import logging.handlers
 import os
+import queue
+import threading
+import time
 
-import sentry_sdk
 from systemd.daemon import notify
 
+
+def get_bool_env(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
 # existing environment variables
 INFLUXDB_HOST = os.getenv('INFLUXDB_HOST', 'localhost')
 INFLUXDB_PORT = int(os.getenv('INFLUXDB_PORT', 8086))
@@ -24,21 +35,351 @@ WAIT_FOR_PORTS_ATTEMPTS = int(os.getenv('WAIT_FOR_PORTS_ATTEMPTS', 60))
 DATA_LOG_PATH = os.getenv('DATA_LOG_PATH', 'data_log')
 NO_BOXES_TIMEOUT = int(os.getenv('NO_BOXES_TIMEOUT', 60* 5))  # 5 minutes
 
+# influx batching, points are written in the background in batches
+INFLUX_BATCHING = get_bool_env('INFLUX_BATCHING', True)
+INFLUX_BATCH_SIZE = int(os.getenv('INFLUX_BATCH_SIZE', 500))
+INFLUX_FLUSH_INTERVAL = float(os.getenv('INFLUX_FLUSH_INTERVAL', 5))  # seconds
+INFLUX_BUFFER_SIZE = int(os.getenv('INFLUX_BUFFER_SIZE', 100000))  # points
+INFLUX_MAX_RETRIES = int(os.getenv('INFLUX_MAX_RETRIES', 5))
+INFLUX_RETRY_BACKOFF = float(os.getenv('INFLUX_RETRY_BACKOFF', 1))  # seconds, doubled on each retry
+INFLUX_RETRY_MAX_DELAY = float(os.getenv('INFLUX_RETRY_MAX_DELAY', 60))  # seconds
+
+# on-disk spool for the points that could not be written to influx
+INFLUX_SPOOL_ENABLED = get_bool_env('INFLUX_SPOOL_ENABLED', True)
+INFLUX_SPOOL_PATH = os.getenv('INFLUX_SPOOL_PATH', os.path.join(DATA_LOG_PATH, 'influx_spool.db'))
+INFLUX_SPOOL_MAX_BYTES = int(os.getenv('INFLUX_SPOOL_MAX_BYTES', 512 * 1024 * 1024))  # 512 MB
+INFLUX_SPOOL_MAX_AGE = int(os.getenv('INFLUX_SPOOL_MAX_AGE', 60 * 60 * 24 * 30))  # 30 days
+INFLUX_SPOOL_REPLAY_RATE = int(os.getenv('INFLUX_SPOOL_REPLAY_RATE', 5000))  # points per second
+
+# aggregate the readings into min/max/mean/last per window before writing to influx, 0 disables it
+INFLUX_AGGREGATE_WINDOW = float(os.getenv('INFLUX_AGGREGATE_WINDOW', 0))  # seconds
+
+# drop the fields that stayed within their tolerance of the last value sent for the box, before the
+# sinks, a full reading is kept every keyframe interval, field=tolerance list, other fields are kept
+DEADBAND_ENABLED = get_bool_env('DEADBAND_ENABLED', False)
+DEADBAND_TOLERANCES = os.getenv('DEADBAND_TOLERANCES', 'RHSP=0,BHSP=0,IHSP=0,co2=0')
+DEADBAND_KEYFRAME_INTERVAL = float(os.getenv('DEADBAND_KEYFRAME_INTERVAL', 300))  # seconds
+
+# gzip the write requests, worth it for large batches on a slow link
+INFLUX_GZIP = get_bool_env('INFLUX_GZIP', False)
+
+# every data handler gets its own queue and thread
+SINK_QUEUE_SIZE = int(os.getenv('SINK_QUEUE_SIZE', 10000))
+SINK_OVERFLOW_POLICY = os.getenv('SINK_OVERFLOW_POLICY', 'spill')  # block, drop_oldest or spill
+SINK_SPILL_PATH = os.getenv('SINK_SPILL_PATH', os.path.join(DATA_LOG_PATH, 'spill'))
+SINK_DEPTH_LOG_INTERVAL = int(os.getenv('SINK_DEPTH_LOG_INTERVAL', 60))  # seconds
+
+# json decoder, auto uses orjson when it is installed, json forces the standard library
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+
+# non-JSON status lines printed by the boxes are logged at most once per interval
+STATUS_LOG_INTERVAL = int(os.getenv('STATUS_LOG_INTERVAL', 60))  # seconds
+
+# answer the time sync requests of the boxes with the host clock
+TIME_SYNC_ENABLED = get_bool_env('TIME_SYNC_ENABLED', True)
+TIME_SYNC_RETRY_INTERVAL = float(os.getenv('TIME_SYNC_RETRY_INTERVAL', 2))  # seconds
+
+# serial port hotplug events, auto uses udev when pyudev is installed, none disables them
+HOTPLUG_BACKEND = os.getenv('HOTPLUG_BACKEND', 'auto')
+# stable port symlinks created by automation/99-usb-ports-nuc.rules
+PORT_LINKS_GLOB = os.getenv('PORT_LINKS_GLOB', '/dev/box_*')
+
+# new ports are probed concurrently for a first line of data
+PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', 12))  # seconds, longer than the boxes send interval
+PROBE_DEADLINE = float(os.getenv('PROBE_DEADLINE', 15))  # seconds, for all the ports together
+PROBE_WORKERS = int(os.getenv('PROBE_WORKERS', 8))
+# start the pipeline and notify systemd right away, the ports are probed and
+# started in the background, each one as soon as it responds
+FAST_START = get_bool_env('FAST_START', False)
+
+# serial reader engine, threads uses a thread per port, selector reads all the ports from one thread
+READER_ENGINE = os.getenv('READER_ENGINE', 'threads')
+
+# boxes and ports without a valid reading for the timeout get their port reopened, then an alert
+# to Sentry, then the systemd status, one step per timeout, the boxes send a reading every 10 s
+LIVENESS_ENABLED = get_bool_env('LIVENESS_ENABLED', False)
+LIVENESS_TIMEOUT = float(os.getenv('LIVENESS_TIMEOUT', 15))  # seconds
+
+# data sinks, the JSON lines data.log and the compact columnar files
+FILE_LOG_ENABLED = get_bool_env('FILE_LOG_ENABLED', True)
+FILE_LOG_INDEX_INTERVAL = int(os.getenv('FILE_LOG_INDEX_INTERVAL', 60))  # seconds, 0 leaves the indexing to the queries
+COLUMNAR_LOG_ENABLED = get_bool_env('COLUMNAR_LOG_ENABLED', False)
+COLUMNAR_LOG_PATH = os.getenv('COLUMNAR_LOG_PATH', os.path.join(DATA_LOG_PATH, 'columnar'))
+COLUMNAR_CHUNK_ROWS = int(os.getenv('COLUMNAR_CHUNK_ROWS', 360))  # buffered readings over all the boxes
+COLUMNAR_FLUSH_INTERVAL = int(os.getenv('COLUMNAR_FLUSH_INTERVAL', 60 * 15))  # seconds
+COLUMNAR_RETENTION_DAYS = int(os.getenv('COLUMNAR_RETENTION_DAYS', 365))
+
+# metrics endpoint in the Prometheus text format, on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = get_bool_env('METRICS_ENABLED', False)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9464))
+
+# supervisor mode, the ports are sharded over worker processes sending their decoded readings
+# to the sinks of the supervisor in batches, 0 reads all the ports in the app process
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', 0))
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', 256))  # readings
+WORKER_FLUSH_INTERVAL = float(os.getenv('WORKER_FLUSH_INTERVAL', 0.05))  # seconds
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv('WORKER_HEARTBEAT_TIMEOUT', 60))  # seconds, a silent worker is killed
+WORKER_RESTART_DELAY = float(os.getenv('WORKER_RESTART_DELAY', 1))  # seconds, doubled on each quick crash
+# set by the supervisor in its worker processes, they log and spill to their own files, a worker
+# must not wait for ports as its shard can be empty
+WORKER_INDEX = os.getenv('WORKER_INDEX')
+if WORKER_INDEX is not None:
+    LOG_FILE_PATH = '{0}.worker{2}{1}'.format(*os.path.splitext(LOG_FILE_PATH), WORKER_INDEX)
+    SINK_SPILL_PATH = os.path.join(SINK_SPILL_PATH, f'worker{WORKER_INDEX}')
+    FAST_START = True
+
+# logging off the data threads, the handlers run on a listener thread
+LOG_QUEUE_ENABLED = get_bool_env('LOG_QUEUE_ENABLED', True)
+# messages logged per line are rate limited per message, a burst per interval
+# then one in LOG_SAMPLE_EVERY, 0 drops them all until the next interval
+LOG_RATE_LIMIT_INTERVAL = float(os.getenv('LOG_RATE_LIMIT_INTERVAL', 60))  # seconds
+LOG_RATE_LIMIT_BURST = int(os.getenv('LOG_RATE_LIMIT_BURST', 10))
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 1000))
+
 NOTIFY_READY = "READY=1"
 NOTIFY_WATCHDOG = "WATCHDOG=1"
 NOTIFY_SOCKET = "NOTIFY_SOCKET"
 
 SENTRY_DSN = os.getenv('SENTRY_DSN', 'https://84ce1983583627baa346f1b2366da01b@o1409994.ingest.sentry.io/4506394675380224')
+# repeats of an error are counted and sent as a summary once per interval
+SENTRY_SUMMARY_INTERVAL = float(os.getenv('SENTRY_SUMMARY_INTERVAL', 300))  # seconds
+SENTRY_QUEUE_SIZE = int(os.getenv('SENTRY_QUEUE_SIZE', 100))
+
+sentry_lock = threading.Lock()
+sentry = None
+
+
+def init_sentry():
+    """Import and initialize the Sentry SDK, once.
+
+    The import takes a good part of the startup time, the app calls this
+    off the main thread, and the error reporter before its first event.
+    """
+    global sentry
+    with sentry_lock:
+        if sentry is None:
+            import sentry_sdk
+            from sentry_sdk.integrations.logging import LoggingIntegration
+            # the errors are reported through the error reporter, the logged
+            # errors are only kept as breadcrumbs, not sent as events again
+            sentry_sdk.init(dsn=SENTRY_DSN, integrations=[LoggingIntegration(event_level=None)])
+            sentry = sentry_sdk
+    return sentry
+
+
+class ErrorAggregator:
+    """Deduplicating, non-blocking front of the Sentry calls.
+
+    Errors are grouped by fingerprint: the exception type and the code
+    locations of its traceback, or the text of a message. The first error
+    of a fingerprint is sent right away, the repeats are only counted and
+    sent as one summary event per interval. A fingerprint without repeats
+    in an interval is forgotten, so its next error is sent right away
+    again. The events are sent by a worker thread, an event that doesn't
+    fit in the bounded queue is dropped and counted.
+    """
+
+    MAX_TRACKED_FINGERPRINTS = 1000
+
+    def __init__(self, summary_interval: float = SENTRY_SUMMARY_INTERVAL, queue_size: int = SENTRY_QUEUE_SIZE):
+        self.summary_interval = summary_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        # fingerprint -> [description, repeats since the last event]
+        self.fingerprints = {}
+        self.dropped = 0
+        self.worker = None
+        self.stop_event = threading.Event()
+
+    @staticmethod
+    def exception_fingerprint(exc: BaseException) -> tuple:
+        locations = []
+        tb = exc.__traceback__
+        while tb is not None:
+            locations.append((tb.tb_frame.f_code.co_filename, tb.tb_lineno))
+            tb = tb.tb_next
+        return (type(exc).__qualname__, *locations)
+
+    def capture_exception(self, exc: BaseException):
+        """Report an exception, without blocking."""
+        self._capture(self.exception_fingerprint(exc), f"{type(exc).__name__}: {exc}", ('exception', exc))
+
+    def capture_message(self, message: str, level: str = 'error'):
+        """Report a message, without blocking."""
+        self._capture(('message', message), message, ('message', message, level))
 
-sentry_sdk.init(dsn=SENTRY_DSN)
+    def _capture(self, fingerprint: tuple, description: str, event: tuple):
+        with self.lock:
+            entry = self.fingerprints.get(fingerprint)
+            if entry is not None:
+                entry[0] = description
+                entry[1] += 1
+                return
+            if len(self.fingerprints) >= self.MAX_TRACKED_FINGERPRINTS:
+                self.fingerprints.clear()
+            self.fingerprints[fingerprint] = [description, 0]
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, name="ErrorAggregator", daemon=True)
+                self.worker.start()
+        self._enqueue(fingerprint, event)
+
+    def _enqueue(self, fingerprint: tuple, event: tuple):
+        try:
+            self.queue.put_nowait((fingerprint, event))
+        except queue.Full:
+            self.dropped += 1
+
+    def summarize(self):
+        """Queue a summary event for every fingerprint repeated since the last one."""
+        with self.lock:
+            repeated = []
+            for fingerprint, entry in list(self.fingerprints.items()):
+                if entry[1]:
+                    repeated.append((fingerprint, entry[0], entry[1]))
+                    entry[1] = 0
+                else:
+                    del self.fingerprints[fingerprint]
+        for fingerprint, description, count in repeated:
+            message = f"{description} (repeated {count} times in the last {self.summary_interval:g} seconds)"
+            self._enqueue(fingerprint, ('message', message, 'warning'))
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} Sentry events, the queue was full")
+            self.dropped = 0
+
+    def _run(self):
+        next_summary = time.monotonic() + self.summary_interval
+        while True:
+            try:
+                fingerprint, event = self.queue.get(timeout=max(0.0, next_summary - time.monotonic()))
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    break
+                self.summarize()
+                next_summary = time.monotonic() + self.summary_interval
+                continue
+            if event is None:
+                break
+            self._send(fingerprint, event)
+
+    @staticmethod
+    def _send(fingerprint: tuple, event: tuple):
+        try:
+            sentry_sdk = init_sentry()
+            new_scope = getattr(sentry_sdk, 'new_scope', None) or sentry_sdk.push_scope
+            with new_scope() as scope:
+                # the summaries are grouped with the first event of the fingerprint
+                scope.fingerprint = [str(part) for part in fingerprint]
+                if event[0] == 'exception':
+                    sentry_sdk.capture_exception(event[1])
+                else:
+                    sentry_sdk.capture_message(event[1], level=event[2])
+        except Exception as e:
+            logger.warning(f"Failed to send a Sentry event: {str(e)}")
+
+    def stop(self, timeout: float = 5):
+        """Send the pending summaries and the queued events, then stop the worker."""
+        if self.worker is None or self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        self.summarize()
+        try:
+            self.queue.put((None, None), timeout=timeout)
+        except queue.Full:
+            pass
+        self.worker.join(timeout)
+        if sentry is not None:
+            sentry.flush(timeout)
+
+
+error_reporter = ErrorAggregator()
+
+
+def capture_exception(exc: BaseException):
+    """Report an exception to Sentry, deduplicated and without blocking."""
+    error_reporter.capture_exception(exc)
+
+
+def capture_message(message: str, level: str = 'error'):
+    """Report a message to Sentry, deduplicated and without blocking."""
+    error_reporter.capture_message(message, level)
+
+
+# the worker processes forward their notifications to the supervisor
+notify_forwarder = None
 
 
 def notify_systemd(state):
-    """Send a notification to systemd."""
-    if NOTIFY_SOCKET in os.environ:
+    """Send a notification to systemd, or to the supervisor from a worker process."""
+    if notify_forwarder is not None:
+        notify_forwarder(state)
+    elif NOTIFY_SOCKET in os.environ:
         notify(state)
 
 
+class RateLimitFilter(logging.Filter):
+    """Rate limit and sample the records, per message.
+
+    The key of a record is its logger, level and message template, so the
+    messages must be logged with lazy formatting (logger.info("x: %s", x))
+    to be grouped. Every interval, the first burst records of a key pass,
+    then one record in sample_every. The passing records report how many
+    were suppressed since the previous one.
+    """
+
+    MAX_TRACKED_KEYS = 1000
+
+    def __init__(
+            self,
+            interval: float = LOG_RATE_LIMIT_INTERVAL,
+            burst: int = LOG_RATE_LIMIT_BURST,
+            sample_every: int = LOG_SAMPLE_EVERY,
+    ):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.sample_every = sample_every
+        self.lock = threading.Lock()
+        # key -> [window start, records in the window, suppressed since the last passing record]
+        self.keys = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.keys.get(key)
+            if entry is None:
+                if len(self.keys) >= self.MAX_TRACKED_KEYS:
+                    self.keys.clear()
+                entry = self.keys[key] = [now, 0, 0]
+            elif now - entry[0] >= self.interval:
+                entry[0] = now
+                entry[1] = 0
+            entry[1] += 1
+            over = entry[1] - self.burst
+            if over > 0 and not (self.sample_every and over % self.sample_every == 0):
+                entry[2] += 1
+                self.suppressed += 1
+                return False
+            suppressed, entry[2] = entry[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler leaving the formatting to the listener thread.
+
+    The records stay in the process, so they don't need to be made
+    picklable by formatting them on the logging thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
 # create logger
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGING_LEVEL)
@@ -49,7 +390,10 @@ handler.setLevel(LOGGING_LEVEL)
 
 
 # create formatter
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+if WORKER_INDEX is None:
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+else:
+    formatter = logging.Formatter(f'%(asctime)s - worker {WORKER_INDEX} - %(levelname)s - %(message)s')
 
 # add formatter to handlers
 handler.setFormatter(formatter)
@@ -57,6 +401,14 @@ handler.setFormatter(formatter)
 # add handlers to logger
 logger.addHandler(handler)
 
+# separate channel for the status lines printed by the boxes
+status_logger = logger.getChild('status')
+
+# channel for the messages logged per line on the data threads, rate limited
+hot_path_logger = logger.getChild('hot')
+hot_path_filter = RateLimitFilter()
+hot_path_logger.addFilter(hot_path_filter)
+
 
 # make sure the log file path exists
 try:
@@ -71,3 +423,27 @@ try:
     logger.addHandler(file_handler)
 except Exception as e:
     logger.error(f"Error creating log file directory: {str(e)}")
+
+log_listener = None
+if LOG_QUEUE_ENABLED:
+    # the console and file handlers run on the listener thread, logging
+    # on the data threads is just a queue put
+    log_handlers = logger.handlers[:]
+    log_queue = queue.SimpleQueue()
+    for log_handler in log_handlers:
+        logger.removeHandler(log_handler)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+
+
+def stop_logging():
+    """Send the pending Sentry events, report the suppressed messages and flush the queued records."""
+    error_reporter.stop()
+    if hot_path_filter.suppressed:
+        logger.info(f"{hot_path_filter.suppressed} rate limited messages were suppressed")
+    if log_listener is not None:
+        log_listener.stop()
+
+
+atexit.register(stop_logging)
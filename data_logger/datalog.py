@@ -1,18 +1,30 @@
 from abc import abstractmethod, ABCMeta
-from time import time_ns
+from array import array
+from collections import deque
+from time import monotonic, monotonic_ns, time_ns
 
+import inspect
 import json
 import logging.handlers
+import math
 import os
 import sys
+import threading
+from typing import TYPE_CHECKING
 
+import config
+import metrics
+from config import hot_path_logger, logger
+from spool import InfluxSpool
 
-from influxdb_client import InfluxDBClient, Point
-from influxdb_client.client.write_api import SYNCHRONOUS
-import sentry_sdk
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-import config
-from config import logger
+if TYPE_CHECKING:
+    # imported on the first write, it's slow to import
+    from influxdb_client import InfluxDBClient, Point
 
 
 # Monitoring data example:
@@ -20,9 +32,162 @@ from config import logger
 # Where ID is the arduino box ID
 
 
+if orjson is not None and config.JSON_BACKEND != 'json':
+    json_loads = orjson.loads
+else:
+    json_loads = json.loads
+
+
 def simple_logging_data_handler(data: str):
     """Simple data handler that logs the data."""
-    logger.info(f"Received data: {data}")
+    hot_path_logger.info("Received data: %s", data)
+
+
+def is_json_line(line: str | bytes | memoryview) -> bool:
+    """Cheap check if the line is monitoring data, before it is parsed.
+
+    The boxes print plain text status lines (e.g. "Still waiting for time
+    sync.") next to the JSON data, those never start with a brace.
+    """
+    return line[:1] in ('{', b'{')
+
+
+class StatusLineLog:
+    """Counter and rate limited log for the status lines of a port.
+
+    Every distinct status line is logged at most once per log interval,
+    together with the number of repeats suppressed in the meantime. At
+    most MAX_NEW_LINES lines not seen before are logged per interval, the
+    others are only counted, e.g. the garbage of a flaky USB link, which
+    is a new line every time.
+    """
+
+    MAX_TRACKED_LINES = 100
+    MAX_NEW_LINES = 10
+
+    def __init__(self, port_name: str, log_interval: int = config.STATUS_LOG_INTERVAL):
+        self.port_name = port_name
+        self.log_interval = log_interval
+        self.count = 0
+        # status line -> [last log time, suppressed count]
+        self.lines = {}
+        # new lines logged and not logged in the current interval
+        self.window_start = monotonic()
+        self.new_lines = 0
+        self.unlogged = 0
+
+    def add(self, line: str):
+        """Count the status line and log it, unless logged recently."""
+        self.count += 1
+        now = monotonic()
+        entry = self.lines.get(line)
+        if entry is None:
+            if now - self.window_start >= self.log_interval:
+                if self.unlogged:
+                    config.status_logger.warning(
+                        "%s: %d other new status lines not logged", self.port_name, self.unlogged)
+                self.window_start = now
+                self.new_lines = 0
+                self.unlogged = 0
+            if self.new_lines >= self.MAX_NEW_LINES:
+                self.unlogged += 1
+                return
+            self.new_lines += 1
+            if len(self.lines) >= self.MAX_TRACKED_LINES:
+                # garbage on the line, don't let the dict grow without bounds
+                self.lines.clear()
+            self.lines[line] = [now, 0]
+            config.status_logger.info("%s: %s", self.port_name, line)
+        elif now - entry[0] >= self.log_interval:
+            config.status_logger.info("%s: %s (repeated %d times)", self.port_name, line, entry[1] + 1)
+            entry[0] = now
+            entry[1] = 0
+        else:
+            entry[1] += 1
+
+
+class ReceiveClock:
+    """Wall clock derived from the monotonic clock, used to stamp the readings.
+
+    The timestamps follow the monotonic clock, so they stay evenly spaced
+    while the system clock is slewed, but the clock is re-anchored when the
+    system clock is stepped by more than max_step_ns (e.g. the first NTP
+    sync after a boot without network).
+    """
+
+    def __init__(self, max_step_ns: int = 1_000_000_000):
+        self.max_step_ns = max_step_ns
+        self.anchor()
+
+    def anchor(self):
+        """Align the clock with the system clock."""
+        self.wall_anchor_ns = time_ns()
+        self.monotonic_anchor_ns = monotonic_ns()
+
+    def now_ns(self) -> int:
+        """Current time in nanoseconds since the epoch."""
+        now = self.wall_anchor_ns + monotonic_ns() - self.monotonic_anchor_ns
+        if abs(time_ns() - now) > self.max_step_ns:
+            logger.warning("System clock was stepped, re-anchoring the receive clock")
+            self.anchor()
+            now = self.wall_anchor_ns
+        return now
+
+
+receive_clock = ReceiveClock()
+
+
+class Reading:
+    """A line received from a serial port.
+
+    The line is kept as the raw bytes read from the port, the JSON decoder
+    reads them directly. The line is stamped with the port name and the receive time when it is
+    read, and decoded once by the queue reader for all the data handlers.
+    """
+
+    __slots__ = ('line', 'port', 'ts', 'data')
+
+    def __init__(self, line: bytes | str, port: str = None, ts: int = None, data: dict = None):
+        self.line = line
+        self.port = port
+        self.ts = ts if ts is not None else receive_clock.now_ns()
+        self.data = data
+
+    def __repr__(self):
+        return f"Reading({self.port!r}, {self.ts}, {self.line!r})"
+
+    @property
+    def text(self) -> str:
+        """The line as a string."""
+        if isinstance(self.line, str):
+            return self.line
+        return self.line.decode('utf-8', errors='replace')
+
+
+def decode_reading(reading: Reading, required_columns: list[str] = None) -> bool:
+    """Parse and validate the JSON data of a reading, into reading.data.
+
+    Returns False if the line is not valid monitoring data.
+    """
+    if required_columns is None:
+        required_columns = DataLoggerBase.REQUIRED_COLUMNS
+    try:
+        data = json_loads(reading.line)
+    except ValueError:
+        metrics.PARSE_FAILURES.labels('invalid_json').inc()
+        hot_path_logger.warning("Invalid JSON data from %s: %s", reading.port, reading.text)
+        return False
+    if not isinstance(data, dict):
+        metrics.PARSE_FAILURES.labels('not_an_object').inc()
+        hot_path_logger.warning("Unexpected JSON data from %s: %s", reading.port, reading.text)
+        return False
+    for column in required_columns:
+        if column not in data:
+            metrics.PARSE_FAILURES.labels('missing_column').inc()
+            hot_path_logger.error("Missing required column: %s", column)
+            return False
+    reading.data = data
+    return True
 
 
 class DataLoggerBase(metaclass=ABCMeta):
@@ -31,49 +196,473 @@ class DataLoggerBase(metaclass=ABCMeta):
     You can create your own data logger by inheriting from this class and implementing
     the log_results method.
 
+    The data handed to log_results is shared between all the data loggers,
+    it must not be modified. The signature is log_results(self, data, ts),
+    ts is the time the reading was received from the serial port, in
+    nanoseconds since the epoch. The data loggers implementing the older
+    log_results(self, data) still work, they are called without ts.
     """
 
     REQUIRED_COLUMNS = ['ID'] #, 'co2', '%RH', 'RHSP', 'boxTempC', 'BHSP', 'waterTempC', 'IHSP']
 
+    # if log_results takes the receive time, set per subclass
+    log_results_takes_ts = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        try:
+            inspect.signature(cls.log_results).bind(None, {}, 0)
+            cls.log_results_takes_ts = True
+        except TypeError:
+            cls.log_results_takes_ts = False
+
     def deserialize_data(self, data: str) -> dict:
         """Deserialize the data into a dict."""
         try:
-            data_dict = json.loads(data)
+            data_dict = json_loads(data)
             # validate the data
             for column in self.REQUIRED_COLUMNS:
                 if column not in data_dict:
-                    logger.error(f"Missing required column: {column}")
+                    metrics.PARSE_FAILURES.labels('missing_column').inc()
+                    hot_path_logger.error("Missing required column: %s", column)
                     return None
             return data_dict
-        except json.JSONDecodeError:
+        except ValueError:
             #sentry_sdk.capture_exception()
-            logger.warning(f"Invalid JSON data: {data}")
+            metrics.PARSE_FAILURES.labels('invalid_json').inc()
+            hot_path_logger.warning("Invalid JSON data: %s", data)
             return None
 
-    def handle_data(self, data: str):
-        """Handle the data."""
-        data_dict = self.deserialize_data(data)
+    def handle_data(self, data: str | Reading):
+        """Handle the data.
+
+        Accepts either a reading already decoded by the queue reader, or
+        a raw line which is deserialized here.
+        """
+        if isinstance(data, Reading):
+            data_dict = data.data
+            ts = data.ts
+        else:
+            data_dict = self.deserialize_data(data)
+            ts = receive_clock.now_ns()
         if not data_dict:
-            logger.warning(f"Failed to deserialize data: {data}")
+            hot_path_logger.warning("Failed to deserialize data: %s", data)
             return
         try:
-            self.log_results(data_dict)
+            with self.write_seconds.time():
+                if self.log_results_takes_ts:
+                    self.log_results(data_dict, ts)
+                else:
+                    self.log_results(data_dict)
         except Exception as e:
-            sentry_sdk.capture_exception(e)
-            logger.exception(f"Error logging data: {str(e)}")
+            config.capture_exception(e)
+            hot_path_logger.exception("Error logging data: %s", e)
+
+    @property
+    def write_seconds(self) -> metrics.Histogram:
+        """Histogram of the time log_results takes for this data logger."""
+        return metrics.SINK_WRITE_SECONDS.labels(type(self).__name__)
 
     @abstractmethod
-    def log_results(self, data: dict):
+    def log_results(self, data: dict, ts: int = None):
         pass
 
+    def close(self):
+        """Flush any pending data and release the resources.
+
+        Called once by the serial port manager on shutdown.
+        """
+        pass
+
+
+class DeferredWriteApi:
+    """Write API of a data logger, its client is only created on the first write."""
+
+    def __init__(self, data_logger: 'InfluxDataLogger'):
+        self.data_logger = data_logger
+
+    def write(self, **kwargs):
+        return self.data_logger.write_api.write(**kwargs)
+
+
+class InfluxBatchWriter(threading.Thread):
+    """Background writer, sending line protocol batches to Influx.
+
+    Points from all the boxes are collected into one bounded buffer and
+    written in batches, when batch_size points are buffered or when the
+    flush interval expires. Failed writes are retried with exponential
+    backoff. When the buffer is full the oldest points are dropped.
+
+    If a spool is given, the batches that could not be written are stored
+    on disk and replayed, oldest first, once Influx is reachable again.
+    The replay is rate limited and only runs when there is no live backlog.
+    The spool is not a write-ahead log: the points are only spooled once
+    their write failed, those still in the memory buffer are lost on a
+    crash. While Influx is known to be down the batches are spooled right
+    away, so that's about a flush interval of points, more while the
+    first failing write is retried.
+    """
+
+    def __init__(
+            self,
+            write_api,
+            bucket_name: str,
+            batch_size: int = config.INFLUX_BATCH_SIZE,
+            flush_interval: float = config.INFLUX_FLUSH_INTERVAL,
+            buffer_size: int = config.INFLUX_BUFFER_SIZE,
+            max_retries: int = config.INFLUX_MAX_RETRIES,
+            retry_backoff: float = config.INFLUX_RETRY_BACKOFF,
+            retry_max_delay: float = config.INFLUX_RETRY_MAX_DELAY,
+            spool: InfluxSpool = None,
+            replay_rate: int = config.INFLUX_SPOOL_REPLAY_RATE,
+    ):
+        super().__init__(name="InfluxBatchWriter", daemon=True)
+        self.write_api = write_api
+        self.bucket_name = bucket_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_delay = retry_max_delay
+        self.buffer = deque(maxlen=buffer_size)
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.dropped_points = 0
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.replay_tokens = 0.0
+        self.last_replay = monotonic()
+        # while Influx is down, batches go straight to the spool and Influx
+        # is only probed every retry_max_delay seconds
+        self.healthy = True
+        self.next_probe = 0.0
+
+    def add(self, line: str):
+        """Add a line protocol point to the buffer."""
+        with self.condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                # the deque evicts the oldest point on append
+                self.dropped_points += 1
+            self.buffer.append(line)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def run(self):
+        """Main thread entry point."""
+        logger.info("Starting influx batch writer...")
+        while True:
+            with self.condition:
+                if not self.stop_event.is_set() and len(self.buffer) < self.batch_size:
+                    # wake up more often while there is a backlog to replay
+                    timeout = min(self.flush_interval, 1.0) if self.spool is not None and len(self.spool) else self.flush_interval
+                    self.condition.wait(timeout)
+                stopping = self.stop_event.is_set()
+                batch = self._take_batch()
+                backlog = len(self.buffer)
+            if batch:
+                self.write_batch(batch)
+            elif stopping:
+                break
+            if self.spool is not None and not stopping and backlog < self.batch_size:
+                self.replay_spool()
+        logger.info("Stopped influx batch writer")
+
+    def _take_batch(self) -> list[str]:
+        """Pop up to batch_size points from the buffer, must hold the condition."""
+        count = min(len(self.buffer), self.batch_size)
+        return [self.buffer.popleft() for _ in range(count)]
+
+    def write_batch(self, batch: list[str]) -> bool:
+        """Write a batch to Influx, retrying with exponential backoff."""
+        delay = self.retry_backoff
+        if self.spool is not None and not self.healthy and monotonic() < self.next_probe:
+            # Influx is known to be down, don't wait for the retries
+            self._spool(batch)
+            return False
+        # a single probe is enough to tell if Influx is back
+        max_retries = self.max_retries if self.healthy else 0
+        for attempt in range(max_retries + 1):
+            try:
+                start = monotonic()
+                self.write_api.write(bucket=self.bucket_name, record=batch)
+                metrics.INFLUX_BATCH_WRITE_SECONDS.observe(monotonic() - start)
+                logger.debug(f"Wrote {len(batch)} points to Influx")
+                self._mark_healthy(True)
+                return True
+            except Exception as e:
+                if attempt == max_retries:
+                    self._mark_healthy(False)
+                    if self.spool is not None:
+                        logger.warning(f"Spooling {len(batch)} points after {attempt + 1} failed writes to Influx: {str(e)}")
+                        self._spool(batch)
+                        return False
+                    config.capture_exception(e)
+                    logger.error(f"Dropping {len(batch)} points after {attempt + 1} failed writes to Influx: {str(e)}")
+                    return False
+                logger.warning(f"Error writing {len(batch)} points to Influx, retrying in {delay} seconds: {str(e)}")
+                # don't wait between the retries when draining on shutdown
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+        return False
+
+    def _spool(self, batch: list[str]):
+        """Store a batch in the spool, keeping it in the buffer if the spool fails, e.g. on a full disk."""
+        try:
+            self.spool.put(batch)
+            return
+        except Exception as e:
+            config.capture_exception(e)
+            hot_path_logger.error("Failed to spool %d points, keeping them in memory: %s", len(batch), e)
+        if self.stop_event.is_set():
+            self.dropped_points += len(batch)
+            return
+        with self.condition:
+            # the batch is older than the buffered points, the oldest are dropped when it's full
+            room = self.buffer.maxlen - len(self.buffer)
+            if room < len(batch):
+                self.dropped_points += len(batch) - room
+                batch = batch[len(batch) - room:] if room > 0 else []
+            self.buffer.extendleft(reversed(batch))
+        # don't retry the spool at full speed
+        self.stop_event.wait(self.retry_backoff)
+
+    def _mark_healthy(self, healthy: bool):
+        """Track if Influx is reachable."""
+        if healthy and not self.healthy:
+            logger.info("Influx is reachable again")
+        elif not healthy:
+            if self.healthy:
+                logger.error("Influx is unreachable")
+            self.next_probe = monotonic() + self.retry_max_delay
+        self.healthy = healthy
+
+    def replay_spool(self):
+        """Replay the spooled points, oldest first, at most replay_rate points per second."""
+        now = monotonic()
+        self.replay_tokens = min(self.replay_tokens + (now - self.last_replay) * self.replay_rate, self.replay_rate)
+        self.last_replay = now
+        if not len(self.spool) or self.replay_tokens < 1:
+            return
+        if not self.healthy and now < self.next_probe:
+            return
+        try:
+            batches = self.spool.peek(int(self.replay_tokens))
+        except Exception as e:
+            config.capture_exception(e)
+            hot_path_logger.error("Failed to read the spooled points: %s", e)
+            return
+        lines = [line for _, batch in batches for line in batch]
+        try:
+            self.write_api.write(bucket=self.bucket_name, record=lines)
+        except Exception as e:
+            logger.warning(f"Error replaying {len(lines)} spooled points to Influx: {str(e)}")
+            self._mark_healthy(False)
+            return
+        self._mark_healthy(True)
+        try:
+            self.spool.remove([batch_id for batch_id, _ in batches])
+        except Exception as e:
+            # the points are written, they may be replayed again, Influx overwrites the duplicates
+            config.capture_exception(e)
+            hot_path_logger.error("Failed to remove the replayed points from the spool: %s", e)
+        self.replay_tokens -= len(lines)
+        logger.info(f"Replayed {len(lines)} spooled points to Influx, {len(self.spool)} points left")
+
+    def stop(self):
+        """Stop the thread, writing out all the buffered points first."""
+        if self.stop_event.is_set():
+            # the thread is already stopped
+            return
+
+        logger.info(f"Stopping influx batch writer, draining {len(self.buffer)} points...")
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify()
+        self.join()
+        if self.spool is not None:
+            self.spool.close()
+        if self.dropped_points:
+            logger.warning(f"Influx batch writer dropped {self.dropped_points} points on buffer overflow")
+
+
+class AggregationWindow:
+    """Running min/max/sum/count/last of the fields of one box, in a flat array."""
+
+    __slots__ = ('start', 'fields', 'slots', 'values')
+
+    # layout of the values of a field in the array
+    MIN, MAX, SUM, COUNT, LAST = range(5)
+    WIDTH = 5
+
+    def __init__(self, start: int):
+        self.start = start
+        self.fields = []
+        self.slots = {}
+        self.values = array('d')
+
+    def add(self, field: str, value: float):
+        slot = self.slots.get(field)
+        values = self.values
+        if slot is None:
+            slot = self.slots[field] = len(values)
+            self.fields.append(field)
+            values.extend((value, value, value, 1, value))
+            return
+        if value < values[slot + self.MIN]:
+            values[slot + self.MIN] = value
+        if value > values[slot + self.MAX]:
+            values[slot + self.MAX] = value
+        values[slot + self.SUM] += value
+        values[slot + self.COUNT] += 1
+        values[slot + self.LAST] = value
+
+    def stats(self):
+        """Yield (field, min, max, mean, last) of all the fields."""
+        values = self.values
+        for field in self.fields:
+            slot = self.slots[field]
+            yield (field, values[slot + self.MIN], values[slot + self.MAX],
+                   values[slot + self.SUM] / values[slot + self.COUNT], values[slot + self.LAST])
+
+
+class WindowAggregator:
+    """Per box tumbling windows over the readings.
+
+    Windows are aligned to multiples of window_ns and keyed by measurement
+    name and box ID. A window is emitted when a reading of a later window
+    arrives for the same key, or when it's expired for longer than a window
+    (the box went quiet).
+    """
+
+    def __init__(self, window_ns: int):
+        self.window_ns = window_ns
+        self.windows = {}
+
+    def add(self, key: tuple, fields: dict, ts: int) -> list[tuple[tuple, AggregationWindow]]:
+        """Add the numeric fields of a reading, returning the completed windows."""
+        start = ts - ts % self.window_ns
+        done = []
+        window = self.windows.get(key)
+        if window is not None and window.start != start:
+            done.append((key, window))
+            window = None
+        if window is None:
+            window = self.windows[key] = AggregationWindow(start)
+        for field, value in fields.items():
+            window.add(field, value)
+        return done + self.expire(ts)
+
+    def expire(self, now: int) -> list[tuple[tuple, AggregationWindow]]:
+        """Remove and return the windows that ended over a window ago."""
+        expired = [(key, window) for key, window in self.windows.items()
+                   if now - window.start >= 2 * self.window_ns]
+        for key, _ in expired:
+            del self.windows[key]
+        return expired
+
+    def flush(self) -> list[tuple[tuple, AggregationWindow]]:
+        """Remove and return all the windows."""
+        windows = list(self.windows.items())
+        self.windows.clear()
+        return windows
+
+
+# line protocol escapes, see influxdb_client.client.write.point
+_LINE_KEY_ESCAPES = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n', '\r': r'\r', '\t': r'\t'})
+_LINE_STRING_ESCAPES = str.maketrans({'"': r'\"', '\\': r'\\'})
+
+
+def line_protocol_value(value) -> str | None:
+    """Format a field value as line protocol, None for the values to leave out."""
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return None
+        text = repr(value)
+        # whole numbers are written without the trailing .0, like Point does
+        return text[:-2] if text.endswith('.0') else text
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, str):
+        return f'"{value.translate(_LINE_STRING_ESCAPES)}"'
+    if value is None:
+        return None
+    raise ValueError(f'Type: "{type(value)}" of field value: "{value}" is not supported.')
+
+
+def line_protocol_float(value) -> str | None:
+    """Format a field value converted to float, the common case, without the type checks."""
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+
+class InfluxSchema:
+    """Converter of the readings with a given set of keys to Influx fields.
+
+    Compiled once per set of keys, with the Influx key and the converter of
+    each field looked up ahead, so converting a reading is a single loop.
+    The keys without an Influx key are left out, see unknown_keys.
+    """
+
+    __slots__ = ('fields', 'unknown_keys')
+
+    def __init__(self, keys: tuple, keys_map: dict, keys_types: dict):
+        self.unknown_keys = []
+        fields = []
+        for key in keys:
+            if key == "ID":
+                continue
+            influx_key = keys_map.get(key)
+            if not influx_key:
+                self.unknown_keys.append(key)
+                continue
+            convert = keys_types.get(key)
+            fields.append((
+                influx_key,
+                key,
+                convert,
+                f'{influx_key.translate(_LINE_KEY_ESCAPES)}=',
+                line_protocol_float if convert is float else line_protocol_value,
+            ))
+        # sorted by the influx key, like Point does
+        fields.sort()
+        self.fields = fields
+
+    def to_fields(self, data: dict) -> dict:
+        """Convert the reading to a dict of Influx fields."""
+        fields = {}
+        for influx_key, key, convert, _, _ in self.fields:
+            value = data[key]
+            fields[influx_key] = convert(value) if convert else value
+        return fields
+
+    def to_line_fields(self, data: dict) -> str:
+        """Convert the reading to the field set of a line protocol point."""
+        parts = []
+        for _, key, _, prefix, format_value in self.fields:
+            value = format_value(data[key])
+            if value is not None:
+                parts.append(prefix + value)
+        return ','.join(parts)
+
 
 class InfluxDataLogger(DataLoggerBase):
     """Serial data handler, writing to Influx DB.
 
     handle_data method is called for each line of data received from the serial port.
     It will deserialize the data into a dict and write it to Influx.
+
+    With an aggregate window set, the readings are reduced per box to
+    <field>_min, <field>_max, <field>_mean and <field>_last fields, written
+    once per window with the window start time.
     """
 
+    AGGREGATE_STATS = ("min", "max", "mean", "last")
+
     INFLUX_KEYS_MAP = {
         "ID": "box_id",
         "co2": "co2",
@@ -104,6 +693,9 @@ class InfluxDataLogger(DataLoggerBase):
     BOX_MEASURMENT_NAME = "arduino_box_data"
     AMBIENT_MEASURMENT_NAME = "ambient_data"
 
+    # bound of the compiled schemas and line prefixes, against garbage on the lines
+    MAX_CACHED_SCHEMAS = 256
+
     def __init__(
             self,
             db_host: str = config.INFLUXDB_HOST,
@@ -111,23 +703,79 @@ class InfluxDataLogger(DataLoggerBase):
             bucket_name: str = config.INFLUXDB_BUCKET,
             token: str = config.INFLUXDB_TOKEN,
             org: str = config.INFLUXDB_ORG,
+            batching: bool = config.INFLUX_BATCHING,
+            spool_enabled: bool = config.INFLUX_SPOOL_ENABLED,
+            aggregate_window: float = config.INFLUX_AGGREGATE_WINDOW,
+            gzip: bool = config.INFLUX_GZIP,
     ):
         self.db_host = db_host
         self.db_port = db_port
         self.bucket_name = bucket_name
         self.token = token
         self.org = org
-        logger.info("Creating influxdb client.")
+        self.gzip = gzip
         if not self.token:
             logger.error("Influxdb token is not provided. Please put your token "
                          "into INFLUXDB_TOKEN env variable and restart the app.")
             sys.exit(1)
-        self.client = InfluxDBClient(
-            url=f"http://{self.db_host}:{self.db_port}",
-            token=self.token,
-            org=self.org
-        )
-        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+        # the client is created on the first write, off the startup path
+        self.client_lock = threading.Lock()
+        self._client = None
+        self._write_api = None
+        self.batch_writer = None
+        if batching:
+            # write off the consumer thread, so a slow Influx doesn't block
+            # the other data handlers
+            spool = InfluxSpool() if spool_enabled else None
+            self.batch_writer = InfluxBatchWriter(DeferredWriteApi(self), self.bucket_name, spool=spool)
+            self.batch_writer.start()
+        self.aggregator = None
+        if aggregate_window:
+            self.aggregator = WindowAggregator(int(aggregate_window * 1e9))
+        # tuple of the reading keys -> InfluxSchema
+        self.schemas = {}
+        # unknown keys already reported, the readings thinned out by the deadband filter have many schemas
+        self.reported_unknown_keys = set()
+        # box id -> measurement name, box id tag and the line prefix
+        self.line_prefixes = {}
+
+    @property
+    def client(self) -> 'InfluxDBClient':
+        """The Influx client, created on first use."""
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    from influxdb_client import InfluxDBClient
+                    logger.info("Creating influxdb client.")
+                    self._client = InfluxDBClient(
+                        url=f"http://{self.db_host}:{self.db_port}",
+                        token=self.token,
+                        org=self.org,
+                        enable_gzip=self.gzip,
+                    )
+        return self._client
+
+    @property
+    def write_api(self):
+        """The synchronous write API of the client, created on first use."""
+        if self._write_api is None:
+            from influxdb_client.client.write_api import SYNCHRONOUS
+            write_api = self.client.write_api(write_options=SYNCHRONOUS)
+            with self.client_lock:
+                if self._write_api is None:
+                    self._write_api = write_api
+        return self._write_api
+
+    @write_api.setter
+    def write_api(self, write_api):
+        self._write_api = write_api
+
+    def connect(self):
+        """Create the client ahead of the first write, e.g. on a background thread."""
+        try:
+            self.write_api
+        except Exception as e:
+            logger.warning(f"Error creating the influxdb client: {str(e)}")
 
     def _get_measurement_name(self, box_id: int|str) -> str:
         """Get the measurement name for the given box id."""
@@ -140,37 +788,109 @@ class InfluxDataLogger(DataLoggerBase):
         else:
             return self.BOX_MEASURMENT_NAME
 
-    def log_results(self, data: dict):
+    def log_results(self, data: dict, ts: int):
         """Write the results to influx"""
         box_id = data.get("ID")
         if not id:
-            logger.error(f"Missing ID in data: {data}")
+            hot_path_logger.error("Missing ID in data: %s", data)
             return
         try:
+            schema = self._get_schema(data)
+            measurement_name, box_tag, line_prefix = self._get_line_prefix(box_id)
+
+            if self.aggregator:
+                numeric = {k: float(v) for k, v in schema.to_fields(data).items()
+                           if isinstance(v, (int, float)) and not isinstance(v, bool)}
+                for key, window in self.aggregator.add((measurement_name, box_tag), numeric, ts):
+                    self._write_point(self._aggregate_point(key, window))
+                return
+
+            line_fields = schema.to_line_fields(data)
+            if not line_fields:
+                hot_path_logger.warning("No fields to write to Influx in data: %s", data)
+                return
+            self._write_line(f"{line_prefix}{line_fields} {ts}")
+        except Exception as e:
+            config.capture_exception(e)
+            hot_path_logger.exception("Error writing data to Influx: %s", e)
+
+    def to_line_protocol(self, data: dict, ts: int) -> str | None:
+        """Convert a reading to a line protocol point, None if it has no fields to write."""
+        line_fields = self._get_schema(data).to_line_fields(data)
+        if not line_fields:
+            return None
+        return f"{self._get_line_prefix(data['ID'])[2]}{line_fields} {ts}"
+
+    def _get_schema(self, data: dict) -> InfluxSchema:
+        """Get the compiled schema of the reading, compiling it on first sight."""
+        keys = tuple(data)
+        schema = self.schemas.get(keys)
+        if schema is None:
+            if len(self.schemas) >= self.MAX_CACHED_SCHEMAS:
+                self.schemas.clear()
+                self.reported_unknown_keys.clear()
+            schema = self.schemas[keys] = InfluxSchema(keys, self.INFLUX_KEYS_MAP, self.INFLUX_KEYS_TYPES)
+            if schema.unknown_keys and frozenset(schema.unknown_keys) not in self.reported_unknown_keys:
+                # reported once instead of on every line
+                self.reported_unknown_keys.add(frozenset(schema.unknown_keys))
+                logger.error(f"Could not find influx keys for columns: {schema.unknown_keys}, "
+                             f"ignoring them in the data with keys: {list(keys)}")
+        return schema
+
+    def _get_line_prefix(self, box_id: int | str) -> tuple[str, str, str]:
+        """Get the measurement name, box id tag and line protocol prefix of the box."""
+        prefix = self.line_prefixes.get(box_id)
+        if prefix is None:
+            if len(self.line_prefixes) >= self.MAX_CACHED_SCHEMAS:
+                self.line_prefixes.clear()
             measurement_name = self._get_measurement_name(box_id)
+            box_tag = str(box_id)
+            escaped_tag = box_tag.translate(_LINE_KEY_ESCAPES)
+            if escaped_tag.endswith('\\'):
+                escaped_tag += ' '
+            prefix = self.line_prefixes[box_id] = (
+                measurement_name, box_tag, f"{measurement_name},box_id={escaped_tag} ")
+        return prefix
+
+    def _aggregate_point(self, key: tuple, window: AggregationWindow) -> 'Point':
+        """Build the point of an aggregation window."""
+        from influxdb_client import Point
+        measurement_name, box_id = key
+        point = Point(measurement_name) \
+            .tag("box_id", box_id) \
+            .time(window.start)
+        for field, *stats in window.stats():
+            for stat, value in zip(self.AGGREGATE_STATS, stats):
+                point = point.field(f"{field}_{stat}", value)
+        return point
+
+    def _write_point(self, point: 'Point'):
+        """Queue the point for the batch writer, or write it right away."""
+        self._write_line(point.to_line_protocol())
+
+    def _write_line(self, line: str):
+        """Queue the line protocol point for the batch writer, or write it right away."""
+        if self.batch_writer:
+            self.batch_writer.add(line)
+            hot_path_logger.debug("Queued point for Influx: %s", line)
+            return
 
-            point = Point(measurement_name) \
-                .tag("box_id", box_id) \
-                .time(time_ns())
-
-            # iterate over all the columns and add them to the point
-            for key, value in data.items():
-                if key == "ID":
-                    continue
-                influx_key = self.INFLUX_KEYS_MAP.get(key)
-                if not influx_key:
-                    logger.error(f"Could not find influx key for column: {key}")
-                    continue
-                # convert the value to the correct type
-                if key in self.INFLUX_KEYS_TYPES:
-                    value = self.INFLUX_KEYS_TYPES[key](value)
-                point = point.field(influx_key, value)
-
-            self.write_api.write(bucket=self.bucket_name, record=point)
-            logger.info(f"Wrote data to Influx: {data}")
-        except Exception as e:
-            sentry_sdk.capture_exception(e)
-            logger.exception(f"Error writing data to Influx: {str(e)}")
+        self.write_api.write(bucket=self.bucket_name, record=line)
+        hot_path_logger.info("Wrote point to Influx: %s", line)
+
+    def close(self):
+        """Flush the buffered points and close the client."""
+        if self.aggregator:
+            for key, window in self.aggregator.flush():
+                try:
+                    self._write_point(self._aggregate_point(key, window))
+                except Exception as e:
+                    config.capture_exception(e)
+                    logger.exception(f"Error writing data to Influx: {str(e)}")
+        if self.batch_writer:
+            self.batch_writer.stop()
+        if self._client is not None:
+            self._client.close()
 
 
 class RotatingFileDataLogger(DataLoggerBase):
@@ -179,13 +899,18 @@ class RotatingFileDataLogger(DataLoggerBase):
     handle_data method is called for each line of data received from the serial port.
     It will deserialize the data into a dict and write it to a file.
 
+    The query index of the file is extended every index_interval seconds,
+    and completed when the file is rotated, so the queries only index the
+    lines written since.
     """
 
     FILE_NAME = "data.log"
 
-    def __init__(self, log_path: str = config.DATA_LOG_PATH):
+    def __init__(self, log_path: str = config.DATA_LOG_PATH, index_interval: int = config.FILE_LOG_INDEX_INTERVAL):
         logger.info(f"Creating file data logger, log path: {log_path}")
         self.log_path = log_path
+        self.index_interval = index_interval
+        self.last_index = monotonic()
         if not os.path.exists(self.log_path):
             os.makedirs(self.log_path)
         self.file_path = os.path.join(self.log_path, self.FILE_NAME)
@@ -195,13 +920,36 @@ class RotatingFileDataLogger(DataLoggerBase):
         file_handler = logging.handlers.TimedRotatingFileHandler(
             self.file_path, when='midnight', interval=1, backupCount=7)
         file_handler.setLevel(logging.INFO)
+        if self.index_interval:
+            file_handler.rotator = self.rotate
         # create formatter, to write the data as json
         formatter = logging.Formatter('%(message)s')
         file_handler.setFormatter(formatter)
         self.data_logger.addHandler(file_handler)
         logger.info(f"File data logger created, log file path: {self.file_path}")
 
-    def log_results(self, data: dict):
+    def log_results(self, data: dict, ts: int):
         """Write the results to a file."""
-        data["ts"] = time_ns()
+        # the data is shared with the other data loggers, don't modify it
+        data = dict(data, ts=ts)
         self.data_logger.info(json.dumps(data))
+        if self.index_interval and monotonic() - self.last_index >= self.index_interval:
+            self.last_index = monotonic()
+            self.update_index(self.file_path)
+
+    def update_index(self, path: str):
+        """Index the lines written to the file since the last update."""
+        # the query module imports this one
+        import query
+        try:
+            query.LogIndex(path).update()
+        except Exception as e:
+            config.capture_exception(e)
+            logger.exception(f"Failed to update the index of {path}: {str(e)}")
+
+    def rotate(self, source: str, dest: str):
+        """Rotate the file, its complete index is moved along."""
+        import query
+        self.update_index(source)
+        os.rename(source, dest)
+        query.adopt_rotated_index(dest, source)
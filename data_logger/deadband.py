@@ -0,0 +1,107 @@
+"""Deadband filter, dropping the fields that did not change from the readings."""
+import math
+from array import array
+
+import config
+import metrics
+
+
+def parse_tolerances(spec: str) -> dict[str, float]:
+    """Parse a field=tolerance,field=tolerance list, as in DEADBAND_TOLERANCES."""
+    tolerances = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        field, _, tolerance = item.rpartition('=')
+        if not field:
+            raise ValueError(f"Invalid deadband tolerance {item!r}, expected field=tolerance")
+        tolerances[field.strip()] = float(tolerance)
+    return tolerances
+
+
+class BoxDeadband:
+    """Last sent values of the filtered fields of a box, NaN when unknown."""
+
+    __slots__ = ('keyframe_ts', 'values')
+
+    def __init__(self, keyframe_ts: int, values: array):
+        self.keyframe_ts = keyframe_ts
+        self.values = values
+
+
+class DeadbandFilter:
+    """Per box deadband over the numeric fields of the readings.
+
+    A field with a tolerance is dropped from a reading while it stays
+    within the tolerance of the last value sent for the box, so a slow
+    drift is still sent once it adds up. The other fields and the
+    required columns are always kept. Every keyframe_interval seconds a
+    box sends a full reading, so the values can be reconstructed by
+    carrying the last value forward from the previous keyframe.
+    """
+
+    # bound of the box states, against garbage IDs on the lines
+    MAX_BOXES = 256
+
+    def __init__(
+            self,
+            tolerances: dict[str, float],
+            keyframe_interval: float = config.DEADBAND_KEYFRAME_INTERVAL,
+            keep_columns: tuple | list = ('ID',),
+    ):
+        fields = [field for field in tolerances if field not in keep_columns]
+        self.slots = {field: slot for slot, field in enumerate(fields)}
+        self.tolerances = [float(tolerances[field]) for field in fields]
+        self.empty_values = array('d', [math.nan]) * len(fields)
+        self.keyframe_ns = int(keyframe_interval * 1e9)
+        self.keep_columns = frozenset(keep_columns)
+        self.boxes = {}
+        self.dropped_fields = metrics.DEADBAND_DROPPED_FIELDS.labels()
+        self.dropped_readings = metrics.DEADBAND_DROPPED_READINGS.labels()
+
+    def apply(self, data: dict, ts: int) -> dict | None:
+        """Filter a reading, returning None if nothing but the kept columns changed."""
+        box_id = data.get('ID')
+        box = self.boxes.get(box_id)
+        if box is None or not 0 <= ts - box.keyframe_ts < self.keyframe_ns:
+            self._keyframe(box_id, data, ts)
+            return data
+
+        slots = self.slots
+        tolerances = self.tolerances
+        values = box.values
+        filtered = {}
+        changed = False
+        for field, value in data.items():
+            slot = slots.get(field)
+            if slot is None:
+                changed = changed or field not in self.keep_columns
+            else:
+                try:
+                    if -tolerances[slot] <= value - values[slot] <= tolerances[slot]:
+                        continue
+                    values[slot] = value
+                except (TypeError, OverflowError):
+                    # not a number, always kept and compared as unknown next time
+                    values[slot] = math.nan
+                changed = True
+            filtered[field] = value
+        dropped = len(data) - len(filtered)
+        if dropped:
+            self.dropped_fields.inc(dropped)
+        if not changed:
+            self.dropped_readings.inc()
+            return None
+        return filtered
+
+    def _keyframe(self, box_id, data: dict, ts: int):
+        """Start over from a full reading of the box."""
+        if box_id not in self.boxes and len(self.boxes) >= self.MAX_BOXES:
+            self.boxes.clear()
+        values = array('d', self.empty_values)
+        for field, slot in self.slots.items():
+            try:
+                values[slot] = data.get(field, math.nan)
+            except (TypeError, OverflowError):
+                pass
+        self.boxes[box_id] = BoxDeadband(ts, values)
@@ -0,0 +1,131 @@
+"""Serial port hotplug event sources.
+
+The serial port monitor rescans the ports as soon as a hotplug event
+arrives, instead of waiting for the next periodic scan.
+"""
+import glob
+import os
+import threading
+
+import config
+from config import logger
+
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
+
+HOTPLUG_ADD = "add"
+HOTPLUG_REMOVE = "remove"
+
+
+def stable_port_names(links_glob: str = config.PORT_LINKS_GLOB) -> dict[str, str]:
+    """Map the device paths to the stable symlinks created by the udev rules.
+
+    See automation/99-usb-ports-nuc.rules, e.g. /dev/ttyACM0 -> /dev/box_2.
+    """
+    names = {}
+    if not links_glob:
+        return names
+    for link in sorted(glob.glob(links_glob)):
+        names[os.path.realpath(link)] = link
+    return names
+
+
+class HotplugEventSource:
+    """Base class for the hotplug event sources.
+
+    The callback is called with the action (add or remove) and the device
+    path, from the event source thread. It must not block.
+    """
+
+    def __init__(self):
+        self.callback = None
+
+    def start(self, callback: callable):
+        """Start delivering the events to the callback."""
+        self.callback = callback
+
+    def stop(self):
+        """Stop delivering the events."""
+        self.callback = None
+
+    def emit(self, action: str, device: str):
+        """Deliver an event to the callback."""
+        if self.callback:
+            logger.info(f"Hotplug event: {action} {device}")
+            self.callback(action, device)
+
+
+class UdevEventSource(HotplugEventSource):
+    """Hotplug events of the tty subsystem, from the udev netlink socket."""
+
+    def __init__(self):
+        super().__init__()
+        self.observer = None
+
+    def start(self, callback: callable):
+        super().start(callback)
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by(subsystem='tty')
+        self.observer = pyudev.MonitorObserver(monitor, callback=self._handle_device, name="UdevEventSource")
+        self.observer.daemon = True
+        self.observer.start()
+        logger.info("Started udev hotplug event source")
+
+    def _handle_device(self, device):
+        if device.action in (HOTPLUG_ADD, HOTPLUG_REMOVE) and device.device_node:
+            self.emit(device.action, device.device_node)
+
+    def stop(self):
+        if self.observer:
+            self.observer.send_stop()
+            self.observer = None
+        super().stop()
+
+
+class SimulatedEventSource(HotplugEventSource):
+    """Event source driven by hand, for tests and simulated boxes.
+
+    Events emitted before start() are delivered once it is called.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending = []
+
+    def start(self, callback: callable):
+        super().start(callback)
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for action, device in pending:
+            self.emit(action, device)
+
+    def emit(self, action: str, device: str):
+        with self.lock:
+            if not self.callback:
+                self.pending.append((action, device))
+                return
+        super().emit(action, device)
+
+
+def create_event_source(backend: str = config.HOTPLUG_BACKEND) -> HotplugEventSource | None:
+    """Create the configured hotplug event source.
+
+    Returns None if hotplug events are disabled or not available, the
+    periodic port scan is used alone then.
+    """
+    if backend == 'none':
+        return None
+    if pyudev is None:
+        if backend == 'udev':
+            logger.error("pyudev is not installed, falling back to the periodic port scan")
+        return None
+    try:
+        return UdevEventSource()
+    except Exception as e:
+        logger.exception(f"Failed to create the udev event source: {str(e)}")
+        return None
@@ -0,0 +1,219 @@
+"""Liveness of the boxes and the serial ports, from their valid readings."""
+import threading
+import time
+
+import config
+import metrics
+from config import logger
+
+
+class TimerWheel:
+    """Hashed timer wheel, scheduling and expiring the timers in O(1).
+
+    The timers are spread over the slots by their deadline tick. A timer
+    further out than a turn of the wheel stays in its slot and is skipped
+    until its turn comes.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, now: float = None):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current_tick = int((time.monotonic() if now is None else now) / tick)
+
+    def schedule(self, key, deadline: float):
+        """Add a timer, expiring at the deadline, in monotonic time."""
+        tick = max(int(deadline / self.tick) + 1, self.current_tick + 1)
+        self.slots[tick % len(self.slots)].append((deadline, key))
+
+    def advance(self, now: float) -> list:
+        """Move the wheel to now, returning the keys of the expired timers."""
+        expired = []
+        now_tick = int(now / self.tick)
+        # after a long pause every slot is visited once
+        first_tick = max(self.current_tick + 1, now_tick - len(self.slots) + 1)
+        for tick in range(first_tick, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            pending = []
+            for deadline, key in slot:
+                if deadline <= now:
+                    expired.append(key)
+                else:
+                    pending.append((deadline, key))
+            slot[:] = pending
+        self.current_tick = max(self.current_tick, now_tick)
+        return expired
+
+
+class LivenessTracker(threading.Thread):
+    """Tracks the last valid reading of every box ID and port.
+
+    seen() is called by the queue reader for every valid reading, it only
+    records the time, the deadlines are checked by this thread on a timer
+    wheel, a timer is re-armed from the last reading time when it expires.
+    A box or port missing the timeout escalates one step per timeout:
+
+    1. the port is reopened, which also resets most Arduino boards,
+    2. an alert is sent to Sentry,
+    3. the systemd status lists the stale boxes and ports.
+
+    The first reading afterwards resets the escalation. Ports are watched
+    from the start of their reader, so a box stuck before its first
+    reading (e.g. looping on the time sync) is caught too.
+    """
+
+    REOPEN, ALERT, STATUS = range(1, 4)
+    STATUS_OK = "Receiving data from all boxes"
+
+    def __init__(
+            self,
+            reopen_port: callable = None,
+            timeout: float = config.LIVENESS_TIMEOUT,
+            tick: float = 1.0,
+    ):
+        super().__init__(name="LivenessTracker", daemon=True)
+        self.reopen_port = reopen_port
+        self.timeout = timeout
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.wheel = TimerWheel(tick, slots=max(8, int(timeout / tick) * 2))
+        # ('box', ID) or ('port', name) -> monotonic time of the last reading
+        self.last_seen = {}
+        # box ID -> port of its last reading
+        self.box_ports = {}
+        # key -> escalation steps taken, for the stale keys
+        self.stale = {}
+        # stale keys alerted, the ports with a known box are alerted as the box
+        self.alerted = set()
+        self.armed = set()
+        # port -> monotonic time it was last reopened
+        self.reopened = {}
+        metrics.STALE_SOURCES.set_function(lambda: len(self.stale))
+
+    def seen(self, box_id, port: str):
+        """Record a valid reading of a box on a port."""
+        now = time.monotonic()
+        box_key = ('box', box_id)
+        port_key = ('port', port)
+        new = box_key not in self.last_seen or port_key not in self.last_seen
+        self.last_seen[box_key] = now
+        self.last_seen[port_key] = now
+        self.box_ports[box_id] = port
+        if new or box_key in self.stale or port_key in self.stale:
+            self._refresh(now, box_key, port_key)
+
+    def watch_port(self, port: str):
+        """Start watching a port, before its first reading."""
+        with self.lock:
+            key = ('port', port)
+            if key not in self.last_seen:
+                self.last_seen[key] = time.monotonic()
+                self._arm(key, self.last_seen[key] + self.timeout)
+
+    def forget_port(self, port: str):
+        """Stop watching a port that is gone, its boxes are still watched."""
+        with self.lock:
+            key = ('port', port)
+            self.last_seen.pop(key, None)
+            self.reopened.pop(port, None)
+            self.stale.pop(key, None)
+            if key in self.alerted:
+                self.alerted.discard(key)
+                self._notify_status()
+
+    def _refresh(self, now: float, *keys):
+        """Arm the timers of the new keys and reset the stale ones."""
+        with self.lock:
+            for key in keys:
+                steps = self.stale.pop(key, None)
+                if steps is not None:
+                    logger.info(f"{self._describe(key)} is sending data again")
+                    if key in self.alerted:
+                        self.alerted.discard(key)
+                        config.capture_message(f"{self._describe(key)} is sending data again", level='info')
+                        if steps >= self.STATUS:
+                            self._notify_status()
+                self._arm(key, now + self.timeout)
+
+    def _arm(self, key, deadline: float):
+        """Schedule the timer of the key, unless it already has one, must hold the lock."""
+        if key not in self.armed:
+            self.armed.add(key)
+            self.wheel.schedule(key, deadline)
+
+    def run(self):
+        """Main thread entry point."""
+        logger.info(f"Starting liveness tracker, timeout {self.timeout:g} seconds...")
+        while not self.stop_event.wait(self.wheel.tick):
+            try:
+                self.check(time.monotonic())
+            except Exception as e:
+                config.capture_exception(e)
+                logger.exception(f"Error checking the liveness: {str(e)}")
+        logger.info("Stopped liveness tracker")
+
+    def check(self, now: float):
+        """Expire the timers and escalate the keys that missed their deadline."""
+        actions = []
+        with self.lock:
+            for key in self.wheel.advance(now):
+                self.armed.discard(key)
+                last_seen = self.last_seen.get(key)
+                if last_seen is None:
+                    # forgotten port
+                    continue
+                steps = self.stale.get(key, 0)
+                deadline = last_seen + self.timeout * (steps + 1)
+                if now < deadline:
+                    self._arm(key, deadline)
+                    continue
+                steps = self.stale[key] = steps + 1
+                actions.append((key, steps, now - last_seen))
+                if steps < self.STATUS:
+                    self._arm(key, last_seen + self.timeout * (steps + 1))
+        for key, steps, silent in actions:
+            self.escalate(key, steps, silent)
+
+    def escalate(self, key, steps: int, silent: float):
+        """Take the escalation step of a stale box or port."""
+        description = self._describe(key)
+        if steps == self.REOPEN:
+            logger.warning(f"{description} sent no data for {silent:.0f} seconds, reopening the port")
+            port = key[1] if key[0] == 'port' else self.box_ports.get(key[1])
+            now = time.monotonic()
+            # a box and its port go stale together, reopen the port once
+            if port and self.reopen_port and now - self.reopened.get(port, -self.timeout) >= self.timeout:
+                self.reopened[port] = now
+                self.reopen_port(port)
+        elif steps == self.ALERT:
+            if key[0] == 'port' and any(p == key[1] for p in self.box_ports.values()):
+                # the alert is sent for the box of the port
+                return
+            logger.error(f"{description} sent no data for {silent:.0f} seconds")
+            with self.lock:
+                self.alerted.add(key)
+            config.capture_message(f"{description} stopped sending data")
+        elif steps == self.STATUS and key in self.alerted:
+            with self.lock:
+                self._notify_status()
+
+    def _describe(self, key) -> str:
+        if key[0] == 'box':
+            return f"Box {key[1]} on {self.box_ports.get(key[1])}"
+        return f"Port {key[1]}"
+
+    def _notify_status(self):
+        """Report the stale boxes and ports in the systemd status, must hold the lock."""
+        stale = sorted(f"{kind} {name}" for (kind, name), steps in self.stale.items()
+                       if steps >= self.STATUS and (kind, name) in self.alerted)
+        if stale:
+            config.notify_systemd(f"STATUS=No data from {', '.join(stale)}")
+        else:
+            config.notify_systemd(f"STATUS={self.STATUS_OK}")
+
+    def stop(self):
+        """Stop the thread."""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
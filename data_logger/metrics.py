@@ -0,0 +1,368 @@
+"""In-process metrics, exposed over HTTP in the Prometheus text format.
+
+The metrics are updated on the hot paths (every serial read, every line),
+so updating them takes no lock: every thread updates its own cell of a
+metric and a scrape sums the cells. A cell only has one writer, so no
+update is lost even though += is not atomic. The registry lock is only
+taken when a thread or a label set is seen for the first time.
+
+The worker processes of the supervisor send snapshots of their counters
+and gauges, which are added to the metrics of the supervisor process.
+The histograms stay in the process that observed them.
+
+Example, scraped with curl::
+
+    curl http://127.0.0.1:9464/metrics
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+from time import monotonic
+
+import config
+from config import logger
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_LABEL_ESCAPES = str.maketrans({'\\': r'\\', '"': r'\"', '\n': r'\n'})
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    pairs = [f'{n}="{str(v).translate(_LABEL_ESCAPES)}"' for n, v in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one cell per updating thread.
+
+    The counter names end with _total, the name of their sample.
+    """
+
+    def __init__(self, lock: threading.Lock):
+        self._lock = lock
+        self._cells = {}
+
+    def _cell(self) -> list:
+        ident = threading.get_ident()
+        cell = self._cells.get(ident)
+        if cell is None:
+            with self._lock:
+                cell = self._cells.setdefault(ident, [0])
+        return cell
+
+    def inc(self, amount: int | float = 1):
+        self._cell()[0] += amount
+
+    @property
+    def value(self) -> int | float:
+        return sum(cell[0] for cell in list(self._cells.values()))
+
+    def samples(self, name: str, labels: str):
+        yield f'{name}{labels}', self.value
+
+
+class Gauge:
+    """Value set by hand, or read from a function on every scrape."""
+
+    def __init__(self, lock: threading.Lock):
+        self._value = 0
+        self._function = None
+
+    def set(self, value: int | float):
+        self._value = value
+
+    def set_function(self, function: callable):
+        """Read the value from the function, e.g. a queue size."""
+        self._function = function
+
+    @property
+    def value(self) -> int | float:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def samples(self, name: str, labels: str):
+        yield f'{name}{labels}', self.value
+
+
+class Histogram:
+    """Distribution of observed values, e.g. durations in seconds."""
+
+    def __init__(self, lock: threading.Lock, buckets: tuple = DEFAULT_BUCKETS):
+        self._lock = lock
+        self.buckets = tuple(sorted(buckets))
+        # per thread: a count per bucket and +Inf, then the sum
+        self._cells = {}
+
+    def _cell(self) -> list:
+        ident = threading.get_ident()
+        cell = self._cells.get(ident)
+        if cell is None:
+            with self._lock:
+                cell = self._cells.setdefault(ident, [0] * (len(self.buckets) + 2))
+        return cell
+
+    def observe(self, value: float):
+        cell = self._cell()
+        cell[bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self) -> 'HistogramTimer':
+        """Context manager observing the duration of the block."""
+        return HistogramTimer(self)
+
+    def samples(self, name: str, labels: str):
+        totals = [0] * (len(self.buckets) + 2)
+        for cell in list(self._cells.values()):
+            for i, value in enumerate(cell):
+                totals[i] += value
+        cumulative = 0
+        label_pairs = labels[1:-1] if labels else ''
+        for bound, count in zip((*self.buckets, float('inf')), totals):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            yield f'{name}_bucket{{{label_pairs + "," if label_pairs else ""}{le}}}', cumulative
+        yield f'{name}_sum{labels}', totals[-1]
+        yield f'{name}_count{labels}', cumulative
+
+
+class HistogramTimer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(monotonic() - self.start)
+
+
+class MetricFamily:
+    """A metric and its children, one per set of label values.
+
+    Look the child up once and keep it when updating it on a hot path,
+    e.g. ``lines = SERIAL_LINES.labels(port_name)``.
+    """
+
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: tuple, factory: callable):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._children = {}
+        # values of the other processes by source, and of the sources that exited
+        self._remote = {}
+        self._retired = {}
+        if not labelnames:
+            self._children[()] = factory(self._lock)
+
+    def labels(self, *values):
+        """Child metric of the label values."""
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._factory(self._lock)
+        return child
+
+    def remove(self, *values):
+        """Forget the child of the label values, e.g. of a removed port."""
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def __getattr__(self, attr):
+        # metrics without labels are updated through the family
+        if not self.labelnames and attr in ('inc', 'set', 'set_function', 'observe', 'time', 'value'):
+            return getattr(self._children[()], attr)
+        raise AttributeError(attr)
+
+    def snapshot(self) -> dict[tuple, int | float]:
+        """Values by label values, of the counters and gauges of this process."""
+        return {values: child.value for values, child in list(self._children.items())}
+
+    def merge(self, source: str, values: dict[tuple, int | float]):
+        """Set the values of another process, added to the local values."""
+        self._remote[source] = values
+
+    def retire(self, source: str):
+        """Forget the values of a process that exited, its counts are kept."""
+        values = self._remote.pop(source, None)
+        if values and self.kind == 'counter':
+            retired = dict(self._retired)
+            for labels, value in values.items():
+                retired[labels] = retired.get(labels, 0) + value
+            self._retired = retired
+
+    def _merged_values(self) -> dict[tuple, int | float]:
+        totals = self.snapshot()
+        for values in [self._retired, *list(self._remote.values())]:
+            for labels, value in values.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        if self._remote or self._retired:
+            try:
+                for values, value in self._merged_values().items():
+                    lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}')
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {self.name}: {str(e)}")
+            return lines
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            try:
+                for sample, value in child.samples(self.name, labels):
+                    lines.append(f'{sample} {_format_value(value)}')
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {self.name}{labels}: {str(e)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metric families, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self.families = {}
+        self.lock = threading.Lock()
+
+    def _register(self, kind: str, name: str, documentation: str, labelnames: tuple, factory) -> MetricFamily:
+        with self.lock:
+            if name in self.families:
+                return self.families[name]
+            family = self.families[name] = MetricFamily(kind, name, documentation, tuple(labelnames), factory)
+            return family
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> MetricFamily:
+        if not name.endswith('_total'):
+            raise ValueError(f"Counter {name} must be named with the _total suffix")
+        return self._register('counter', name, documentation, labelnames, Counter)
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> MetricFamily:
+        return self._register('gauge', name, documentation, labelnames, Gauge)
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._register('histogram', name, documentation, labelnames,
+                              lambda lock: Histogram(lock, buckets))
+
+    def snapshot(self) -> dict[str, dict[tuple, int | float]]:
+        """Values of the counters and gauges, e.g. of a worker process for the supervisor."""
+        snapshot = {}
+        for family in list(self.families.values()):
+            if family.kind == 'histogram':
+                continue
+            try:
+                snapshot[family.name] = family.snapshot()
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {family.name}: {str(e)}")
+        return snapshot
+
+    def merge(self, source: str, snapshot: dict[str, dict[tuple, int | float]]):
+        """Add the values of the snapshot of another process to the metrics."""
+        for name, values in snapshot.items():
+            family = self.families.get(name)
+            if family is not None:
+                family.merge(source, values)
+
+    def retire(self, source: str):
+        """Forget the process that sent the snapshots, keeping its counts."""
+        for family in list(self.families.values()):
+            family.retire(source)
+
+    def render(self) -> str:
+        lines = []
+        for family in list(self.families.values()):
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+SERIAL_LINES = registry.counter('box_logger_serial_lines_total', "Lines read from the serial port.", ('port',))
+SERIAL_BYTES = registry.counter('box_logger_serial_bytes_total', "Bytes read from the serial port.", ('port',))
+PORT_RECONNECTS = registry.counter('box_logger_port_reconnects_total', "Serial port connections lost.", ('port',))
+PARSE_FAILURES = registry.counter('box_logger_parse_failures_total', "Data lines that failed to decode.", ('reason',))
+READING_QUEUE_DEPTH = registry.gauge('box_logger_reading_queue_depth', "Readings waiting to be decoded.")
+DEADBAND_DROPPED_FIELDS = registry.counter(
+    'box_logger_deadband_dropped_fields_total', "Fields dropped by the deadband filter.")
+DEADBAND_DROPPED_READINGS = registry.counter(
+    'box_logger_deadband_dropped_readings_total', "Readings dropped by the deadband filter, nothing changed.")
+SINK_QUEUE_DEPTH = registry.gauge('box_logger_sink_queue_depth', "Items waiting for the data handler.", ('sink',))
+SINK_WRITE_SECONDS = registry.histogram(
+    'box_logger_sink_write_seconds', "Time a data logger takes to handle a reading.", ('sink',))
+INFLUX_BATCH_WRITE_SECONDS = registry.histogram(
+    'box_logger_influx_batch_write_seconds', "Time of the successful batch writes to Influx.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+STALE_SOURCES = registry.gauge(
+    'box_logger_stale_sources', "Boxes and ports without a valid reading for the liveness timeout.")
+PORT_SCAN_SECONDS = registry.histogram(
+    'box_logger_port_scan_seconds', "Time of a port monitor scan, probing the new ports included.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0))
+WORKER_RESTARTS = registry.counter(
+    'box_logger_worker_restarts_total', "Worker processes started again after they exited or stopped responding.")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Metrics request: {format % args}")
+
+
+class MetricsServer(threading.Thread):
+    """HTTP server thread, serving the metrics on /metrics."""
+
+    def __init__(self, host: str = config.METRICS_HOST, port: int = config.METRICS_PORT):
+        super().__init__(name="MetricsServer", daemon=True)
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+
+    def run(self):
+        host, port = self.server.server_address[:2]
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_metrics_server() -> MetricsServer | None:
+    """Start the metrics server if enabled, a failure doesn't stop the app."""
+    if not config.METRICS_ENABLED:
+        return None
+    try:
+        server = MetricsServer()
+    except OSError as e:
+        logger.error(f"Failed to start the metrics server on {config.METRICS_HOST}:{config.METRICS_PORT}: {str(e)}")
+        return None
+    server.start()
+    return server
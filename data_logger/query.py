@@ -0,0 +1,243 @@
+"""Query and export the readings stored in the data logs.
+
+Reads the JSON lines files written by RotatingFileDataLogger (data.log and
+its daily rotated data.log.YYYY-MM-DD copies) through a sparse sidecar
+index, seeking straight to the blocks holding the requested range. The
+data logger extends the index as it writes and rotates the files, a query
+only indexes the lines written since its last update.
+
+Example, box 5 between 14:00 and 16:00 as CSV::
+
+    python query.py --box 5 --start 2026-10-13T14:00 --end 2026-10-13T16:00 --format csv
+"""
+import argparse
+import csv
+import fcntl
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+
+import config
+from columnar import SCHEMA_FIELDS
+from config import logger
+from datalog import RotatingFileDataLogger, json_loads
+
+# the indexes are kept apart, the rotating file handler would take them
+# for old data logs otherwise
+INDEX_DIR = ".index"
+INDEX_SUFFIX = ".idx"
+INDEX_VERSION = 1
+# number of lines covered by an index entry
+BLOCK_LINES = 256
+
+
+class LogIndex:
+    """Sparse index of a data log file.
+
+    The index is a JSON lines sidecar file in the .index directory next to
+    the data logs: a header with the inode of the
+    indexed file, then an entry per block of lines with the byte range, the
+    timestamp range and the box IDs of the block. The index of the active
+    data.log is extended on every use, and moved along when the file is
+    rotated, so every line is only parsed once. The app and the queries
+    update it under a file lock.
+    """
+
+    def __init__(self, data_path: str):
+        self.data_path = data_path
+        self.index_path = index_path(data_path)
+        self.inode = os.stat(data_path).st_ino
+        # loaded by update(), under the lock
+        self.entries = []
+        # if the index on disk can be extended, or must be rewritten
+        self.saved = False
+
+    @property
+    def indexed_size(self) -> int:
+        return self.entries[-1]["end"] if self.entries else 0
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                header = json.loads(f.readline())
+                if header.get("version") != INDEX_VERSION or header.get("inode") != self.inode:
+                    logger.info(f"Index {self.index_path} is stale, rebuilding it")
+                    return
+                self.entries = [json.loads(line) for line in f]
+                self.saved = True
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load index {self.index_path}, rebuilding it: {str(e)}")
+            self.entries = []
+
+    def update(self):
+        """Index the lines appended since the last update."""
+        index_dir = os.path.dirname(self.index_path)
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir, exist_ok=True)
+        with open(self.index_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have extended it since it was loaded
+            self.entries = []
+            self.saved = False
+            self._load()
+            self._update()
+
+    def _update(self):
+        size = os.path.getsize(self.data_path)
+        if size < self.indexed_size:
+            # the file was truncated, start over
+            self.entries = []
+            self.saved = False
+        if size == self.indexed_size and self.saved:
+            return
+        new_entries = []
+        with open(self.data_path, "rb") as f:
+            f.seek(self.indexed_size)
+            entry = None
+            offset = self.indexed_size
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # the line is still being written
+                    break
+                if entry is None:
+                    entry = {"offset": offset, "end": offset, "lines": 0,
+                             "min_ts": None, "max_ts": None, "boxes": []}
+                offset += len(line)
+                entry["end"] = offset
+                entry["lines"] += 1
+                try:
+                    data = json_loads(line)
+                    ts = int(data["ts"])
+                    box_id = data.get("ID")
+                except (ValueError, KeyError, TypeError):
+                    ts, box_id = None, None
+                if ts is not None:
+                    entry["min_ts"] = ts if entry["min_ts"] is None else min(entry["min_ts"], ts)
+                    entry["max_ts"] = ts if entry["max_ts"] is None else max(entry["max_ts"], ts)
+                if box_id is not None and box_id not in entry["boxes"]:
+                    entry["boxes"].append(box_id)
+                if entry["lines"] >= BLOCK_LINES:
+                    new_entries.append(entry)
+                    entry = None
+            if entry is not None:
+                new_entries.append(entry)
+        self.entries.extend(new_entries)
+        self._save(new_entries)
+
+    def _save(self, new_entries: list[dict]):
+        if self.saved:
+            with open(self.index_path, "a") as f:
+                f.writelines(json.dumps(e) + "\n" for e in new_entries)
+            return
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"version": INDEX_VERSION, "inode": self.inode}) + "\n")
+            f.writelines(json.dumps(e) + "\n" for e in self.entries)
+        os.replace(tmp_path, self.index_path)
+        self.saved = True
+
+    def blocks(self, start_ts: int, end_ts: int, boxes: set | None):
+        """Yield the (offset, end) byte ranges that may hold matching lines."""
+        for entry in self.entries:
+            if entry["min_ts"] is None or entry["max_ts"] < start_ts or entry["min_ts"] > end_ts:
+                continue
+            if boxes and not boxes.intersection(str(b) for b in entry["boxes"]):
+                continue
+            yield entry["offset"], entry["end"]
+
+
+def index_path(data_path: str) -> str:
+    """Path of the index of a data log file."""
+    log_dir, file_name = os.path.split(data_path)
+    return os.path.join(log_dir, INDEX_DIR, file_name + INDEX_SUFFIX)
+
+
+def adopt_rotated_index(data_path: str, active_path: str):
+    """Move the index of the active file along to its rotated copy."""
+    rotated_index_path = index_path(data_path)
+    active_index_path = index_path(active_path)
+    if os.path.exists(rotated_index_path) or not os.path.exists(active_index_path):
+        return
+    try:
+        with open(active_index_path) as f:
+            header = json.loads(f.readline())
+    except (OSError, ValueError):
+        return
+    if header.get("inode") == os.stat(data_path).st_ino:
+        os.replace(active_index_path, rotated_index_path)
+
+
+def data_log_files(log_path: str) -> list[str]:
+    """The data log files, the oldest first."""
+    active_path = os.path.join(log_path, RotatingFileDataLogger.FILE_NAME)
+    rotated = sorted(glob.glob(active_path + ".*"))
+    files = rotated + ([active_path] if os.path.exists(active_path) else [])
+    for path in rotated:
+        adopt_rotated_index(path, active_path)
+    # drop the indexes of the data logs removed by the rotation
+    for path in glob.glob(os.path.join(log_path, INDEX_DIR, "*" + INDEX_SUFFIX)):
+        if not os.path.exists(os.path.join(log_path, os.path.basename(path)[:-len(INDEX_SUFFIX)])):
+            os.remove(path)
+            if os.path.exists(path + ".lock"):
+                os.remove(path + ".lock")
+    return files
+
+
+def query(log_path: str, start_ts: int, end_ts: int, boxes: set | None = None):
+    """Yield the readings between the timestamps, for the given box IDs."""
+    for path in data_log_files(log_path):
+        index = LogIndex(path)
+        index.update()
+        with open(path, "rb") as f:
+            for offset, end in index.blocks(start_ts, end_ts, boxes):
+                f.seek(offset)
+                for line in f.read(end - offset).splitlines():
+                    try:
+                        data = json_loads(line)
+                        ts = int(data["ts"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if start_ts <= ts <= end_ts and (not boxes or str(data.get("ID")) in boxes):
+                        yield data
+
+
+def _parse_time(value: str) -> int:
+    return int(datetime.fromisoformat(value).timestamp() * 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and export the data logs.")
+    parser.add_argument("--start", required=True, help="start time, ISO-8601 local time")
+    parser.add_argument("--end", required=True, help="end time, ISO-8601 local time")
+    parser.add_argument("--box", action="append", help="box ID, can be repeated, all boxes by default")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv")
+    parser.add_argument("--path", default=config.DATA_LOG_PATH, help="data log directory")
+    parser.add_argument("--output", help="output file, stdout by default")
+    args = parser.parse_args()
+
+    start_ts = _parse_time(args.start)
+    end_ts = _parse_time(args.end)
+    boxes = set(args.box) if args.box else None
+
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(out, fieldnames=["ts", "time", "ID", *SCHEMA_FIELDS], extrasaction="ignore")
+            writer.writeheader()
+            for data in query(args.path, start_ts, end_ts, boxes):
+                data["time"] = datetime.fromtimestamp(data["ts"] / 1e9).isoformat()
+                writer.writerow(data)
+        else:
+            for data in query(args.path, start_ts, end_ts, boxes):
+                out.write(json.dumps(data) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,158 @@
+from datetime import datetime
+import os
+import pickle
+import re
 import sys
 import serial
 from serial.tools import list_ports
 import time
 from time import sleep
 import queue
+import selectors
 import threading
 
-import sentry_sdk
-
 import config
 import datalog
-from config import logger
+import deadband
+import hotplug
+import liveness
+import metrics
+from config import hot_path_logger, logger
+
+
+class TimeSyncResponder:
+    """Answers the time sync requests of a box.
+
+    On boot the firmware prints a sync request every 500 ms until it receives
+    an ISO-8601 timestamp, which it acknowledges with a "Received time:" line.
+    The box only reads our answer on its next poll, so the round trip to the
+    acknowledgement is mostly that wait, not the serial latency. It's logged,
+    but not used to correct the reading timestamps, the readings keep the
+    receive time taken when the line is read.
+    """
+
+    SYNC_REQUESTS = ("Serial up. Initializing.", "Still waiting for time sync.")
+    SYNC_ACK_PREFIX = "Received time: "
+
+    def __init__(self, port_name: str, retry_interval: float = config.TIME_SYNC_RETRY_INTERVAL):
+        self.port_name = port_name
+        self.retry_interval = retry_interval
+        self.last_sent_ns = None
+        self.synced = False
+
+    def handle_status_line(self, line: str, write: callable) -> bool:
+        """Answer a sync request or record the acknowledgement.
+
+        Returns True if the line was part of the time sync.
+        """
+        if line in self.SYNC_REQUESTS:
+            now = time.monotonic_ns()
+            if self.last_sent_ns is None or now - self.last_sent_ns >= self.retry_interval * 1e9:
+                self.synced = False
+                timestamp = datetime.now().isoformat(timespec='seconds')
+                write(f"{timestamp}\n".encode('ascii'))
+                self.last_sent_ns = time.monotonic_ns()
+                logger.info(f"Sent time sync {timestamp} to {self.port_name}")
+            return True
+        if line.startswith(self.SYNC_ACK_PREFIX):
+            if self.last_sent_ns is not None:
+                round_trip_ns = time.monotonic_ns() - self.last_sent_ns
+                self.last_sent_ns = None
+                logger.info(f"Time synced on {self.port_name}, acknowledged after {round_trip_ns / 1e6:.1f} ms")
+            self.synced = True
+            return True
+        return False
+
+
+class LineBuffer:
+    """Reusable buffer splitting the bytes read from a port into lines.
+
+    The bytes are read in chunks, all that the port has waiting, and the
+    complete lines are handed out as memoryview slices of the buffer,
+    without copying. A partial line stays in the buffer until the rest of
+    it arrives. A line growing over max_line_length is dropped as garbage.
+    """
+
+    def __init__(self, max_line_length: int = 4096):
+        self.buffer = bytearray()
+        self.max_line_length = max_line_length
+
+    def feed(self, data: bytes, callback: callable):
+        """Add the data and call the callback with each complete line.
+
+        The line passed to the callback is only valid during the call, the
+        callback must copy what it keeps. The line terminator is removed.
+        """
+        buffer = self.buffer
+        buffer += data
+        start = 0
+        try:
+            with memoryview(buffer) as view:
+                while (end := buffer.find(b'\n', start)) >= 0:
+                    line_start = start
+                    line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+                    start = end + 1
+                    if line_end > line_start:
+                        # released even if a traceback still refers to it,
+                        # the buffer can't be resized while a slice is alive
+                        with view[line_start:line_end] as line:
+                            callback(line)
+        finally:
+            # drop the handled lines, even if the callback failed
+            if start:
+                del buffer[:start]
+        if len(buffer) > self.max_line_length:
+            hot_path_logger.warning("Dropping %d bytes without a line end", len(buffer))
+            buffer.clear()
+
+    def clear(self):
+        """Drop the partial line, e.g. after a reconnect."""
+        self.buffer.clear()
+
+
+class PortLineHandler:
+    """Routes the lines read from a serial port.
+
+    Data lines are stamped and put on the reading queue, status lines go
+    to the status log and the time sync responder.
+    """
+
+    def __init__(self, port_name: str, reading_queue: queue.Queue):
+        self.port_name = port_name
+        self.reading_queue = reading_queue
+        self.status_lines = datalog.StatusLineLog(port_name)
+        self.time_sync = TimeSyncResponder(port_name) if config.TIME_SYNC_ENABLED else None
+        self.lines_read = metrics.SERIAL_LINES.labels(port_name)
+        self.bytes_read = metrics.SERIAL_BYTES.labels(port_name)
+
+    def handle_line(self, line: bytes | memoryview, write: callable):
+        """Handle a line, write is used to answer the box.
+
+        Data lines are kept as bytes, only the status lines are decoded.
+        The errors are logged and not raised, the port is only reopened on
+        a read error, reopening it resets the box.
+        """
+        try:
+            self._handle_line(line, write)
+        except Exception as e:
+            hot_path_logger.exception("Failed to handle a line from %s: %s", self.port_name, e)
+
+    def _handle_line(self, line: bytes | memoryview, write: callable):
+        self.lines_read.inc()
+        if datalog.is_json_line(line):
+            self.reading_queue.put(self.make_reading(bytes(line)))
+            return
+        # status chatter never reaches the JSON decoder
+        text = str(line, 'utf-8', errors='replace').strip()
+        if not text:
+            return
+        self.status_lines.add(text)
+        if self.time_sync:
+            self.time_sync.handle_status_line(text, write)
+
+    def make_reading(self, line: bytes) -> datalog.Reading:
+        """Stamp the line with the port name and the receive time."""
+        return datalog.Reading(line, self.port_name, datalog.receive_clock.now_ns())
 
 
 class SerialPortThread(threading.Thread):
@@ -35,6 +177,8 @@ class SerialPortThread(threading.Thread):
         self.baud_rate = baud_rate
         self.timeout = timeout
         self.reconnect_delay = reconnect_delay
+        self.line_handler = PortLineHandler(port_name, reading_queue)
+        self.line_buffer = LineBuffer()
 
     def run(self):
         """Main thread entry point."""
@@ -50,14 +194,23 @@ class SerialPortThread(threading.Thread):
                 self.stop_event.set()
                 break
             try:
-                line = self.ser.readline().decode('utf-8').strip()
-                if line:
-                    self.reading_queue.put(line)
-            except Exception as e:
-                logger.debug(f"Error reading from {self.port_name}: {str(e)}")
+                # read all that is waiting in one call, or wait for the next byte
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except (serial.SerialException, OSError) as e:
+                # e.g. the box was unplugged, close the port so it is reconnected
+                # after the reconnect delay instead of failing in a busy loop
+                hot_path_logger.warning("Error reading from %s, reconnecting: %s", self.port_name, e)
+                self.ser.close()
+                self.line_buffer.clear()
                 continue
+            if data:
+                self.line_handler.bytes_read.inc(len(data))
+                self.line_buffer.feed(data, self._handle_line)
         logger.info(f"Stopping serial port thread for {self.port_name}...")
 
+    def _handle_line(self, line: memoryview):
+        self.line_handler.handle_line(line, self.ser.write)
+
     def stop(self):
         """Stop the thread."""
         if self.stop_event.is_set():
@@ -86,6 +239,9 @@ class SerialPortThread(threading.Thread):
                 return False
             # try to connect to the port if not connected
             if self.ser is None or not self.ser.is_open:
+                if self.ser is not None and attempts == 0:
+                    # the connection was lost
+                    metrics.PORT_RECONNECTS.labels(self.port_name).inc()
                 logger.info(f"Attempting to connect to {self.port_name}...")
                 try:
                     if port := self.connect_port(self.port_name):
@@ -120,39 +276,537 @@ class SerialPortThread(threading.Thread):
             return None
 
 
+class SelectorPort:
+    """State of a serial port read by the selector reader."""
+
+    def __init__(self, port_name: str, reading_queue: queue.Queue):
+        self.port_name = port_name
+        self.ser = None
+        self.line_buffer = LineBuffer()
+        self.line_handler = PortLineHandler(port_name, reading_queue)
+        self.reconnect_attempts = 0
+        # monotonic time of the next connection attempt, None while connected
+        self.next_connect = 0.0
+        self.stopped = threading.Event()
+
+
+class SelectorPortHandle:
+    """Handle of a port read by the selector reader.
+
+    Mirrors the start/stop interface of SerialPortThread, so the port
+    monitor can manage both reader engines the same way.
+    """
+
+    def __init__(self, reader: 'SelectorReaderThread', port_name: str):
+        self.reader = reader
+        self.port_name = port_name
+
+    def start(self):
+        self.reader.add_port(self.port_name)
+
+    def stop(self):
+        self.reader.remove_port(self.port_name)
+
+    def is_alive(self) -> bool:
+        return self.reader.has_port(self.port_name)
+
+
+class SelectorReaderThread(threading.Thread):
+    """Single thread reading all the serial ports with a selector.
+
+    Alternative to a SerialPortThread per port: the thread sleeps in the
+    selector until one of the ports has data, so the thread count and the
+    wakeup rate don't grow with the number of ports. Ports that fail are
+    closed and reconnected after the reconnect delay, like SerialPortThread
+    does, and dropped after max_reconnect_attempts failed attempts. An
+    unexpected error is logged and the thread keeps reading the other
+    ports, the port it happened on is reconnected.
+    """
+
+    # seconds remove_port waits for the port to be closed
+    REMOVE_TIMEOUT = 10.0
+
+    def __init__(
+            self,
+            reading_queue: queue.Queue,
+            max_reconnect_attempts: int = config.RECONNECT_ATTEMPTS,
+            baud_rate: int = config.BAUD_RATE,
+            reconnect_delay: int = config.PORT_RECONNECT_DELAY,
+    ):
+        super().__init__(name="SelectorReader")
+        self.reading_queue = reading_queue
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.baud_rate = baud_rate
+        self.reconnect_delay = reconnect_delay
+        self.stop_event = threading.Event()
+        self.selector = selectors.DefaultSelector()
+        self.ports = {}
+        self.commands = queue.SimpleQueue()
+        # self-pipe, to wake up the selector when a command is queued
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+
+    def add_port(self, port_name: str):
+        """Start reading the port."""
+        self._send_command('add', port_name)
+
+    def remove_port(self, port_name: str):
+        """Stop reading the port and close it, waits until it's closed."""
+        port = self.ports.get(port_name)
+        self._send_command('remove', port_name)
+        if port and self.is_alive() and not port.stopped.wait(self.REMOVE_TIMEOUT):
+            logger.error(f"Selector reader did not close {port_name} in {self.REMOVE_TIMEOUT:g} seconds")
+
+    def has_port(self, port_name: str) -> bool:
+        """Check if the port is read, or is being reconnected."""
+        return port_name in self.ports
+
+    def _send_command(self, command: str, port_name: str):
+        self.commands.put((command, port_name))
+        os.write(self.wakeup_write, b'\0')
+
+    def run(self):
+        """Main thread entry point."""
+        logger.info("Starting selector reader thread...")
+        while not self.stop_event.is_set():
+            try:
+                events = self.selector.select(self._select_timeout())
+            except Exception as e:
+                # e.g. the fd of a vanished port
+                config.capture_exception(e)
+                hot_path_logger.exception("Error waiting for the serial ports: %s", e)
+                self._close_broken_ports()
+                self.stop_event.wait(1)
+                events = []
+            for key, _ in events:
+                try:
+                    if key.fileobj == self.wakeup_read:
+                        self._handle_commands()
+                    else:
+                        self._read_port(key.data)
+                except Exception as e:
+                    config.capture_exception(e)
+                    hot_path_logger.exception("Error in the selector reader: %s", e)
+                    if key.data is not None:
+                        self._close_port(key.data)
+                        key.data.next_connect = time.monotonic() + self.reconnect_delay
+            try:
+                self._reconnect_ports()
+            except Exception as e:
+                config.capture_exception(e)
+                hot_path_logger.exception("Error reconnecting the serial ports: %s", e)
+        for port in list(self.ports.values()):
+            self._close_port(port)
+            port.stopped.set()
+        self.ports.clear()
+        logger.info("Stopped selector reader thread")
+
+    def _close_broken_ports(self):
+        """Close the ports whose fd is no longer valid, they are reconnected."""
+        for port in list(self.ports.values()):
+            if port.ser is None:
+                continue
+            try:
+                os.fstat(port.ser.fileno())
+            except Exception:
+                logger.warning(f"Lost the file descriptor of {port.port_name}, reconnecting")
+                self._close_port(port)
+                port.next_connect = time.monotonic() + self.reconnect_delay
+
+    def _select_timeout(self) -> float | None:
+        """Sleep until the next reconnect attempt, or until data arrives."""
+        pending = [p.next_connect for p in self.ports.values() if p.next_connect is not None]
+        if not pending:
+            return None
+        return max(0.0, min(pending) - time.monotonic())
+
+    def _handle_commands(self):
+        try:
+            while os.read(self.wakeup_read, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                command, port_name = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if command == 'add' and port_name not in self.ports:
+                logger.info(f"Adding {port_name} to the selector reader...")
+                self.ports[port_name] = SelectorPort(port_name, self.reading_queue)
+            elif command == 'remove' and port_name in self.ports:
+                logger.info(f"Removing {port_name} from the selector reader...")
+                port = self.ports.pop(port_name)
+                self._close_port(port)
+                port.stopped.set()
+
+    def _reconnect_ports(self):
+        now = time.monotonic()
+        for port in list(self.ports.values()):
+            if port.next_connect is None or port.next_connect > now:
+                continue
+            logger.info(f"Attempting to connect to {port.port_name}...")
+            try:
+                port.ser = serial.Serial(port.port_name, self.baud_rate, timeout=0)
+                self.selector.register(port.ser.fileno(), selectors.EVENT_READ, port)
+                port.next_connect = None
+                port.reconnect_attempts = 0
+                logger.info(f"Connected to {port.port_name}")
+            except Exception as e:
+                logger.exception(f"Failed to connect to {port.port_name}: {str(e)}")
+                self._close_port(port)
+                port.reconnect_attempts += 1
+                if port.reconnect_attempts > self.max_reconnect_attempts:
+                    logger.error(f"Failed to connect to {port.port_name} after {port.reconnect_attempts} attempts")
+                    del self.ports[port.port_name]
+                    port.stopped.set()
+                    continue
+                port.next_connect = now + self.reconnect_delay
+
+    def _read_port(self, port: SelectorPort):
+        try:
+            data = port.ser.read(port.ser.in_waiting or 1)
+        except Exception as e:
+            logger.warning(f"Error reading from {port.port_name}, reconnecting: {str(e)}")
+            metrics.PORT_RECONNECTS.labels(port.port_name).inc()
+            self._close_port(port)
+            port.next_connect = time.monotonic() + self.reconnect_delay
+            return
+        port.line_handler.bytes_read.inc(len(data))
+        port.line_buffer.feed(data, lambda line: port.line_handler.handle_line(line, port.ser.write))
+
+    def _close_port(self, port: SelectorPort):
+        if port.ser is None:
+            return
+        # looked up by port, the fd of a vanished port may be gone
+        for key in list(self.selector.get_map().values()):
+            if key.data is port:
+                self.selector.unregister(key.fileobj)
+        try:
+            port.ser.close()
+            logger.info(f"Closed serial port {port.port_name}")
+        except Exception as e:
+            logger.warning(f"Error closing {port.port_name}: {str(e)}")
+        port.ser = None
+        port.line_buffer.clear()
+
+    def stop(self):
+        """Stop the thread, closing all the ports."""
+        if self.stop_event.is_set():
+            # the thread is already stopped
+            return
+
+        logger.info("Stopping selector reader thread...")
+        self.stop_event.set()
+        os.write(self.wakeup_write, b'\0')
+        if self.is_alive():
+            self.join()
+        self.selector.close()
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
+
+
+class SpillFile:
+    """Append-only on-disk overflow for a data handler queue.
+
+    Items are pickled one after another and read back in the same order.
+    Once the items read are handled, commit() saves the read offset next
+    to the file, so a restart only replays the items that were not handled,
+    and truncates the file if all of them were.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = f"{path}.offset"
+        self.lock = threading.Lock()
+        spill_dir = os.path.dirname(self.path)
+        if spill_dir and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+        self.file = open(self.path, 'a+b')
+        self.read_offset = self._load_offset()
+        # items left over from the previous run are handled first
+        self.count = 0
+        self.file.seek(self.read_offset)
+        while True:
+            try:
+                pickle.load(self.file)
+                self.count += 1
+            except EOFError:
+                break
+            except Exception:
+                logger.exception(f"Corrupted spill file {self.path}, ignoring the rest of it")
+                break
+        if self.count:
+            logger.info(f"Found {self.count} spilled items in {self.path}")
+
+    def __len__(self):
+        return self.count
+
+    def append(self, item):
+        """Append an item to the end of the file."""
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            pickle.dump(item, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.count += 1
+
+    def read(self, max_items: int) -> list:
+        """Read up to max_items of the oldest items."""
+        items = []
+        with self.lock:
+            self.file.flush()
+            self.file.seek(self.read_offset)
+            while len(items) < max_items and self.count:
+                try:
+                    items.append(pickle.load(self.file))
+                    self.count -= 1
+                except Exception:
+                    logger.exception(f"Failed to read from spill file {self.path}, dropping {self.count} items")
+                    self.count = 0
+            self.read_offset = self.file.tell()
+        return items
+
+    def commit(self):
+        """Record that the items read so far are handled."""
+        with self.lock:
+            if not self.count:
+                self.file.truncate(0)
+                self.read_offset = 0
+            self._save_offset()
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                offset = int(f.read())
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError) as e:
+            logger.warning(f"Invalid spill offset {self.offset_path}, replaying all of {self.path}: {str(e)}")
+            return 0
+        # the file was truncated after the offset was saved
+        return offset if offset <= os.path.getsize(self.path) else 0
+
+    def _save_offset(self):
+        """Write the read offset, must hold the lock."""
+        temp_path = f"{self.offset_path}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(str(self.read_offset))
+        os.replace(temp_path, self.offset_path)
+
+    def close(self):
+        """Close the file."""
+        with self.lock:
+            self.file.close()
+
+
+class DataHandlerThread(threading.Thread):
+    """Thread feeding a single data handler from its own bounded queue.
+
+    Every data handler runs on its own thread, so a slow handler (e.g. a
+    network write) never delays the others. When the queue is full the
+    overflow policy decides what happens with the new item:
+
+    - block: wait until the handler catches up,
+    - drop_oldest: drop the oldest queued item,
+    - spill: append the item to an on-disk spill file, the handler reads
+      it back in order once the queue is drained.
+    """
+
+    OVERFLOW_BLOCK = 'block'
+    OVERFLOW_DROP_OLDEST = 'drop_oldest'
+    OVERFLOW_SPILL = 'spill'
+    OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+    def __init__(
+            self,
+            callback: callable,
+            max_size: int = config.SINK_QUEUE_SIZE,
+            overflow_policy: str = config.SINK_OVERFLOW_POLICY,
+            spill_path: str = config.SINK_SPILL_PATH,
+    ):
+        self.sink_name = self.get_sink_name(callback)
+        super().__init__(name=f"DataHandler-{self.sink_name}")
+        if overflow_policy not in self.OVERFLOW_POLICIES:
+            logger.error(f"Unknown overflow policy {overflow_policy}, using {self.OVERFLOW_BLOCK}")
+            overflow_policy = self.OVERFLOW_BLOCK
+        self.callback = callback
+        # data loggers get the decoded readings, other callbacks the raw lines
+        self.wants_reading = isinstance(getattr(callback, '__self__', None), datalog.DataLoggerBase)
+        self.queue = queue.Queue(maxsize=max_size)
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.stop_event = threading.Event()
+        self.dropped = 0
+        self.spill_file = None
+        if overflow_policy == self.OVERFLOW_SPILL:
+            self.spill_file = SpillFile(os.path.join(spill_path, f"{self.sink_name}.spill"))
+
+    @staticmethod
+    def get_sink_name(callback: callable) -> str:
+        """Name of the data handler, used for logging and the spill file."""
+        owner = getattr(callback, '__self__', None)
+        if owner is not None:
+            return type(owner).__name__
+        return getattr(callback, '__name__', type(callback).__name__)
+
+    @property
+    def depth(self) -> int:
+        """Number of items waiting for the data handler."""
+        spilled = len(self.spill_file) if self.spill_file is not None else 0
+        return self.queue.qsize() + spilled
+
+    def put(self, item):
+        """Queue an item for the data handler, applying the overflow policy."""
+        if self.overflow_policy == self.OVERFLOW_BLOCK:
+            self.queue.put(item)
+            return
+        if self.spill_file is not None and len(self.spill_file):
+            # keep the order, new items go behind the spilled ones
+            self.spill_file.append(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if self.spill_file is not None:
+                self.spill_file.append(item)
+                return
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(item)
+
+    def run(self):
+        """Main thread entry point."""
+        logger.info(f"Starting {self.sink_name} data handler thread...")
+        while True:
+            spilled = self.spill_file is not None and len(self.spill_file)
+            try:
+                # the spilled items are read as soon as the queue is drained
+                item = self.queue.get_nowait() if spilled else self.queue.get(timeout=1)
+            except queue.Empty:
+                if spilled:
+                    for item in self.spill_file.read(self.max_size):
+                        self.execute_callback(item)
+                    self.spill_file.commit()
+                    continue
+                if self.stop_event.is_set():
+                    break
+                continue
+            self.execute_callback(item)
+        logger.info(f"Stopped {self.sink_name} data handler thread")
+
+    def execute_callback(self, item):
+        """Execute the data callback."""
+        try:
+            self.callback(item)
+        except Exception:
+            hot_path_logger.exception("Failed to execute %s callback!", self.callback)
+
+    def stop(self):
+        """Stop the thread, after all the queued items are handled."""
+        if self.stop_event.is_set():
+            # the thread is already stopped
+            return
+
+        logger.info(f"Stopping {self.sink_name} data handler thread, {self.depth} items left...")
+        self.stop_event.set()
+        self.join()
+        if self.spill_file is not None:
+            self.spill_file.close()
+        if self.dropped:
+            logger.warning(f"{self.sink_name} data handler dropped {self.dropped} items on queue overflow")
+
+
 class QueueReadingThread(threading.Thread):
-    """Thread for reading data from a queue."""
+    """Thread for reading data from a queue.
 
-    def __init__(self, queue: queue.Queue, callbacks: list[callable]):
+    Every line read from the queue is decoded once and fanned out to the
+    data handler threads, each data handler has its own bounded queue.
+    Data loggers receive the decoded reading, plain callbacks still get
+    the raw line. The readings decoded already, by the worker processes
+    of the supervisor, are passed on as they are, they have no line for
+    the plain callbacks. With the deadband filter enabled, the unchanged
+    fields are dropped from the decoded readings before the fan out. The thread
+    blocks on the queue until data arrives, stop() wakes it up with a
+    sentinel queued behind the remaining lines.
+    """
+
+    STOP_SENTINEL = object()
+
+    def __init__(
+            self,
+            queue: queue.Queue,
+            callbacks: list[callable],
+            depth_log_interval: int = config.SINK_DEPTH_LOG_INTERVAL,
+            deadband_filter: deadband.DeadbandFilter | None = None,
+            liveness_tracker: liveness.LivenessTracker | None = None,
+    ):
         super().__init__()
         self.queue = queue
+        self.liveness_tracker = liveness_tracker
         self.stop_event = threading.Event()
         self.callbacks = callbacks
         if not self.callbacks:
             self.callbacks.append(datalog.simple_logging_data_handler)
+        self.handler_threads = [DataHandlerThread(cb) for cb in self.callbacks]
+        for handler_thread in self.handler_threads:
+            metrics.SINK_QUEUE_DEPTH.labels(handler_thread.sink_name).set_function(
+                lambda t=handler_thread: t.depth)
+        wants_readings = any(t.wants_reading for t in self.handler_threads)
+        # the liveness is tracked from the valid readings
+        self.decode_lines = wants_readings or liveness_tracker is not None
+        self.deadband_filter = deadband_filter
+        if self.deadband_filter is None and config.DEADBAND_ENABLED and wants_readings:
+            self.deadband_filter = deadband.DeadbandFilter(
+                deadband.parse_tolerances(config.DEADBAND_TOLERANCES),
+                keep_columns=datalog.DataLoggerBase.REQUIRED_COLUMNS)
+        self.depth_log_interval = depth_log_interval
+        self.last_depth_log = time.monotonic()
 
     def run(self):
         """Main thread entry point."""
 
         logger.info(f"Starting queue reading thread...")
+        for handler_thread in self.handler_threads:
+            handler_thread.start()
 
-        # main loop, execute until stop event is set
-        while not self.stop_event.is_set():
+        # main loop, execute until the stop sentinel is received
+        while True:
+            reading = self.queue.get()
+            if reading is self.STOP_SENTINEL:
+                break
             try:
-                line = self.queue.get(block=False, timeout=1000)
-                self.execute_callbacks(line)
+                self.execute_callbacks(reading)
             except Exception as e:
-                logger.debug(f"Error reading from queue: {str(e)}")
-                continue
+                hot_path_logger.exception("Error handling data from queue: %s", e)
         logger.info(f"Stopping queue reading thread...")
 
-    def execute_callbacks(self, line):
-        """Execute all data callbacks."""
-        for cb in self.callbacks:
-            try:
-                cb(line)
-            except Exception:
-                logger.exception(f"Failed to execute %s callback!", cb)
+    def execute_callbacks(self, reading: datalog.Reading):
+        """Decode the reading and pass it to all the data handler threads."""
+        decoded = reading.data is not None
+        if self.decode_lines and not decoded:
+            decoded = datalog.decode_reading(reading)
+            if decoded and self.liveness_tracker:
+                self.liveness_tracker.seen(reading.data['ID'], reading.port)
+            if decoded and self.deadband_filter:
+                reading.data = self.deadband_filter.apply(reading.data, reading.ts)
+                decoded = reading.data is not None
+        for handler_thread in self.handler_threads:
+            if not handler_thread.wants_reading:
+                # the readings of the worker processes come decoded, without the line
+                if reading.line is not None:
+                    handler_thread.put(reading.text)
+            elif decoded:
+                handler_thread.put(reading)
+        if time.monotonic() - self.last_depth_log > self.depth_log_interval:
+            self.last_depth_log = time.monotonic()
+            logger.info(f"Data handler queue depths: {self.queue_depths()}")
+
+    def queue_depths(self) -> dict[str, int]:
+        """Number of items waiting for each data handler."""
+        return {t.sink_name: t.depth for t in self.handler_threads}
 
     def stop(self):
         """Stop the thread."""
@@ -162,7 +816,11 @@ class QueueReadingThread(threading.Thread):
 
         logger.info(f"Stopping queue reading thread...")
         self.stop_event.set()
+        # the lines already in the queue are handled before the sentinel
+        self.queue.put(self.STOP_SENTINEL)
         self.join()
+        for handler_thread in self.handler_threads:
+            handler_thread.stop()
         logger.info(f"Stopped queue reading thread")
 
 
@@ -173,6 +831,11 @@ class SerialPortMonitor(threading.Thread):
     the available serial ports and data reading threads. It will
     start a new thread for each port that is available and stop the
     threads for ports that are no longer available.
+
+    The ports are scanned periodically, and right away when the hotplug
+    event source reports a port added or removed. The ports are named
+    after their stable symlinks when they have one. With a port filter,
+    only the ports it accepts are read, e.g. the shard of a worker process.
     """
 
     def __init__(self,
@@ -181,7 +844,11 @@ class SerialPortMonitor(threading.Thread):
                  reading_queue: queue.Queue,
                  scanning_interval: int = config.PORT_SCAN_INTERVAL,
                  alert_on_no_ports: bool = True,
-                 no_ports_timeout: int = config.NO_BOXES_TIMEOUT
+                 no_ports_timeout: int = config.NO_BOXES_TIMEOUT,
+                 hotplug_source: hotplug.HotplugEventSource = None,
+                 port_reader_factory: callable = None,
+                 liveness_tracker: liveness.LivenessTracker = None,
+                 port_filter: callable = None,
                  ):
         super().__init__()
         self.threads = threads
@@ -192,13 +859,60 @@ class SerialPortMonitor(threading.Thread):
         self.alert_on_no_ports = alert_on_no_ports
         self.last_alert_time = 0
         self.max_time_without_ports = no_ports_timeout
+        self.hotplug_source = hotplug_source
+        self.rescan_event = threading.Event()
+        # ports that passed the probe, with the first reading received
+        self.probed_ports = {}
+        # creates the reader of a port, a SerialPortThread by default
+        self.port_reader_factory = port_reader_factory or self.create_port_thread
+        self.liveness_tracker = liveness_tracker
+        self.port_filter = port_filter
+        # ports to close and open again, e.g. of a box that stopped sending data
+        self.restart_requests = set()
+        self.restart_lock = threading.Lock()
+        # ports with a probe running, it can outlive the deadline of its scan
+        self.probing = set()
+        self.probing_lock = threading.Lock()
+
+    def create_port_thread(self, port_name: str) -> SerialPortThread:
+        """Create a thread reading the port."""
+        return SerialPortThread(port_name, threading.Event(), self.reading_queue)
+
+    def handle_hotplug_event(self, action: str, device: str):
+        """Rescan the ports right away on a hotplug event."""
+        self.rescan_event.set()
+
+    def request_port_restart(self, port_name: str):
+        """Close the port and open it again on the next scan, right away."""
+        with self.restart_lock:
+            self.restart_requests.add(port_name)
+        self.rescan_event.set()
+
+    def restart_requested_ports(self):
+        """Stop the readers of the ports to restart, the scan starts them again."""
+        with self.restart_lock:
+            restart_requests, self.restart_requests = self.restart_requests, set()
+        for port_name in restart_requests:
+            thread = self.threads.pop(port_name, None)
+            if thread is None:
+                continue
+            logger.info(f"Restarting the thread for port {port_name}...")
+            thread.stop()
+            self.ports.discard(port_name)
 
     def run(self):
         """Main thread entry point."""
         logger.info("Starting serial port monitor...")
+        if self.hotplug_source:
+            self.hotplug_source.start(self.handle_hotplug_event)
+        # the ports have the timeout to show up before the first alert
+        self.last_alert_time = time.time()
         while not self.stop_event.is_set():
+            self.rescan_event.clear()
+            self.restart_requested_ports()
             # scan for available ports
             logger.info("Scanning for available ports...")
+            scan_start = time.monotonic()
             available_ports = self.scan_serial_ports(with_ping=False)
             logger.info(f"Found {len(available_ports)} available ports: {available_ports}")
 
@@ -210,74 +924,182 @@ class SerialPortMonitor(threading.Thread):
                     self.threads[port_name].stop()
                     del self.threads[port_name]
                     ports_to_remove.append(port_name)
+                    if self.liveness_tracker:
+                        self.liveness_tracker.forget_port(port_name)
                     logger.info(f"Stopped the thread for port {port_name}")
 
             # remove the ports from the list
             for port_name in ports_to_remove:
                 self.ports.remove(port_name)
 
-            # check if any new ports are available
-            for port_name in available_ports:
-                if port_name not in self.ports and not self.stop_event.is_set():
-                    # try to ping the port, if it fails, skip it
-                    if not self.ping_port(port_name, timeout=10):
-                        continue
-
-                    logger.info(f"Port {port_name} is now available, starting the thread...")
-                    self.ports.add(port_name)
-                    stop_event = threading.Event()
-                    thread = SerialPortThread(port_name, stop_event, self.reading_queue)
-                    self.threads[port_name] = thread
-                    thread.start()
+            # check if any new ports are available, start the ones already
+            # probed by a scan, then probe the others all at once, starting
+            # each one as soon as it responds
+            new_ports = [p for p in available_ports if p not in self.ports]
+            for port_name in new_ports:
+                if port_name in self.probed_ports and not self.stop_event.is_set():
+                    self.start_port(port_name, self.probed_ports.pop(port_name))
+            self.probe_ports([p for p in new_ports if p not in self.ports], on_responded=self.start_port)
+            # forget the probes of the ports that are gone since
+            self.probed_ports.clear()
+            metrics.PORT_SCAN_SECONDS.observe(time.monotonic() - scan_start)
 
             if not self.ports:
                 if self.alert_on_no_ports and time.time() - self.last_alert_time > self.max_time_without_ports:
-                    sentry_sdk.capture_message("No serial ports available! Check the connections.")
+                    config.capture_message("No serial ports available! Check the connections.")
                     self.last_alert_time = time.time()
                 logger.warning("No serial ports found.")
 
             if not self.stop_event.is_set():
                 logger.info(f"Waiting {self.scanning_interval} seconds before scanning again...")
-                sleep(self.scanning_interval)
+                if self.rescan_event.wait(self.scanning_interval) and not self.stop_event.is_set():
+                    logger.info("Hotplug event received, scanning again...")
 
             # Notify systemd that the service is still alive
             config.notify_systemd(config.NOTIFY_WATCHDOG)
 
-    def scan_serial_ports(self, with_ping: bool = True, timeout: int = config.PORT_TIMEOUT) -> list[str]:
+    def start_port(self, port_name: str, first_reading: datalog.Reading | None = None):
+        """Start reading a port that passed the probe."""
+        if self.stop_event.is_set():
+            return
+        logger.info(f"Port {port_name} is now available, starting the thread...")
+        self.ports.add(port_name)
+        thread = self.port_reader_factory(port_name)
+        self.threads[port_name] = thread
+        if first_reading:
+            # don't throw away the data received during the probe
+            self.reading_queue.put(first_reading)
+        if self.liveness_tracker:
+            self.liveness_tracker.watch_port(port_name)
+        thread.start()
+
+    def scan_serial_ports(
+            self,
+            with_ping: bool = True,
+            timeout: float = config.PORT_TIMEOUT,
+            deadline: float = config.PROBE_DEADLINE,
+    ) -> list[str]:
         """Scan serial ports and return a list of available ports.
 
         Args:
             with_ping: If True, ping the port before adding it to the list.
+            timeout: Time to wait for a line from each port.
+            deadline: Time to wait for all the ports together.
 
         """
         logger.info("Scanning serial ports...")
         ports = list_ports.grep(config.PORTS_RE)
-        available_ports = []
-        for port in ports:
-            if self.stop_event.is_set():
-                # thead is exiting, don't scan anymore
-                break
-            if with_ping and not self.ping_port(port.device, timeout=timeout):
-                continue
-            available_ports.append(port.device)
+        stable_names = hotplug.stable_port_names()
+        available_ports = [stable_names.get(port.device, port.device) for port in ports]
+        # links to devices unknown to list_ports, e.g. the pseudo-terminals
+        # of the box simulator, are matched by their link name
+        for device, link in stable_names.items():
+            if link not in available_ports and re.search(config.PORTS_RE, link) and os.path.exists(device):
+                available_ports.append(link)
+        if self.port_filter:
+            available_ports = [p for p in available_ports if self.port_filter(p)]
+        if with_ping and not self.stop_event.is_set():
+            self.probe_ports(available_ports, timeout=timeout, deadline=deadline)
+            available_ports = [p for p in available_ports if p in self.probed_ports]
         logger.info(f"Found {len(available_ports)}\navailable ports: {available_ports}")
         return available_ports
 
-    def ping_port(self, port_name: str, timeout: int = config.PORT_TIMEOUT) -> bool:
-        """Try to open the port and read a line of data."""
+    def probe_ports(
+            self,
+            port_names: list[str],
+            timeout: float = config.PROBE_TIMEOUT,
+            deadline: float = config.PROBE_DEADLINE,
+            max_workers: int = config.PROBE_WORKERS,
+            on_responded: callable = None,
+    ):
+        """Probe the ports concurrently, recording the ones that respond.
+
+        With on_responded, it's called with the port name and the first
+        reading of every port as soon as it responds, instead. The ports
+        that don't respond before the deadline are skipped, they are
+        probed again on a later scan, once their probe has ended and
+        closed the port.
+
+        The probes run on their own threads, not an executor, the
+        executors refuse new work once the interpreter shutdown started.
+        """
+        with self.probing_lock:
+            busy = [p for p in port_names if p in self.probing]
+            port_names = [p for p in port_names if p not in self.probing]
+            self.probing.update(port_names)
+        if busy:
+            logger.info(f"Still probing ports {busy}, skipping them")
+        if not port_names:
+            return
+        logger.info(f"Probing ports {port_names}...")
+        deadline_at = time.monotonic() + deadline
+        workers = threading.BoundedSemaphore(min(max_workers, len(port_names)))
+        results = queue.Queue()
+        for port_name in port_names:
+            threading.Thread(
+                target=self._run_probe, args=(port_name, min(timeout, deadline), deadline_at, workers, results),
+                name=f"PortProbe-{port_name}", daemon=True).start()
+        pending = set(port_names)
+        while pending:
+            try:
+                port_name, responded, first_reading = results.get(timeout=max(0.0, deadline_at - time.monotonic()))
+            except queue.Empty:
+                logger.warning(f"Probe deadline expired for ports: {sorted(pending)}")
+                break
+            pending.discard(port_name)
+            if not responded:
+                continue
+            if on_responded:
+                on_responded(port_name, first_reading)
+            else:
+                self.probed_ports[port_name] = first_reading
+
+    def _run_probe(self, port_name: str, timeout: float, deadline_at: float,
+                   workers: threading.BoundedSemaphore, results: queue.Queue):
+        """Probe thread entry point, waiting for a free worker slot."""
+        responded, first_reading = False, None
+        try:
+            with workers:
+                # the scan gave up on the ports still waiting for a slot
+                if time.monotonic() < deadline_at:
+                    responded, first_reading = self.probe_port(port_name, timeout)
+        finally:
+            with self.probing_lock:
+                self.probing.discard(port_name)
+            results.put((port_name, responded, first_reading))
+
+    def probe_port(self, port_name: str, timeout: float = config.PROBE_TIMEOUT) -> tuple[bool, datalog.Reading | None]:
+        """Try to open the port and read a line of data.
+
+        Returns if the port responded, and the reading if the line was data.
+        """
         logger.info(f"Pinging port {port_name}...")
+        lines = []
+        line_buffer = LineBuffer()
         try:
             with serial.Serial(port_name, config.BAUD_RATE, timeout=timeout) as ser:
-                line = ser.readline().decode('utf-8').strip()
-                if line:
-                    logger.info(f"Successfully pinged port {port_name}")
-                    return True
-                else:
+                deadline = time.monotonic() + timeout
+                while not lines and time.monotonic() < deadline:
+                    data = ser.read(ser.in_waiting or 1)
+                    if not data:
+                        # read timed out
+                        break
+                    line_buffer.feed(data, lambda line: lines.append(bytes(line)))
+                if not lines:
                     logger.warning(f"Failed to ping port {port_name}")
-                    return False
+                    return False, None
+                logger.info(f"Successfully pinged port {port_name}")
+                if datalog.is_json_line(lines[0]):
+                    return True, datalog.Reading(lines[0], port_name)
+                return True, None
         except Exception as e:
             logger.warning(f"Failed to open port {port_name}")
-            return False
+            return False, None
+
+    def ping_port(self, port_name: str, timeout: float = config.PORT_TIMEOUT) -> bool:
+        """Try to open the port and read a line of data."""
+        responded, _ = self.probe_port(port_name, timeout)
+        return responded
 
     def stop(self):
         """Stop the thread."""
@@ -286,13 +1108,19 @@ class SerialPortMonitor(threading.Thread):
             return
 
         logger.info("Stopping serial port monitor...")
+        self.stop_event.set()
+        # wake up the thread if it's waiting for the next scan
+        self.rescan_event.set()
+        if self.hotplug_source:
+            self.hotplug_source.stop()
+        # the monitor adds and removes the port threads, let it exit first
+        if self.is_alive():
+            self.join()
         # stop all the threads
-        for port_name, thread in self.threads.items():
+        for port_name, thread in list(self.threads.items()):
             logger.info(f"Stopping thread for port {port_name}...")
             thread.stop()
             logger.info(f"Stopped thread for port {port_name}")
-        self.stop_event.set()
-        self.join()
         logger.info("Stopped serial port monitor")
 
 
@@ -304,54 +1132,92 @@ class SerialPortManager:
                  baud_rate: int = config.BAUD_RATE,
                  timeout: int = config.PORT_TIMEOUT,
                  wait_for_ports_attempts: int = config.WAIT_FOR_PORTS_ATTEMPTS,
+                 port_filter: callable = None,
+                 alert_on_no_ports: bool = True,
                  ):
         self.ports = []
         self.threads = {}
         self.stop_events = {}
         self.reading_queue = queue.Queue()
+        metrics.READING_QUEUE_DEPTH.set_function(self.reading_queue.qsize)
         self.max_retries = max_retries
         self.baud_rate = baud_rate
         self.timeout = timeout
         self.queue_reader = None
         self.data_handlers = []
+        self.data_loggers = []
         if data_handler_callback:
             self.data_handlers.append(data_handler_callback)
-        self.port_monitor = SerialPortMonitor(self.threads, self.ports, self.reading_queue)
+        self.selector_reader = None
+        port_reader_factory = None
+        if config.READER_ENGINE == 'selector':
+            self.selector_reader = SelectorReaderThread(self.reading_queue)
+            port_reader_factory = lambda port_name: SelectorPortHandle(self.selector_reader, port_name)
+        elif config.READER_ENGINE != 'threads':
+            logger.error(f"Unknown reader engine {config.READER_ENGINE}, using threads")
+        self.liveness_tracker = liveness.LivenessTracker() if config.LIVENESS_ENABLED else None
+        self.port_monitor = SerialPortMonitor(
+            self.threads, self.ports, self.reading_queue,
+            hotplug_source=hotplug.create_event_source(),
+            port_reader_factory=port_reader_factory,
+            liveness_tracker=self.liveness_tracker,
+            port_filter=port_filter,
+            alert_on_no_ports=alert_on_no_ports)
+        if self.liveness_tracker:
+            self.liveness_tracker.reopen_port = self.port_monitor.request_port_restart
         self.wait_fror_ports_attempts = wait_for_ports_attempts
         self.stop_event = threading.Event()
 
     def add_data_handler(self, data_handler: datalog.DataLoggerBase):
         """Add logging data handler."""
         self.data_handlers.append(data_handler.handle_data)
+        self.data_loggers.append(data_handler)
         logger.info("Added %s data handler", data_handler)
 
+    def queue_depths(self) -> dict[str, int]:
+        """Number of items waiting for each data handler."""
+        if not self.queue_reader:
+            return {}
+        return self.queue_reader.queue_depths()
+
     def wait_for_serial_ports(self):
         """Waits until at least one serial port is available."""
         attempts = 0
-        self.ports = self.port_monitor.scan_serial_ports(timeout=10000)
+        self.ports = self.port_monitor.scan_serial_ports(timeout=config.PROBE_TIMEOUT)
         while not self.ports and attempts < self.wait_fror_ports_attempts:
             if self.stop_event.is_set():
                 # app is exiting, don't scan anymore
                 break
             logger.info("No serial ports found, waiting for 10 seconds...")
             sleep(10)
-            self.ports = self.port_monitor.scan_serial_ports(timeout=10000)
+            self.ports = self.port_monitor.scan_serial_ports(timeout=config.PROBE_TIMEOUT)
             if self.ports:
                 break
             attempts += 1
         logger.info("Serial ports found, continuing...")
 
     def start(self):
-        """Start the serial port manager."""
+        """Start the serial port manager.
+
+        With FAST_START the ports are found by the monitor in the background,
+        otherwise this waits for a port to respond and exits if none does.
+        """
         logger.info("Starting serial port manager...")
-        self.wait_for_serial_ports()
-        if not self.ports:
-            logger.error("No serial ports found, exiting...")
-            sys.exit(1)
+        if not config.FAST_START:
+            self.wait_for_serial_ports()
+            if not self.ports:
+                logger.error("No serial ports found, exiting...")
+                sys.exit(1)
         # start the queue reading thread
-        self.queue_reader = QueueReadingThread(self.reading_queue, self.data_handlers)
+        self.queue_reader = QueueReadingThread(
+            self.reading_queue, self.data_handlers, liveness_tracker=self.liveness_tracker)
         self.queue_reader.start()
         logger.info("Started queue reading thread")
+        if self.liveness_tracker:
+            self.liveness_tracker.start()
+        if self.selector_reader:
+            self.selector_reader.start()
+            logger.info("Started selector reader thread")
         self.port_monitor.start()
         logger.info("Started serial port manager")
 
@@ -359,6 +1225,17 @@ class SerialPortManager:
         """Stop the serial port manager."""
         logger.info("Stopping serial port manager...")
         self.stop_event.set()
+        if self.liveness_tracker:
+            self.liveness_tracker.stop()
         self.port_monitor.stop()
+        if self.selector_reader:
+            self.selector_reader.stop()
         self.queue_reader.stop()
+        # let the data loggers flush what they have buffered
+        for data_logger in self.data_loggers:
+            try:
+                data_logger.close()
+            except Exception as e:
+                config.capture_exception(e)
+                logger.exception(f"Error closing {data_logger} data handler: {str(e)}")
         logger.info("Stopped serial port manager")
@@ -0,0 +1,291 @@
+"""Simulated Arduino boxes on pseudo-terminals, for tests and benchmarks.
+
+Every box gets a pseudo-terminal and a symlink to it in the link
+directory, like the udev rules create for the real boxes. The boxes print
+the boot chatter of the firmware, ask for the time sync, then send a
+sendJson line every interval. Garbage lines, disconnects (the box is
+unplugged and plugged back after a delay) and hangs (the box goes silent
+for a while, then boots again) are thrown in at the given rates.
+
+Run the simulator::
+
+    python simulator.py --boxes 8 --link-dir /tmp/boxes
+
+and point the data logger at the links::
+
+    PORT_LINKS_GLOB='/tmp/boxes/box_sim*' PORTS_RE='box_sim' python app.py
+
+The simulator doesn't use the app config, so it can run next to the app
+without touching its logs or Sentry.
+"""
+import argparse
+import json
+import logging
+import os
+import pty
+import random
+import select
+import signal
+import threading
+import time
+import tty
+from datetime import datetime, timezone
+
+
+logger = logging.getLogger('simulator')
+
+LINK_PREFIX = "box_sim"
+
+BOOT_LINES = [
+    "I2C up.",
+    "SHT30 OK",
+    "SCD41 OK",
+    "BMP280 OK",
+    "Screen ok!",
+    "Initialized scheduler",
+]
+
+
+class SimulatedBox(threading.Thread):
+    """A box on a pseudo-terminal, sending sendJson lines every interval."""
+
+    def __init__(
+            self,
+            box_id: int,
+            link_path: str,
+            interval: float = 10,
+            garbage_rate: float = 0,
+            disconnect_rate: float = 0,
+            reconnect_delay: float = 3,
+            hang_rate: float = 0,
+            hang_duration: float = 60,
+            time_sync: bool = True,
+            timestamps: bool = False,
+            seed: int = None,
+    ):
+        super().__init__(name=f"SimulatedBox-{box_id}", daemon=True)
+        self.box_id = box_id
+        self.link_path = link_path
+        self.interval = interval
+        self.garbage_rate = garbage_rate
+        self.disconnect_rate = disconnect_rate
+        self.reconnect_delay = reconnect_delay
+        # a hung firmware sends nothing until it's reset by the watchdog
+        self.hang_rate = hang_rate
+        self.hang_duration = hang_duration
+        self.time_sync = time_sync
+        # add the send time to the data, to measure the end to end latency
+        self.timestamps = timestamps
+        self.random = random.Random(seed)
+        self.stop_event = threading.Event()
+        self.master = None
+        self.slave = None
+        self.state = {
+            "co2": 800, "%RH": 70.0, "RHSP": 71.0, "boxTempC": 34.0,
+            "BHSP": 35.0, "waterTempC": 42.0, "IHSP": 40.0, "pressure": 101325.0,
+        }
+        self.stats = {"lines": 0, "data_lines": 0, "bytes": 0, "dropped": 0, "garbage": 0, "disconnects": 0, "hangs": 0}
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.plug()
+            try:
+                self.session()
+            except OSError as e:
+                logger.warning(f"Box {self.box_id} session failed: {str(e)}")
+            finally:
+                self.unplug()
+            self.stop_event.wait(self.reconnect_delay)
+
+    def plug(self):
+        """Create the pseudo-terminal and link it, like plugging the box in."""
+        self.master, self.slave = pty.openpty()
+        # the slave end is kept open, so the box outlives the readers
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        tmp_link = f"{self.link_path}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.ttyname(self.slave), tmp_link)
+        os.replace(tmp_link, self.link_path)
+        logger.info(f"Box {self.box_id} plugged in on {self.link_path} -> {os.ttyname(self.slave)}")
+
+    def unplug(self):
+        """Remove the link and close the pseudo-terminal."""
+        if os.path.lexists(self.link_path):
+            os.remove(self.link_path)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+        logger.info(f"Box {self.box_id} unplugged")
+
+    def session(self):
+        """Boot, sync the time and send data until a disconnect or stop."""
+        self.boot()
+        next_send = time.monotonic()
+        while not self.stop_event.is_set():
+            self.wait_input(next_send - time.monotonic())
+            if time.monotonic() < next_send:
+                continue
+            next_send += self.interval
+            if self.random.random() < self.disconnect_rate:
+                self.stats["disconnects"] += 1
+                return
+            if self.random.random() < self.hang_rate:
+                self.stats["hangs"] += 1
+                self.stop_event.wait(self.hang_duration)
+                self.boot()
+                next_send = time.monotonic()
+                continue
+            if self.random.random() < self.garbage_rate:
+                self.stats["garbage"] += 1
+                self.send(self.garbage_line())
+            else:
+                self.stats["data_lines"] += 1
+                self.send(self.data_line())
+
+    def boot(self):
+        """Boot messages and time sync, like after a reset."""
+        for line in BOOT_LINES:
+            self.send(line)
+        if self.time_sync:
+            self.sync_time()
+
+    def sync_time(self):
+        """Ask for the time, like requestTime() of the firmware, until answered."""
+        while not self.stop_event.is_set():
+            self.send("Serial up. Initializing.")
+            answer = self.wait_input(1.0)
+            if answer.strip():
+                self.send(f"Received time: {answer.splitlines()[0].strip()}")
+                return
+            self.send("Still waiting for time sync.")
+
+    def wait_input(self, timeout: float) -> str:
+        """Wait for the timeout, returning what the reader wrote to the box."""
+        if timeout <= 0:
+            timeout = 0
+        readable, _, _ = select.select([self.master], [], [], timeout)
+        if not readable:
+            return ""
+        try:
+            return os.read(self.master, 4096).decode("utf-8", errors="replace")
+        except (BlockingIOError, InterruptedError):
+            return ""
+
+    def data_line(self) -> str:
+        """The next reading, in the sendJson format."""
+        state = self.state
+        walk = self.random.uniform
+        state["co2"] = max(400, state["co2"] + int(walk(-20, 20)))
+        state["%RH"] = round(min(100.0, max(0.0, state["%RH"] + walk(-0.5, 0.5))), 2)
+        state["boxTempC"] = round(state["boxTempC"] + walk(-0.1, 0.1), 2)
+        state["waterTempC"] = round(state["waterTempC"] + walk(-0.1, 0.1), 2)
+        state["pressure"] = round(state["pressure"] + walk(-5, 5), 2)
+        data = {"ID": self.box_id, **state}
+        if self.timestamps:
+            data["sent_ns"] = time.time_ns()
+        return json.dumps(data, separators=(",", ":"))
+
+    def garbage_line(self) -> str:
+        """A line mangled on the wire, a truncated reading or line noise."""
+        if self.random.random() < 0.5:
+            line = self.data_line()
+            return line[:self.random.randrange(1, len(line))]
+        return "".join(chr(self.random.randrange(0x21, 0x7f)) for _ in range(self.random.randrange(1, 40)))
+
+    def send(self, line: str):
+        data = (line + "\r\n").encode("utf-8")
+        try:
+            os.write(self.master, data)
+        except BlockingIOError:
+            # nobody is reading and the pty buffer is full, the line is lost
+            # like on a real serial port
+            self.stats["dropped"] += 1
+            return
+        self.stats["lines"] += 1
+        self.stats["bytes"] += len(data)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class BoxSimulator:
+    """A set of simulated boxes, linked in the same directory."""
+
+    def __init__(self, boxes: int, link_dir: str, first_id: int = 1, seed: int = None, **box_options):
+        self.link_dir = link_dir
+        if not os.path.exists(link_dir):
+            os.makedirs(link_dir)
+        rng = random.Random(seed)
+        self.boxes = [
+            SimulatedBox(box_id, os.path.join(link_dir, f"{LINK_PREFIX}{box_id}"),
+                         seed=rng.randrange(2 ** 32), **box_options)
+            for box_id in range(first_id, first_id + boxes)
+        ]
+
+    @property
+    def link_glob(self) -> str:
+        """Glob of the links, for PORT_LINKS_GLOB."""
+        return os.path.join(self.link_dir, f"{LINK_PREFIX}*")
+
+    def start(self):
+        for box in self.boxes:
+            box.start()
+
+    def stop(self):
+        for box in self.boxes:
+            box.stop_event.set()
+        for box in self.boxes:
+            box.join()
+
+    def stats(self) -> dict:
+        """Totals of the box counters."""
+        totals = {}
+        for box in self.boxes:
+            for key, value in box.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Arduino boxes on pseudo-terminals.")
+    parser.add_argument("--boxes", type=int, default=4)
+    parser.add_argument("--link-dir", default="/tmp/boxes", help="directory of the port links")
+    parser.add_argument("--first-id", type=int, default=1, help="ID of the first box")
+    parser.add_argument("--interval", type=float, default=10, help="seconds between the readings")
+    parser.add_argument("--garbage-rate", type=float, default=0, help="fraction of the lines mangled")
+    parser.add_argument("--disconnect-rate", type=float, default=0, help="chance of a disconnect per reading")
+    parser.add_argument("--reconnect-delay", type=float, default=3, help="seconds unplugged after a disconnect")
+    parser.add_argument("--hang-rate", type=float, default=0, help="chance of a firmware hang per reading")
+    parser.add_argument("--hang-duration", type=float, default=60, help="seconds silent after a hang")
+    parser.add_argument("--no-time-sync", action="store_true", help="don't wait for the time sync")
+    parser.add_argument("--timestamps", action="store_true", help="add the send time, sent_ns, to the data")
+    parser.add_argument("--duration", type=float, help="seconds to run, until interrupted by default")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    simulator = BoxSimulator(
+        args.boxes, args.link_dir, first_id=args.first_id, seed=args.seed,
+        interval=args.interval, garbage_rate=args.garbage_rate, disconnect_rate=args.disconnect_rate,
+        reconnect_delay=args.reconnect_delay, hang_rate=args.hang_rate, hang_duration=args.hang_duration,
+        time_sync=not args.no_time_sync, timestamps=args.timestamps,
+    )
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda sig, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda sig, frame: stop_event.set())
+    simulator.start()
+    started = datetime.now(timezone.utc).isoformat()
+    stop_event.wait(args.duration)
+    simulator.stop()
+    # the totals go to stdout, for the benchmarks
+    print(json.dumps({"started": started, "boxes": args.boxes, **simulator.stats()}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Durable on-disk spool for Influx points that could not be written."""
+import os
+import sqlite3
+import threading
+import time
+
+import config
+from config import logger
+
+
+class InfluxSpool:
+    """Durable spool for the line protocol batches that failed, backed by SQLite.
+
+    Each failed batch is stored as one row, so replaying a multi-hour
+    backlog is a handful of bulk reads instead of one query per point.
+    The spool is bounded by size and age, the oldest batches are evicted
+    first when a limit is exceeded. The size and point totals are only
+    computed on open, then kept up to date with the stored and removed
+    batches.
+    """
+
+    def __init__(
+            self,
+            path: str = config.INFLUX_SPOOL_PATH,
+            max_bytes: int = config.INFLUX_SPOOL_MAX_BYTES,
+            max_age: int = config.INFLUX_SPOOL_MAX_AGE,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        spool_dir = os.path.dirname(self.path)
+        if spool_dir and not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+        logger.info(f"Opening influx spool: {self.path}")
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created REAL NOT NULL,"
+            " points INTEGER NOT NULL,"
+            " payload TEXT NOT NULL)"
+        )
+        # the eviction by age
+        self.db.execute("CREATE INDEX IF NOT EXISTS batches_created ON batches (created)")
+        self.size_bytes = self._payload_bytes()
+        self.points = self._count_points()
+        if self.points:
+            logger.info(f"Influx spool holds {self.points} points to replay")
+
+    def _payload_bytes(self) -> int:
+        row = self.db.execute("SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM batches").fetchone()
+        return row[0]
+
+    def _count_points(self) -> int:
+        row = self.db.execute("SELECT COALESCE(SUM(points), 0) FROM batches").fetchone()
+        return row[0]
+
+    def _delete(self, where: str, params: tuple) -> int:
+        """Delete the matching batches and subtract them from the totals, must hold the lock."""
+        deleted, size_bytes, points = self.db.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0), COALESCE(SUM(points), 0) FROM batches WHERE {where}",
+            params).fetchone()
+        if deleted:
+            self.db.execute(f"DELETE FROM batches WHERE {where}", params)
+            self.size_bytes -= size_bytes
+            self.points -= points
+        return deleted
+
+    def __len__(self):
+        return self.points
+
+    def put(self, lines: list[str]):
+        """Store a batch of line protocol points."""
+        if not lines:
+            return
+        payload = "\n".join(lines)
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO batches (created, points, payload) VALUES (?, ?, ?)",
+                (time.time(), len(lines), payload),
+            )
+            self.size_bytes += len(payload)
+            self.points += len(lines)
+            self._evict()
+        logger.info(f"Spooled {len(lines)} points, {self.points} points in the spool")
+
+    def peek(self, max_points: int) -> list[tuple[int, list[str]]]:
+        """Return the oldest batches, holding at most max_points points.
+
+        The first batch is always returned, even if it is larger than
+        max_points, so the replay can't get stuck on it.
+        """
+        batches = []
+        total = 0
+        with self.lock:
+            cursor = self.db.execute("SELECT id, points, payload FROM batches ORDER BY id")
+            for batch_id, points, payload in cursor:
+                if batches and total + points > max_points:
+                    break
+                batches.append((batch_id, payload.split("\n")))
+                total += points
+            cursor.close()
+        return batches
+
+    def remove(self, batch_ids: list[int]):
+        """Remove the replayed batches from the spool."""
+        if not batch_ids:
+            return
+        with self.lock:
+            placeholders = ",".join("?" * len(batch_ids))
+            self._delete(f"id IN ({placeholders})", tuple(batch_ids))
+
+    def _evict(self):
+        """Drop the batches over the age and size limits, must hold the lock."""
+        evicted = self._delete("created < ?", (time.time() - self.max_age,))
+        while self.size_bytes > self.max_bytes:
+            row = self.db.execute("SELECT id FROM batches ORDER BY id LIMIT 1").fetchone()
+            if not row:
+                break
+            evicted += self._delete("id = ?", (row[0],))
+        if evicted:
+            logger.warning(f"Evicted {evicted} batches from the influx spool over the size or age limit")
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,403 @@
+"""Supervisor mode, sharding the serial ports over worker processes.
+
+Every worker process runs a serial port manager over its shard of the
+ports matched by PORTS_RE, so the serial reads, the line splitting, the
+JSON decoding and the deadband filter of the shards run in parallel. The
+decoded readings are sent to the supervisor in batches over a pipe, one
+pickled batch per message, and fanned out to the data handlers of the app
+by the supervisor. The workers also send snapshots of their metrics, the
+supervisor serves them with its own.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import re
+import signal
+import threading
+import time
+import zlib
+
+import config
+import datalog
+import metrics
+from config import hot_path_logger, logger
+from liveness import LivenessTracker
+from serial_reader import QueueReadingThread, SerialPortManager
+
+
+def port_shard(port_name: str, shards: int) -> int:
+    """Shard of a port, the numbered ports (/dev/box_12, ttyACM3) are dealt round robin by number."""
+    number = re.search(r'(\d+)$', port_name)
+    if number:
+        return int(number.group(1)) % shards
+    return zlib.crc32(port_name.encode('utf-8')) % shards
+
+
+class PipeDataLogger(datalog.DataLoggerBase):
+    """Data logger of a worker process, sending the readings to the supervisor.
+
+    The readings are sent in batches, when batch_size readings are buffered
+    and every flush_interval. The notifications to systemd and the ports of
+    the worker are sent over the same pipe.
+    """
+
+    def __init__(
+            self,
+            connection: multiprocessing.connection.Connection,
+            batch_size: int = config.WORKER_BATCH_SIZE,
+            flush_interval: float = config.WORKER_FLUSH_INTERVAL,
+    ):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # the connection is used from the data handler, monitor, liveness and flusher threads
+        self.lock = threading.Lock()
+        self.batch = []
+        self.stop_event = threading.Event()
+        self.flusher = threading.Thread(target=self.run_flusher, name="PipeFlusher", daemon=True)
+        self.flusher.start()
+
+    def log_results(self, data: dict, ts: int):
+        """Add the reading to the batch, sent when it's full."""
+        with self.lock:
+            self.batch.append((data, ts))
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        """Send the batch, must hold the lock."""
+        if self.batch:
+            batch, self.batch = self.batch, []
+            self.connection.send(('readings', batch))
+
+    def run_flusher(self):
+        """Flusher thread entry point."""
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                with self.lock:
+                    self._flush()
+            except Exception as e:
+                hot_path_logger.exception("Failed to send the readings to the supervisor: %s", e)
+
+    def send_notification(self, state: str):
+        """Forward a notification to systemd to the supervisor."""
+        with self.lock:
+            self.connection.send(('notify', state))
+
+    def send_ports(self, ports: list[str]):
+        """Report the ports read by the worker."""
+        with self.lock:
+            self.connection.send(('ports', ports))
+
+    def send_metrics(self):
+        """Send the counters and gauges of the worker."""
+        snapshot = metrics.registry.snapshot()
+        with self.lock:
+            self.connection.send(('metrics', snapshot))
+
+    def close(self):
+        """Send the last batch."""
+        self.stop_event.set()
+        self.flusher.join()
+        with self.lock:
+            self._flush()
+
+
+def worker_main(index: int, shards: int, connection: multiprocessing.connection.Connection):
+    """Entry point of a worker process, reading the ports of its shard."""
+    # a Ctrl-C in the terminal reaches the whole process group, the supervisor stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda sig, frame: stopping.set())
+
+    pipe_logger = PipeDataLogger(connection)
+    # the supervisor aggregates the watchdog pings and the status of the workers
+    config.notify_forwarder = pipe_logger.send_notification
+    # the supervisor alerts when none of the workers has a port
+    port_manager = SerialPortManager(
+        port_filter=lambda port_name: port_shard(port_name, shards) == index,
+        alert_on_no_ports=False)
+    port_manager.add_data_handler(pipe_logger)
+    port_manager.start()
+
+    parent = multiprocessing.parent_process()
+    while not stopping.wait(config.PORT_SCAN_INTERVAL):
+        if parent is not None and not parent.is_alive():
+            logger.error("Supervisor is gone, stopping...")
+            break
+        try:
+            pipe_logger.send_ports(sorted(port_manager.port_monitor.ports.copy()))
+            if config.METRICS_ENABLED:
+                pipe_logger.send_metrics()
+        except OSError as e:
+            logger.error(f"Failed to report the ports to the supervisor: {str(e)}")
+    port_manager.stop()
+
+
+class WorkerProcess:
+    """A worker process of the supervisor and what it reported."""
+
+    def __init__(self, index: int, restart_delay: float):
+        self.index = index
+        self.process = None
+        self.connection = None
+        self.started = 0.0
+        self.last_heartbeat = 0.0
+        self.restart_at = 0.0
+        self.restart_delay = restart_delay
+        self.killed = False
+        self.ports = []
+        self.status = None
+        # name of the worker's metrics in the registry of the supervisor
+        self.source = f'worker{index}'
+
+
+class Supervisor:
+    """Shards the serial ports over worker processes, feeding the data handlers.
+
+    The supervisor is used like the serial port manager, the readings of
+    the workers are fanned out to the data handlers by a queue reader. A
+    worker that exits is started again, with the delay doubled while it
+    keeps crashing right away. A worker without a watchdog ping for the
+    heartbeat timeout is killed and started again. systemd gets a watchdog
+    ping while all the workers ping, and the stale boxes of all the workers
+    in the status.
+    """
+
+    CHECK_INTERVAL = 1.0
+    MAX_RESTART_DELAY = 60.0
+    STOP_TIMEOUT = 30.0
+
+    def __init__(
+            self,
+            processes: int = config.WORKER_PROCESSES,
+            heartbeat_timeout: float = config.WORKER_HEARTBEAT_TIMEOUT,
+            restart_delay: float = config.WORKER_RESTART_DELAY,
+            no_ports_timeout: int = config.NO_BOXES_TIMEOUT,
+    ):
+        self.processes = processes
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+        self.no_ports_timeout = no_ports_timeout
+        # the workers start from a fresh interpreter, forking the threads of the app is unsafe
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [WorkerProcess(index, restart_delay) for index in range(processes)]
+        self.reading_queue = queue.Queue()
+        metrics.READING_QUEUE_DEPTH.set_function(self.reading_queue.qsize)
+        self.queue_reader = None
+        self.data_handlers = []
+        self.data_loggers = []
+        self.status = None
+        self.last_ports_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="Supervisor")
+        self.stop_event = threading.Event()
+
+    def add_data_handler(self, data_handler: datalog.DataLoggerBase):
+        """Add logging data handler."""
+        self.data_handlers.append(data_handler.handle_data)
+        self.data_loggers.append(data_handler)
+        logger.info("Added %s data handler", data_handler)
+
+    def queue_depths(self) -> dict[str, int]:
+        """Number of items waiting for each data handler."""
+        if not self.queue_reader:
+            return {}
+        return self.queue_reader.queue_depths()
+
+    def start(self):
+        """Start the data handlers and the worker processes."""
+        logger.info(f"Starting supervisor, {self.processes} worker processes...")
+        self.queue_reader = QueueReadingThread(self.reading_queue, self.data_handlers)
+        self.queue_reader.start()
+        for worker in self.workers:
+            self.start_worker(worker)
+        self.thread.start()
+        logger.info("Started supervisor")
+
+    def start_worker(self, worker: WorkerProcess):
+        """Start the process of a worker."""
+        self.drain(worker)
+        reader, writer = self.context.Pipe(duplex=False)
+        # the worker reads its index from the environment when it imports the config
+        os.environ['WORKER_INDEX'] = str(worker.index)
+        try:
+            process = self.context.Process(
+                target=worker_main, args=(worker.index, self.processes, writer),
+                name=f"Worker-{worker.index}", daemon=True)
+            process.start()
+        finally:
+            del os.environ['WORKER_INDEX']
+        # the worker has its own end, the reader gets EOF when it exits
+        writer.close()
+        worker.process = process
+        worker.connection = reader
+        worker.started = worker.last_heartbeat = time.monotonic()
+        worker.killed = False
+        worker.ports = []
+        if worker.status is not None:
+            worker.status = None
+            self.notify_status()
+        logger.info(f"Started worker {worker.index}, pid {process.pid}")
+
+    def run(self):
+        """Supervisor thread entry point, receiving from the workers and checking them."""
+        next_check = time.monotonic()
+        stop_deadline = None
+        while True:
+            now = time.monotonic()
+            if self.stop_event.is_set():
+                if stop_deadline is None:
+                    stop_deadline = now + self.STOP_TIMEOUT
+                    self.stop_workers()
+                if not any(worker.connection for worker in self.workers) or now > stop_deadline:
+                    break
+            elif now >= next_check:
+                try:
+                    self.check(now)
+                except Exception as e:
+                    config.capture_exception(e)
+                    logger.exception(f"Error checking the workers: {str(e)}")
+                next_check = now + self.CHECK_INTERVAL
+            connections = {worker.connection: worker for worker in self.workers if worker.connection is not None}
+            timeout = max(0.0, next_check - time.monotonic())
+            if not connections:
+                self.stop_event.wait(timeout)
+                continue
+            for connection in multiprocessing.connection.wait(list(connections), timeout):
+                self.receive(connections[connection])
+        self.join_workers()
+
+    def receive(self, worker: WorkerProcess):
+        """Receive a message from a worker."""
+        try:
+            kind, payload = worker.connection.recv()
+        except (EOFError, OSError):
+            # the worker exited, it's started again by the next check
+            worker.connection.close()
+            worker.connection = None
+            return
+        except Exception as e:
+            config.capture_exception(e)
+            logger.exception(f"Invalid message from worker {worker.index}: {str(e)}")
+            return
+        if kind == 'readings':
+            put = self.reading_queue.put
+            for data, ts in payload:
+                put(datalog.Reading(None, None, ts, data))
+        elif kind == 'notify':
+            self.handle_notification(worker, payload)
+        elif kind == 'ports':
+            worker.ports = payload
+        elif kind == 'metrics':
+            metrics.registry.merge(worker.source, payload)
+
+    def drain(self, worker: WorkerProcess):
+        """Receive what a worker that exited sent last, up to the end of its pipe."""
+        while worker.connection is not None and worker.connection.poll():
+            self.receive(worker)
+        if worker.connection is not None:
+            worker.connection.close()
+            worker.connection = None
+
+    def handle_notification(self, worker: WorkerProcess, state: str):
+        """Aggregate a notification to systemd of a worker."""
+        if state == config.NOTIFY_WATCHDOG:
+            worker.last_heartbeat = time.monotonic()
+        elif state.startswith('STATUS='):
+            worker.status = state[len('STATUS='):]
+            self.notify_status()
+
+    def notify_status(self):
+        """Report the stale boxes of all the workers in the systemd status."""
+        stale = [worker.status for worker in self.workers
+                 if worker.status and worker.status != LivenessTracker.STATUS_OK]
+        status = '; '.join(stale) or LivenessTracker.STATUS_OK
+        if status != self.status:
+            self.status = status
+            config.notify_systemd(f"STATUS={status}")
+
+    def check(self, now: float):
+        """Restart the workers that exited or hung, ping the systemd watchdog."""
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    metrics.WORKER_RESTARTS.inc()
+                    self.start_worker(worker)
+            elif not worker.process.is_alive():
+                self.worker_exited(worker, now)
+            elif now - worker.last_heartbeat > self.heartbeat_timeout and not worker.killed:
+                logger.error(f"Worker {worker.index} sent no watchdog ping for "
+                             f"{now - worker.last_heartbeat:.0f} seconds, killing it")
+                config.capture_message(f"Worker {worker.index} stopped responding, restarting it")
+                worker.process.kill()
+                worker.killed = True
+
+        # a worker that can't be killed, e.g. stuck in the USB driver, stops
+        # the pings and systemd restarts the service
+        if all(worker.process is None or now - worker.last_heartbeat <= self.heartbeat_timeout
+               for worker in self.workers):
+            config.notify_systemd(config.NOTIFY_WATCHDOG)
+
+        if any(worker.ports for worker in self.workers):
+            self.last_ports_time = now
+        elif now - self.last_ports_time > self.no_ports_timeout:
+            config.capture_message("No serial ports available! Check the connections.")
+            self.last_ports_time = now
+
+    def worker_exited(self, worker: WorkerProcess, now: float):
+        """Schedule the restart of a worker that exited."""
+        uptime = now - worker.started
+        if uptime >= self.MAX_RESTART_DELAY:
+            worker.restart_delay = self.restart_delay
+        worker.restart_at = now + worker.restart_delay
+        logger.error(f"Worker {worker.index} exited with code {worker.process.exitcode} after "
+                     f"{uptime:.0f} seconds, restarting it in {worker.restart_delay:g} seconds")
+        config.capture_message(f"Worker {worker.index} exited with code {worker.process.exitcode}, restarting it")
+        # a worker crashing right away again is restarted later and later
+        worker.restart_delay = min(worker.restart_delay * 2, self.MAX_RESTART_DELAY)
+        worker.process.close()
+        worker.process = None
+        worker.ports = []
+        # the batches and metrics it sent before exiting, its counts are kept
+        self.drain(worker)
+        metrics.registry.retire(worker.source)
+
+    def stop_workers(self):
+        """Ask the workers to stop, they send what they have buffered first."""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                logger.info(f"Stopping worker {worker.index}...")
+                worker.process.terminate()
+
+    def join_workers(self):
+        """Wait for the workers to exit, killing the ones that didn't."""
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            worker.process.join(1)
+            if worker.process.is_alive():
+                logger.warning(f"Worker {worker.index} did not stop, killing it")
+                worker.process.kill()
+                worker.process.join()
+            if worker.connection is not None:
+                worker.connection.close()
+                worker.connection = None
+            logger.info(f"Stopped worker {worker.index}")
+
+    def stop(self):
+        """Stop the workers, then the data handlers."""
+        logger.info("Stopping supervisor...")
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.queue_reader:
+            self.queue_reader.stop()
+        # let the data loggers flush what they have buffered
+        for data_logger in self.data_loggers:
+            try:
+                data_logger.close()
+            except Exception as e:
+                config.capture_exception(e)
+                logger.exception(f"Error closing {data_logger} data handler: {str(e)}")
+        logger.info("Stopped supervisor")
@@ -0,0 +1,38 @@
+"""Test setup, run from the data_logger directory::
+
+    python -m pytest tests
+
+The app modules are imported from the data_logger directory. The app logs
+and data logs go to a temporary directory and Sentry is disabled, like for
+the benchmarks.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+TEST_DIR = tempfile.mkdtemp(prefix='box-logger-test-')
+# the links of the simulated boxes
+PORTS_DIR = os.path.join(TEST_DIR, 'ports')
+
+os.environ.setdefault('SENTRY_DSN', '')
+# the Influx clients are only created on the first write, never in the tests
+os.environ.setdefault('INFLUXDB_TOKEN', 'test-token')
+os.environ.setdefault('LOG_FILE_PATH', os.path.join(TEST_DIR, 'app.log'))
+os.environ.setdefault('DATA_LOG_PATH', os.path.join(TEST_DIR, 'data_log'))
+os.environ.setdefault('HOTPLUG_BACKEND', 'none')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('PORT_LINKS_GLOB', os.path.join(PORTS_DIR, 'box_sim*'))
+os.environ.setdefault('PORTS_RE', 'box_sim')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def ports_dir() -> str:
+    """Directory of the links of the simulated boxes, matched by the port scan."""
+    os.makedirs(PORTS_DIR, exist_ok=True)
+    yield PORTS_DIR
+    for name in os.listdir(PORTS_DIR):
+        os.remove(os.path.join(PORTS_DIR, name))
@@ -0,0 +1,77 @@
+"""Per box window aggregation of the readings written to Influx."""
+from datalog import InfluxDataLogger, WindowAggregator
+
+SECOND = 10**9
+
+
+def stats(window) -> dict:
+    return {field: values for field, *values in window.stats()}
+
+
+def test_window_is_emitted_when_the_next_window_starts():
+    aggregator = WindowAggregator(10 * SECOND)
+    key = ("arduino_box_data", "1")
+
+    assert aggregator.add(key, {"co2": 400.0}, 100 * SECOND) == []
+    assert aggregator.add(key, {"co2": 600.0}, 103 * SECOND) == []
+    assert aggregator.add(key, {"co2": 500.0}, 109 * SECOND) == []
+
+    (done_key, window), = aggregator.add(key, {"co2": 700.0}, 110 * SECOND)
+    assert done_key == key
+    assert window.start == 100 * SECOND
+    assert stats(window) == {"co2": [400.0, 600.0, 500.0, 500.0]}
+    assert aggregator.windows[key].start == 110 * SECOND
+
+
+def test_fields_missing_in_some_readings_are_aggregated_separately():
+    aggregator = WindowAggregator(10 * SECOND)
+    key = ("arduino_box_data", "1")
+
+    aggregator.add(key, {"co2": 400.0}, 100 * SECOND)
+    aggregator.add(key, {"co2": 410.0, "humidity": 50.0}, 101 * SECOND)
+
+    (_, window), = aggregator.flush()
+    assert stats(window) == {"co2": [400.0, 410.0, 405.0, 410.0], "humidity": [50.0, 50.0, 50.0, 50.0]}
+    assert aggregator.windows == {}
+
+
+def test_quiet_box_window_is_expired_by_the_other_boxes():
+    aggregator = WindowAggregator(10 * SECOND)
+    quiet, busy = ("arduino_box_data", "1"), ("arduino_box_data", "2")
+
+    aggregator.add(quiet, {"co2": 400.0}, 100 * SECOND)
+    assert aggregator.add(busy, {"co2": 400.0}, 115 * SECOND) == []
+
+    done = aggregator.add(busy, {"co2": 400.0}, 120 * SECOND)
+    assert [(key, window.start) for key, window in done] == [(busy, 110 * SECOND), (quiet, 100 * SECOND)]
+    assert list(aggregator.windows) == [busy]
+
+
+class RecordingBatchWriter:
+    def __init__(self):
+        self.lines = []
+
+    def add(self, line: str):
+        self.lines.append(line)
+
+    def stop(self):
+        pass
+
+
+def test_influx_data_logger_writes_the_window_stats():
+    data_logger = InfluxDataLogger(batching=False, aggregate_window=10)
+    data_logger.batch_writer = RecordingBatchWriter()
+
+    data_logger.log_results({"ID": 1, "co2": 400, "%RH": 50}, 100 * SECOND)
+    data_logger.log_results({"ID": 1, "co2": 600, "%RH": 52}, 105 * SECOND)
+    assert data_logger.batch_writer.lines == []
+
+    data_logger.log_results({"ID": 1, "co2": 500, "%RH": 51}, 110 * SECOND)
+    data_logger.close()
+
+    assert data_logger.batch_writer.lines == [
+        "arduino_box_data,box_id=1 co2_last=600,co2_max=600,co2_mean=500,co2_min=400,"
+        "humidity_last=52,humidity_max=52,humidity_mean=51,humidity_min=50 100000000000",
+        "arduino_box_data,box_id=1 co2_last=500,co2_max=500,co2_mean=500,co2_min=500,"
+        "humidity_last=51,humidity_max=51,humidity_mean=51,humidity_min=51 110000000000",
+    ]
@@ -0,0 +1,60 @@
+"""Backfill of the data logs, without an Influx server."""
+import pytest
+
+from backfill import Backfill
+from datalog import RotatingFileDataLogger
+
+START = 1_700_000_000 * 10**9
+MINUTE = 60 * 10**9
+
+
+class RecordingBackfill(Backfill):
+    """Backfill with the points already in Influx given, recording the batches."""
+
+    def __init__(self, log_path: str, existing: dict[str, set]):
+        super().__init__(log_path, batch_size=100, workers=2)
+        self.existing = existing
+        self.batches = []
+
+    def existing_times(self, box_id: str, start_ts: int, end_ts: int) -> set[int]:
+        return self.existing.get(box_id, set())
+
+    def write_batch(self, batch: list[str]):
+        with self.lock:
+            self.batches.append(batch)
+            self.stats["written"] += len(batch)
+
+
+@pytest.fixture
+def log_path(tmp_path) -> str:
+    data_logger = RotatingFileDataLogger(str(tmp_path), index_interval=0)
+    for i in range(300):
+        data_logger.log_results({"ID": 1 + i % 3, "co2": 400 + i}, START + i * MINUTE)
+    for handler in list(data_logger.data_logger.handlers):
+        data_logger.data_logger.removeHandler(handler)
+        handler.close()
+    return str(tmp_path)
+
+
+def test_points_already_in_influx_are_skipped(log_path):
+    # read back from Influx in microseconds
+    existing = {"1": {(START + i * MINUTE) // 1000 for i in range(0, 300, 3)}}
+    backfill = RecordingBackfill(log_path, existing)
+
+    stats = backfill.run()
+
+    assert stats["read"] == 300
+    assert stats["existing"] == 100
+    assert stats["written"] == 200
+    lines = [line for batch in backfill.batches for line in batch]
+    assert len(lines) == 200
+    assert not any(",box_id=1 " in line for line in lines)
+    assert any(",box_id=2 " in line for line in lines)
+
+
+def test_backfill_is_limited_to_the_boxes_and_range(log_path):
+    backfill = RecordingBackfill(log_path, {})
+
+    stats = backfill.run(START + 100 * MINUTE, START + 199 * MINUTE, {"2"})
+
+    assert stats["read"] == stats["written"] == 34
@@ -0,0 +1,92 @@
+"""Influx batch writer batching and bounding the buffered points."""
+import threading
+import time
+
+import config
+from datalog import InfluxBatchWriter
+
+
+class RecordingWriteApi:
+    """Write API recording the written batches."""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def write(self, bucket: str, record: list[str]):
+        with self.lock:
+            self.batches.append(list(record))
+
+
+def points(count: int) -> list[str]:
+    return [f"box,ID=1 co2={i} {i}" for i in range(count)]
+
+
+def wait_until(condition: callable, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_full_batch_is_written_without_waiting_for_the_flush_interval():
+    write_api = RecordingWriteApi()
+    writer = InfluxBatchWriter(write_api, "bucket", batch_size=5, flush_interval=60, buffer_size=100)
+    writer.start()
+    try:
+        for line in points(12):
+            writer.add(line)
+        assert wait_until(lambda: len(write_api.batches) == 2)
+        assert write_api.batches == [points(12)[:5], points(12)[5:10]]
+    finally:
+        writer.stop()
+    # the partial batch is drained on stop
+    assert write_api.batches[-1] == points(12)[10:]
+
+
+def test_partial_batch_is_written_after_the_flush_interval():
+    write_api = RecordingWriteApi()
+    writer = InfluxBatchWriter(write_api, "bucket", batch_size=100, flush_interval=0.1, buffer_size=1000)
+    writer.start()
+    try:
+        for line in points(3):
+            writer.add(line)
+        assert wait_until(lambda: write_api.batches)
+        assert write_api.batches == [points(3)]
+    finally:
+        writer.stop()
+
+
+def test_buffer_overflow_drops_the_oldest_points():
+    write_api = RecordingWriteApi()
+    # not started, the points stay in the buffer
+    writer = InfluxBatchWriter(write_api, "bucket", batch_size=100, flush_interval=60, buffer_size=4)
+    for line in points(7):
+        writer.add(line)
+
+    assert writer.dropped_points == 3
+    assert list(writer.buffer) == points(7)[3:]
+
+    writer.start()
+    writer.stop()
+    assert write_api.batches == [points(7)[3:]]
+
+
+def test_failed_batch_is_dropped_after_the_retries_without_a_spool(monkeypatch):
+    attempts = []
+    reported = []
+    monkeypatch.setattr(config, "capture_exception", reported.append)
+
+    class FailingWriteApi:
+        def write(self, bucket: str, record: list[str]):
+            attempts.append(record)
+            raise ConnectionError("Influx is down")
+
+    writer = InfluxBatchWriter(FailingWriteApi(), "bucket", batch_size=10, max_retries=2,
+                               retry_backoff=0.01, retry_max_delay=0.02)
+    assert not writer.write_batch(points(3))
+    assert len(attempts) == 3
+    assert not writer.healthy
+    assert [type(e) for e in reported] == [ConnectionError]
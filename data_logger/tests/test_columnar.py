@@ -0,0 +1,60 @@
+"""Columnar files written by the columnar data logger and read back."""
+import glob
+import os
+import time
+
+from columnar import ColumnarDataLogger, read_columnar_file
+
+DAY_START = int(time.mktime((2024, 3, 1, 0, 0, 0, 0, 0, -1))) * 10**9
+
+
+def reading(box_id: int, minute: int) -> tuple[dict, int]:
+    return {"ID": box_id, "co2": 400 + minute, "boxTempC": 20.5}, DAY_START + minute * 60 * 10**9
+
+
+def read_box(log_path: str, box_id: int) -> list:
+    rows = []
+    for path in sorted(glob.glob(os.path.join(log_path, f"box_{box_id}", "*.cols"))):
+        rows.extend(read_columnar_file(path))
+    return rows
+
+
+def test_readings_are_read_back(tmp_path):
+    data_logger = ColumnarDataLogger(str(tmp_path), chunk_rows=4)
+    for minute in range(10):
+        data_logger.log_results(*reading(1 + minute % 2, minute))
+    data_logger.close()
+
+    rows = read_box(str(tmp_path), 1)
+    assert [ts for ts, _ in rows] == [reading(1, minute)[1] for minute in range(0, 10, 2)]
+    assert rows[1][1] == {"co2": 402.0, "boxTempC": 20.5}
+    assert len(read_box(str(tmp_path), 2)) == 5
+
+
+def test_buffered_rows_stay_under_one_chunk(tmp_path):
+    data_logger = ColumnarDataLogger(str(tmp_path), chunk_rows=10)
+    for minute in range(100):
+        data_logger.log_results(*reading(1 + minute % 8, minute))
+        assert data_logger.buffered < 10
+    data_logger.close()
+
+    assert sum(len(read_box(str(tmp_path), box_id)) for box_id in range(1, 9)) == 100
+
+
+def test_chunks_after_a_torn_chunk_are_read(tmp_path):
+    data_logger = ColumnarDataLogger(str(tmp_path), chunk_rows=2)
+    for minute in range(4):
+        data_logger.log_results(*reading(1, minute))
+    data_logger.close()
+    path, = glob.glob(os.path.join(str(tmp_path), "box_1", "*.cols"))
+    # a crash in the middle of writing a chunk
+    with open(path, "ab") as f:
+        f.write(b"BXC1\x01\x00torn")
+
+    # the app is restarted
+    data_logger = ColumnarDataLogger(str(tmp_path), chunk_rows=2)
+    for minute in range(4, 8):
+        data_logger.log_results(*reading(1, minute))
+    data_logger.close()
+
+    assert [ts for ts, _ in read_columnar_file(path)] == [reading(1, minute)[1] for minute in range(8)]
@@ -0,0 +1,52 @@
+"""Data logger base class, handing the readings to log_results."""
+import time
+
+import datalog
+
+
+class ListDataLogger(datalog.DataLoggerBase):
+    def __init__(self):
+        self.readings = []
+
+    def log_results(self, data: dict, ts: int):
+        self.readings.append((data, ts))
+
+
+class LegacyDataLogger(datalog.DataLoggerBase):
+    """Data logger written before log_results got the receive time."""
+
+    def __init__(self):
+        self.readings = []
+
+    def log_results(self, data):
+        self.readings.append(data)
+
+
+def test_decoded_reading_is_logged_with_its_receive_time():
+    data_logger = ListDataLogger()
+
+    data_logger.handle_data(datalog.Reading(b'', 'port', 42, {"ID": 1}))
+
+    assert data_logger.readings == [({"ID": 1}, 42)]
+
+
+def test_raw_line_is_decoded_and_stamped():
+    data_logger = ListDataLogger()
+    before = time.time_ns()
+
+    data_logger.handle_data('{"ID":1,"co2":450}')
+    data_logger.handle_data('not json')
+
+    (data, ts), = data_logger.readings
+    assert data == {"ID": 1, "co2": 450}
+    assert abs(ts - before) < 10**9
+
+
+def test_log_results_without_ts_still_works():
+    data_logger = LegacyDataLogger()
+
+    data_logger.handle_data(datalog.Reading(b'', 'port', 42, {"ID": 1}))
+    data_logger.handle_data('{"ID":2}')
+
+    assert not LegacyDataLogger.log_results_takes_ts
+    assert data_logger.readings == [{"ID": 1}, {"ID": 2}]
@@ -0,0 +1,107 @@
+"""Deadband filter dropping the unchanged fields of the readings."""
+import math
+import queue
+
+import pytest
+
+import datalog
+from deadband import DeadbandFilter, parse_tolerances
+from serial_reader import QueueReadingThread
+
+SECOND = 10**9
+
+
+@pytest.fixture
+def deadband():
+    return DeadbandFilter({"co2": 5, "%RH": 0.5}, keyframe_interval=60, keep_columns=('ID',))
+
+
+def test_parse_tolerances():
+    assert parse_tolerances("co2=5, %RH=0.5,,boxTempC=0.1") == {"co2": 5.0, "%RH": 0.5, "boxTempC": 0.1}
+    with pytest.raises(ValueError):
+        parse_tolerances("co2")
+
+
+def test_first_reading_is_a_keyframe(deadband):
+    data = {"ID": 1, "co2": 450, "%RH": 50.0, "boxTempC": 34.1}
+
+    assert deadband.apply(data, 0) is data
+
+
+def test_fields_within_tolerance_are_dropped(deadband):
+    deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0, "boxTempC": 34.1}, 0)
+
+    # the fields without a tolerance are always kept
+    assert deadband.apply({"ID": 1, "co2": 453, "%RH": 50.2, "boxTempC": 34.1}, SECOND) == {"ID": 1, "boxTempC": 34.1}
+    assert deadband.apply({"ID": 1, "co2": 456, "%RH": 50.4}, 2 * SECOND) == {"ID": 1, "co2": 456}
+
+
+def test_slow_drift_is_sent_once_it_adds_up(deadband):
+    deadband.apply({"ID": 1, "co2": 450}, 0)
+
+    sent = [deadband.apply({"ID": 1, "co2": 450 + step * 2}, step * SECOND) for step in range(1, 6)]
+
+    # compared to the last value sent, not the last value read
+    assert sent == [None, None, {"ID": 1, "co2": 456}, None, None]
+
+
+def test_all_suppressed_reading_is_dropped_and_counted(deadband):
+    deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0}, 0)
+    dropped_fields = deadband.dropped_fields.value
+    dropped_readings = deadband.dropped_readings.value
+
+    assert deadband.apply({"ID": 1, "co2": 451, "%RH": 50.1}, SECOND) is None
+    assert deadband.dropped_fields.value == dropped_fields + 2
+    assert deadband.dropped_readings.value == dropped_readings + 1
+
+
+def test_full_reading_is_sent_every_keyframe_interval(deadband):
+    deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0}, 0)
+    assert deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0}, 59 * SECOND) is None
+
+    data = {"ID": 1, "co2": 450, "%RH": 50.0}
+    assert deadband.apply(data, 60 * SECOND) is data
+    assert deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0}, 61 * SECOND) is None
+
+
+def test_clock_going_back_starts_a_keyframe(deadband):
+    deadband.apply({"ID": 1, "co2": 450}, 100 * SECOND)
+
+    data = {"ID": 1, "co2": 450}
+    assert deadband.apply(data, 90 * SECOND) is data
+
+
+def test_boxes_are_filtered_separately(deadband):
+    deadband.apply({"ID": 1, "co2": 450}, 0)
+
+    data = {"ID": 2, "co2": 450}
+    assert deadband.apply(data, SECOND) is data
+    assert deadband.apply({"ID": 1, "co2": 450}, SECOND) is None
+
+
+def test_missing_and_non_numeric_fields_are_kept(deadband):
+    # missing in the keyframe, unknown until sent
+    deadband.apply({"ID": 1, "co2": 450}, 0)
+    assert deadband.apply({"ID": 1, "co2": 450, "%RH": 50.0}, SECOND) == {"ID": 1, "%RH": 50.0}
+
+    assert deadband.apply({"ID": 1, "co2": "n/a"}, 2 * SECOND) == {"ID": 1, "co2": "n/a"}
+    assert math.isnan(deadband.boxes[1].values[deadband.slots["co2"]])
+    assert deadband.apply({"ID": 1, "co2": 450}, 3 * SECOND) == {"ID": 1, "co2": 450}
+
+
+def test_queue_reader_skips_the_suppressed_readings(deadband):
+    readings = []
+
+    class ListDataLogger(datalog.DataLoggerBase):
+        def log_results(self, data: dict, ts: int):
+            readings.append(data)
+
+    reading_queue = queue.Queue()
+    thread = QueueReadingThread(reading_queue, [ListDataLogger().handle_data], deadband_filter=deadband)
+    thread.start()
+    for ts, line in enumerate([b'{"ID":1,"co2":450,"%RH":50.0}', b'{"ID":1,"co2":452,"%RH":50.1}',
+                               b'{"ID":1,"co2":460,"%RH":50.1}']):
+        reading_queue.put(datalog.Reading(line, 'port', ts * SECOND))
+    thread.stop()
+
+    assert readings == [{"ID": 1, "co2": 450, "%RH": 50.0}, {"ID": 1, "co2": 460}]
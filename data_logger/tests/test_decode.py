@@ -0,0 +1,46 @@
+"""Decoding the JSON lines of the readings."""
+import pytest
+
+import metrics
+from datalog import Reading, decode_reading
+
+
+def parse_failures(reason: str) -> int:
+    return metrics.PARSE_FAILURES.labels(reason).value
+
+
+def test_valid_line_is_decoded_into_the_reading():
+    reading = Reading(b'{"ID": 3, "co2": 450, "%RH": 51.5}', 'ttyUSB0', 1)
+
+    assert decode_reading(reading)
+    assert reading.data == {"ID": 3, "co2": 450, "%RH": 51.5}
+
+
+def test_str_line_is_decoded():
+    reading = Reading('{"ID": 3}', 'ttyUSB0', 1)
+
+    assert decode_reading(reading)
+    assert reading.data == {"ID": 3}
+
+
+@pytest.mark.parametrize("line, reason", [
+    (b'{"ID": 3, "co2": ', 'invalid_json'),
+    (b'\xff\xfe garbage', 'invalid_json'),
+    (b'[1, 2, 3]', 'not_an_object'),
+    (b'"status"', 'not_an_object'),
+    (b'{"co2": 450}', 'missing_column'),
+])
+def test_invalid_line_is_rejected_and_counted(line, reason):
+    before = parse_failures(reason)
+    reading = Reading(line, 'ttyUSB0', 1)
+
+    assert not decode_reading(reading)
+    assert reading.data is None
+    assert parse_failures(reason) == before + 1
+
+
+def test_required_columns_can_be_given():
+    reading = Reading(b'{"ID": 3, "co2": 450}', 'ttyUSB0', 1)
+
+    assert not decode_reading(reading, ['ID', 'co2', '%RH'])
+    assert decode_reading(reading, ['ID', 'co2'])
@@ -0,0 +1,118 @@
+"""Deduplicated, non-blocking Sentry reporting."""
+import threading
+import time
+
+import pytest
+
+from config import ErrorAggregator
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """The events sent to Sentry, as (fingerprint, event)."""
+    events = []
+
+    def send(fingerprint, event):
+        events.append((fingerprint, event))
+
+    monkeypatch.setattr(ErrorAggregator, "_send", staticmethod(send))
+    return events
+
+
+def raise_error(message: str):
+    try:
+        raise ValueError(message)
+    except ValueError as e:
+        return e
+
+
+def test_repeats_are_sent_as_one_summary(sent):
+    reporter = ErrorAggregator(summary_interval=300)
+    errors = [raise_error(f"bad line {i}") for i in range(5)]
+    for error in errors:
+        reporter.capture_exception(error)
+    reporter.stop()
+
+    (first_fingerprint, first), (summary_fingerprint, summary) = sent
+    assert first == ('exception', errors[0])
+    assert summary_fingerprint == first_fingerprint
+    assert summary == ('message', "ValueError: bad line 4 (repeated 4 times in the last 300 seconds)", 'warning')
+
+
+def test_errors_raised_in_different_places_are_sent_separately(sent):
+    reporter = ErrorAggregator(summary_interval=300)
+    first = raise_error("bad line")
+    second = ValueError("bad line")
+    try:
+        raise second
+    except ValueError:
+        pass
+    reporter.capture_exception(first)
+    reporter.capture_exception(second)
+    reporter.capture_message("Influx is unreachable")
+    reporter.capture_message("Influx is unreachable")
+    reporter.stop()
+
+    assert [event for _, event in sent] == [
+        ('exception', first),
+        ('exception', second),
+        ('message', "Influx is unreachable", 'error'),
+        ('message', "Influx is unreachable (repeated 1 times in the last 300 seconds)", 'warning'),
+    ]
+
+
+def test_fingerprint_without_repeats_is_forgotten(sent):
+    reporter = ErrorAggregator(summary_interval=300)
+    reporter.capture_message("port lost")
+    reporter.capture_message("port lost")
+    reporter.summarize()
+    # repeated in the last interval, still tracked
+    reporter.capture_message("port lost")
+    reporter.summarize()
+    reporter.summarize()
+    # quiet for an interval, sent right away again
+    reporter.capture_message("port lost")
+    reporter.stop()
+
+    assert [event[1] for _, event in sent] == [
+        "port lost",
+        "port lost (repeated 1 times in the last 300 seconds)",
+        "port lost (repeated 1 times in the last 300 seconds)",
+        "port lost",
+    ]
+
+
+def test_summaries_are_sent_every_interval(sent):
+    reporter = ErrorAggregator(summary_interval=0.05)
+    reporter.capture_message("port lost")
+    reporter.capture_message("port lost")
+    reporter.capture_message("port lost")
+    try:
+        deadline = time.monotonic() + 5
+        while len(sent) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [event[1] for _, event in sent] == [
+            "port lost", "port lost (repeated 2 times in the last 0.05 seconds)"]
+    finally:
+        reporter.stop()
+
+
+def test_full_queue_drops_the_events_without_blocking(monkeypatch):
+    release = threading.Event()
+    sent = []
+
+    def send(fingerprint, event):
+        release.wait(5)
+        sent.append(event)
+
+    monkeypatch.setattr(ErrorAggregator, "_send", staticmethod(send))
+    reporter = ErrorAggregator(summary_interval=300, queue_size=2)
+    for i in range(10):
+        reporter.capture_message(f"error {i}")
+
+    # two events queued, and one taken by the blocked worker if it started
+    dropped = reporter.dropped
+    assert dropped in (7, 8)
+    release.set()
+    reporter.stop()
+    assert len(sent) == 10 - dropped
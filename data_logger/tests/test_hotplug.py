@@ -0,0 +1,152 @@
+"""Port monitor driven by hotplug events, with boxes simulated on pseudo-terminals."""
+import os
+import queue
+import threading
+import time
+
+import pytest
+
+from hotplug import HOTPLUG_ADD, HOTPLUG_REMOVE, SimulatedEventSource
+from serial_reader import SerialPortMonitor
+from simulator import SimulatedBox
+
+
+class FakePortReader:
+    """Port reader recording its start and stop."""
+
+    def __init__(self, port_name: str):
+        self.port_name = port_name
+        self.started = False
+        self.stopped = False
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.stopped = True
+
+    def is_alive(self) -> bool:
+        return self.started and not self.stopped
+
+
+def wait_until(condition: callable, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class CountingMonitor(SerialPortMonitor):
+    """Port monitor counting its scans and keeping its port readers."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, port_reader_factory=self.create_reader, **kwargs)
+        self.scans = 0
+        self.readers = {}
+
+    def create_reader(self, port_name: str) -> FakePortReader:
+        self.readers[port_name] = FakePortReader(port_name)
+        return self.readers[port_name]
+
+    def scan_serial_ports(self, *args, **kwargs) -> list[str]:
+        ports = super().scan_serial_ports(*args, **kwargs)
+        self.scans += 1
+        return ports
+
+
+@pytest.fixture
+def monitor():
+    # no periodic scan during the test, the ports are only found on the events
+    monitor = CountingMonitor({}, [], queue.Queue(), scanning_interval=3600, alert_on_no_ports=False,
+                              hotplug_source=SimulatedEventSource())
+    monitor.start()
+    assert wait_until(lambda: monitor.scans == 1)
+    yield monitor
+    monitor.stop()
+
+
+def plug_box(ports_dir: str, box_id: int) -> SimulatedBox:
+    box = SimulatedBox(box_id, os.path.join(ports_dir, f'box_sim{box_id}'), interval=0.1, time_sync=False)
+    box.start()
+    assert wait_until(lambda: os.path.exists(box.link_path))
+    return box
+
+
+def unplug_box(box: SimulatedBox):
+    box.stop_event.set()
+    box.join(5)
+
+
+def test_added_port_is_started_on_the_event(ports_dir, monitor):
+    box = plug_box(ports_dir, 1)
+    try:
+        assert not monitor.ports
+        monitor.hotplug_source.emit(HOTPLUG_ADD, os.path.realpath(box.link_path))
+
+        assert wait_until(lambda: box.link_path in monitor.ports)
+        assert monitor.scans == 2
+        assert monitor.readers[box.link_path].started
+        # the port is named after its stable link
+        assert monitor.threads[box.link_path].port_name == box.link_path
+        # the first reading of the probe is kept
+        assert monitor.reading_queue.get(timeout=1).port == box.link_path
+    finally:
+        unplug_box(box)
+
+
+def test_removed_port_is_stopped_on_the_event(ports_dir, monitor):
+    box = plug_box(ports_dir, 2)
+    monitor.hotplug_source.emit(HOTPLUG_ADD, os.path.realpath(box.link_path))
+    assert wait_until(lambda: box.link_path in monitor.ports)
+    device = os.path.realpath(box.link_path)
+
+    unplug_box(box)
+    monitor.hotplug_source.emit(HOTPLUG_REMOVE, device)
+
+    assert wait_until(lambda: box.link_path not in monitor.ports)
+    assert box.link_path not in monitor.threads
+    assert monitor.readers[box.link_path].stopped
+
+
+def test_events_before_start_are_delivered():
+    source = SimulatedEventSource()
+    source.emit(HOTPLUG_ADD, '/dev/ttyACM0')
+    events = []
+
+    source.start(lambda action, device: events.append((action, device)))
+    source.emit(HOTPLUG_REMOVE, '/dev/ttyACM0')
+
+    assert events == [(HOTPLUG_ADD, '/dev/ttyACM0'), (HOTPLUG_REMOVE, '/dev/ttyACM0')]
+
+
+class SlowProbeMonitor(SerialPortMonitor):
+    """Port monitor whose probes hang until released, like a box that doesn't answer."""
+
+    def __init__(self):
+        super().__init__({}, [], queue.Queue(), alert_on_no_ports=False)
+        self.release = threading.Event()
+        self.probed = []
+
+    def probe_port(self, port_name: str, timeout: float) -> tuple[bool, None]:
+        self.probed.append(port_name)
+        self.release.wait(10)
+        return True, None
+
+
+def test_port_still_probed_after_the_deadline_is_skipped():
+    monitor = SlowProbeMonitor()
+    responded = []
+    try:
+        monitor.probe_ports(['/dev/ttyACM0'], deadline=0.1, on_responded=lambda *args: responded.append(args))
+        monitor.probe_ports(['/dev/ttyACM0'], deadline=0.1)
+
+        assert monitor.probed == ['/dev/ttyACM0']
+        assert not responded
+    finally:
+        monitor.release.set()
+    assert wait_until(lambda: not monitor.probing)
+
+    monitor.probe_ports(['/dev/ttyACM0'], deadline=1)
+    assert monitor.probed == ['/dev/ttyACM0', '/dev/ttyACM0']
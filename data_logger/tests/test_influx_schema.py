@@ -0,0 +1,64 @@
+"""Line protocol written by the compiled schemas, checked against Point."""
+import pytest
+from influxdb_client import Point
+
+from datalog import InfluxDataLogger, InfluxSchema, line_protocol_value
+
+TS = 1_700_000_000_000_000_000
+
+
+@pytest.fixture
+def data_logger():
+    return InfluxDataLogger(batching=False, aggregate_window=0)
+
+
+def point_line(data_logger: InfluxDataLogger, data: dict, ts: int) -> str:
+    """The point InfluxDataLogger built field by field before the schemas."""
+    box_id = data["ID"]
+    point = Point(data_logger._get_measurement_name(box_id)).tag("box_id", box_id).time(ts)
+    for key, value in data.items():
+        influx_key = data_logger.INFLUX_KEYS_MAP.get(key)
+        if key == "ID" or not influx_key:
+            continue
+        if key in data_logger.INFLUX_KEYS_TYPES:
+            value = data_logger.INFLUX_KEYS_TYPES[key](value)
+        point = point.field(influx_key, value)
+    return point.to_line_protocol()
+
+
+@pytest.mark.parametrize("data", [
+    {"ID": 5, "co2": 612, "%RH": 71.2, "RHSP": 71, "boxTempC": 34.1, "BHSP": 35,
+     "waterTempC": 41.9, "IHSP": 40},
+    {"ID": 10001, "co2(ppm)_0": 455, "humidity(RH)_0": 48.2, "temperature(C)_0": 22.4,
+     "pressure(Pa)_0": 101322.5},
+    # whole floats, ints sent as floats and the other way around
+    {"ID": 6, "co2": 600, "%RH": 70.0, "boxTempC": 35, "waterTempC": "41.5"},
+    # unknown keys are left out
+    {"ID": 7, "co2": 580, "pressure": 101318},
+    # box id sent as a string
+    {"ID": "8", "co2": 1},
+])
+def test_schema_line_matches_point(data_logger, data):
+    assert data_logger.to_line_protocol(data, TS) == point_line(data_logger, data, TS)
+
+
+def test_non_finite_floats_are_left_out_like_point(data_logger):
+    data = {"ID": 5, "co2": 612, "%RH": float("nan"), "boxTempC": float("inf")}
+
+    assert data_logger.to_line_protocol(data, TS) == point_line(data_logger, data, TS)
+    assert data_logger.to_line_protocol({"ID": 5, "%RH": float("nan")}, TS) is None
+
+
+@pytest.mark.parametrize("value", [0, -3, 2**40, 1.5, -0.25, 1e20, 3.0, True, False, "say \"hi\" \\ ok"])
+def test_field_values_match_point(value):
+    expected = Point("m").field("f", value).to_line_protocol().split(" ", 1)[1]
+
+    assert f"f={line_protocol_value(value)}" == expected
+
+
+def test_schema_fields_and_unknown_keys():
+    schema = InfluxSchema(("ID", "co2", "%RH", "pressure"), InfluxDataLogger.INFLUX_KEYS_MAP,
+                          InfluxDataLogger.INFLUX_KEYS_TYPES)
+
+    assert schema.unknown_keys == ["pressure"]
+    assert schema.to_fields({"ID": 1, "co2": 450, "%RH": "51", "pressure": 1}) == {"co2": 450, "humidity": 51.0}
@@ -0,0 +1,71 @@
+"""Splitting the bytes read from a port into lines."""
+import pytest
+
+from serial_reader import LineBuffer
+
+
+def feed_all(line_buffer: LineBuffer, *chunks: bytes) -> list[bytes]:
+    lines = []
+    for chunk in chunks:
+        line_buffer.feed(chunk, lambda line: lines.append(bytes(line)))
+    return lines
+
+
+def test_lines_split_across_chunks_are_joined():
+    line_buffer = LineBuffer()
+
+    lines = feed_all(line_buffer, b'{"ID":', b' 1}\n{"ID"', b': 2}\n{"I', b'D": 3}\n')
+
+    assert lines == [b'{"ID": 1}', b'{"ID": 2}', b'{"ID": 3}']
+    assert not line_buffer.buffer
+
+
+def test_crlf_line_ends_are_removed():
+    line_buffer = LineBuffer()
+
+    # the CR and the LF can arrive in different chunks
+    lines = feed_all(line_buffer, b'first\r\nsecond\r', b'\nthird\n')
+
+    assert lines == [b'first', b'second', b'third']
+
+
+def test_empty_lines_are_skipped():
+    line_buffer = LineBuffer()
+
+    assert feed_all(line_buffer, b'\n\r\nline\n\n') == [b'line']
+
+
+def test_partial_line_stays_in_the_buffer():
+    line_buffer = LineBuffer()
+
+    assert feed_all(line_buffer, b'done\npart') == [b'done']
+    assert line_buffer.buffer == b'part'
+
+    line_buffer.clear()
+    assert feed_all(line_buffer, b'ial\nnext\n') == [b'ial', b'next']
+
+
+def test_overlong_line_is_dropped():
+    line_buffer = LineBuffer(max_line_length=16)
+
+    assert feed_all(line_buffer, b'x' * 10, b'x' * 10) == []
+    assert not line_buffer.buffer
+    # the tail of the garbage line comes out as a line, the decoder rejects it
+    assert feed_all(line_buffer, b'xx\nok\n') == [b'xx', b'ok']
+
+
+def test_handled_lines_are_dropped_when_the_callback_fails():
+    line_buffer = LineBuffer()
+    lines = []
+
+    def callback(line):
+        lines.append(bytes(line))
+        if len(lines) == 1:
+            raise ValueError("bad line")
+
+    with pytest.raises(ValueError):
+        line_buffer.feed(b'one\ntwo\nthree', callback)
+    assert line_buffer.buffer == b'two\nthree'
+
+    line_buffer.feed(b'\n', callback)
+    assert lines == [b'one', b'two', b'three']
@@ -0,0 +1,156 @@
+"""Timer wheel and the liveness escalation of the silent boxes and ports."""
+import pytest
+
+import config
+import liveness
+from liveness import LivenessTracker, TimerWheel
+
+
+def test_timers_expire_on_their_tick():
+    wheel = TimerWheel(tick=1.0, slots=8, now=0)
+    wheel.schedule('a', 1.5)
+    wheel.schedule('b', 3.2)
+
+    assert wheel.advance(1.0) == []
+    assert wheel.advance(2.0) == ['a']
+    assert wheel.advance(3.5) == []
+    assert wheel.advance(4.0) == ['b']
+
+
+def test_timer_further_than_a_turn_waits_for_its_turn():
+    wheel = TimerWheel(tick=1.0, slots=4, now=0)
+    wheel.schedule('far', 10.5)
+
+    assert wheel.advance(3.0) == []
+    assert wheel.advance(7.0) == []
+    assert wheel.advance(11.0) == ['far']
+
+
+def test_past_deadline_expires_on_the_next_tick():
+    wheel = TimerWheel(tick=1.0, slots=4, now=10)
+    wheel.schedule('late', 2.0)
+
+    assert wheel.advance(10.5) == []
+    assert wheel.advance(11.0) == ['late']
+
+
+def test_all_timers_expire_after_a_long_pause():
+    wheel = TimerWheel(tick=1.0, slots=4, now=0)
+    for i in range(10):
+        wheel.schedule(i, i + 0.5)
+
+    assert sorted(wheel.advance(1000.0)) == list(range(10))
+    assert wheel.advance(2000.0) == []
+
+
+class FakeTime:
+    def __init__(self, now: float):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime(1000.0)
+    monkeypatch.setattr(liveness, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def reports(monkeypatch):
+    """The Sentry messages and the systemd notifications."""
+    reports = []
+    monkeypatch.setattr(config, 'capture_message', lambda message, level='error': reports.append((level, message)))
+    monkeypatch.setattr(config, 'notify_systemd', lambda state: reports.append(('systemd', state)))
+    return reports
+
+
+@pytest.fixture
+def reopened():
+    return []
+
+
+@pytest.fixture
+def tracker(clock, reports, reopened):
+    return LivenessTracker(reopen_port=reopened.append, timeout=10, tick=1.0)
+
+
+def advance(tracker: LivenessTracker, clock: FakeTime, seconds: int):
+    for _ in range(seconds):
+        clock.now += 1
+        tracker.check(clock.now)
+
+
+def test_silent_box_escalates_one_step_per_timeout(tracker, clock, reports, reopened):
+    tracker.watch_port('/dev/ttyUSB0')
+    tracker.seen(5, '/dev/ttyUSB0')
+
+    advance(tracker, clock, 10)
+    assert tracker.stale == {}
+
+    # the box and its port go stale together, the port is reopened once
+    advance(tracker, clock, 1)
+    assert reopened == ['/dev/ttyUSB0']
+    assert tracker.stale == {('port', '/dev/ttyUSB0'): 1, ('box', 5): 1}
+    assert reports == []
+
+    # the alert is sent for the box, not for its port
+    advance(tracker, clock, 10)
+    assert reports == [('error', "Box 5 on /dev/ttyUSB0 stopped sending data")]
+
+    advance(tracker, clock, 10)
+    assert reports[1:] == [('systemd', "STATUS=No data from box 5")]
+
+    # no more steps
+    advance(tracker, clock, 30)
+    assert len(reports) == 2
+    assert reopened == ['/dev/ttyUSB0']
+
+
+def test_reading_resets_the_escalation(tracker, clock, reports):
+    tracker.seen(5, '/dev/ttyUSB0')
+    advance(tracker, clock, 31)
+    reports.clear()
+
+    tracker.seen(5, '/dev/ttyUSB0')
+
+    assert tracker.stale == {}
+    assert reports == [
+        ('info', "Box 5 on /dev/ttyUSB0 is sending data again"),
+        ('systemd', f"STATUS={LivenessTracker.STATUS_OK}"),
+    ]
+    # watched again from the new reading
+    advance(tracker, clock, 11)
+    assert tracker.stale == {('port', '/dev/ttyUSB0'): 1, ('box', 5): 1}
+
+
+def test_regular_readings_keep_the_box_alive(tracker, clock, reports, reopened):
+    for _ in range(10):
+        tracker.seen(5, '/dev/ttyUSB0')
+        advance(tracker, clock, 5)
+
+    assert tracker.stale == {}
+    assert reopened == []
+
+
+def test_port_without_a_reading_is_alerted(tracker, clock, reports, reopened):
+    tracker.watch_port('/dev/ttyUSB1')
+
+    advance(tracker, clock, 21)
+
+    assert reopened == ['/dev/ttyUSB1']
+    assert reports == [('error', "Port /dev/ttyUSB1 stopped sending data")]
+
+
+def test_forgotten_port_is_not_escalated(tracker, clock, reports):
+    tracker.watch_port('/dev/ttyUSB1')
+    advance(tracker, clock, 21)
+    reports.clear()
+
+    tracker.forget_port('/dev/ttyUSB1')
+    advance(tracker, clock, 30)
+
+    assert reports == [('systemd', f"STATUS={LivenessTracker.STATUS_OK}")]
+    assert tracker.stale == {}
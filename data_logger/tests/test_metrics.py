@@ -0,0 +1,114 @@
+"""Metrics rendered in the Prometheus text format."""
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.MetricsRegistry()
+
+
+def test_counter_is_rendered_with_help_and_type(registry):
+    lines = registry.counter('test_lines_total', "Lines read.", ('port',))
+    lines.labels('/dev/ttyUSB0').inc()
+    lines.labels('/dev/ttyUSB0').inc(2)
+
+    assert registry.render() == (
+        '# HELP test_lines_total Lines read.\n'
+        '# TYPE test_lines_total counter\n'
+        'test_lines_total{port="/dev/ttyUSB0"} 3\n'
+    )
+
+
+def test_counter_without_total_suffix_is_rejected(registry):
+    with pytest.raises(ValueError):
+        registry.counter('test_lines', "Lines read.")
+
+
+def test_counter_cells_of_all_threads_are_summed(registry):
+    counter = registry.counter('test_events_total', "Events.")
+    threads = [threading.Thread(target=lambda: [counter.inc() for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 4000
+
+
+def test_label_values_are_escaped(registry):
+    registry.counter('test_errors_total', "Errors.", ('reason',)).labels('say "hi"\\\nbye').inc()
+
+    assert 'test_errors_total{reason="say \\"hi\\"\\\\\\nbye"} 1' in registry.render().splitlines()
+
+
+def test_wrong_label_count_is_rejected(registry):
+    family = registry.counter('test_lines_total', "Lines read.", ('port', 'box'))
+
+    with pytest.raises(ValueError):
+        family.labels('/dev/ttyUSB0')
+
+
+def test_gauge_reads_its_function_on_every_render(registry):
+    items = []
+    gauge = registry.gauge('test_queue_depth', "Queue depth.")
+    gauge.set_function(lambda: len(items))
+
+    assert 'test_queue_depth 0' in registry.render()
+    items.extend([1, 2])
+    assert 'test_queue_depth 2' in registry.render()
+
+
+def test_failing_gauge_function_doesnt_break_the_scrape(registry):
+    registry.gauge('test_broken', "Broken.").set_function(lambda: 1 / 0)
+    registry.gauge('test_ok', "Ok.").set(1.5)
+
+    lines = registry.render().splitlines()
+    assert 'test_ok 1.5' in lines
+    assert not [line for line in lines if line.startswith('test_broken ')]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram('test_write_seconds', "Write time.", ('sink',), buckets=(0.1, 1.0))
+    child = histogram.labels('influx')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        child.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'test_write_seconds_bucket{sink="influx",le="0.1"} 2',
+        'test_write_seconds_bucket{sink="influx",le="1.0"} 3',
+        'test_write_seconds_bucket{sink="influx",le="+Inf"} 4',
+        'test_write_seconds_sum{sink="influx"} 3.65',
+        'test_write_seconds_count{sink="influx"} 4',
+    ]
+
+
+def test_removed_child_is_not_rendered(registry):
+    family = registry.gauge('test_depth', "Depth.", ('sink',))
+    family.labels('file').set(1)
+    family.labels('influx').set(2)
+    family.remove('file')
+
+    assert registry.render().splitlines()[2:] == ['test_depth{sink="influx"} 2']
+
+
+def test_metrics_are_served_over_http(monkeypatch, registry):
+    registry.counter('test_lines_total', "Lines read.").inc()
+    monkeypatch.setattr(metrics.MetricsHandler, 'registry', registry)
+    server = metrics.MetricsServer('127.0.0.1', 0)
+    server.start()
+    try:
+        host, port = server.server.server_address[:2]
+        with urllib.request.urlopen(f'http://{host}:{port}/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+            assert response.read().decode() == registry.render()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f'http://{host}:{port}/other', timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.stop()
@@ -0,0 +1,81 @@
+"""Data log index and queries, over the files of the file data logger."""
+import json
+import os
+
+import pytest
+
+import query
+from datalog import RotatingFileDataLogger
+
+START = 1_700_000_000 * 10**9
+MINUTE = 60 * 10**9
+
+
+@pytest.fixture
+def data_logger(tmp_path):
+    data_logger = RotatingFileDataLogger(str(tmp_path), index_interval=0)
+    yield data_logger
+    # the file handler is on a module level logger, shared by the tests
+    for handler in list(data_logger.data_logger.handlers):
+        data_logger.data_logger.removeHandler(handler)
+        handler.close()
+
+
+def write(data_logger: RotatingFileDataLogger, count: int, start: int = 0):
+    for i in range(start, start + count):
+        data_logger.log_results({"ID": 1 + i % 4, "co2": 400 + i}, START + i * MINUTE)
+
+
+def test_query_returns_the_range_of_a_box(tmp_path, data_logger):
+    write(data_logger, 1000)
+
+    rows = list(query.query(str(tmp_path), START + 100 * MINUTE, START + 199 * MINUTE, {"2"}))
+
+    assert [row["co2"] for row in rows] == [400 + i for i in range(101, 200, 4)]
+
+
+def test_index_is_extended_with_the_new_lines(tmp_path, data_logger):
+    write(data_logger, 600)
+    index = query.LogIndex(data_logger.file_path)
+    index.update()
+    blocks = len(index.entries)
+
+    write(data_logger, 600, start=600)
+    index = query.LogIndex(data_logger.file_path)
+    index.update()
+
+    assert len(index.entries) > blocks
+    assert index.indexed_size == os.path.getsize(data_logger.file_path)
+    assert len(list(query.query(str(tmp_path), START, START + 1200 * MINUTE))) == 1200
+
+
+def test_data_logger_indexes_as_it_writes(tmp_path, data_logger):
+    data_logger.index_interval = 1
+    data_logger.last_index = 0
+    write(data_logger, 10)
+
+    with open(query.index_path(data_logger.file_path)) as f:
+        header = json.loads(f.readline())
+        entries = [json.loads(line) for line in f]
+    assert header["inode"] == os.stat(data_logger.file_path).st_ino
+    # indexed up to the first line, the next ones after the interval
+    assert entries[0]["lines"] == 1
+
+
+def test_index_is_moved_along_on_rotation(tmp_path):
+    data_logger = RotatingFileDataLogger(str(tmp_path), index_interval=3600)
+    file_handler = data_logger.data_logger.handlers[-1]
+    try:
+        write(data_logger, 300)
+        file_handler.doRollover()
+        write(data_logger, 10, start=300)
+    finally:
+        data_logger.data_logger.removeHandler(file_handler)
+        file_handler.close()
+
+    rotated_path, = [path for path in query.data_log_files(str(tmp_path)) if path != data_logger.file_path]
+    # indexed by the data logger when it was rotated
+    with open(query.index_path(rotated_path)) as f:
+        assert json.loads(f.readline())["inode"] == os.stat(rotated_path).st_ino
+        assert sum(json.loads(line)["lines"] for line in f) == 300
+    assert len(list(query.query(str(tmp_path), START, START + 310 * MINUTE))) == 310
@@ -0,0 +1,45 @@
+"""Fan out of the readings by the queue reader to the data handlers."""
+import queue
+import time
+
+import datalog
+from serial_reader import QueueReadingThread
+
+
+class ListDataLogger(datalog.DataLoggerBase):
+    """Data logger keeping the readings in a list."""
+
+    def __init__(self):
+        self.readings = []
+
+    def log_results(self, data: dict, ts: int):
+        self.readings.append((data, ts))
+
+
+def fan_out(readings: list, callbacks: list):
+    reading_queue = queue.Queue()
+    thread = QueueReadingThread(reading_queue, callbacks)
+    thread.start()
+    for reading in readings:
+        reading_queue.put(reading)
+    thread.stop()
+
+
+def test_decoded_readings_skip_the_raw_callbacks():
+    lines = []
+    data_logger = ListDataLogger()
+    ts = time.time_ns()
+
+    # a reading of a worker process, decoded without its line
+    fan_out([datalog.Reading(None, None, ts, {"ID": 1, "co2": 450})], [lines.append, data_logger.handle_data])
+
+    assert lines == []
+    assert data_logger.readings == [({"ID": 1, "co2": 450}, ts)]
+
+
+def test_raw_callbacks_get_the_lines():
+    lines = []
+
+    fan_out([datalog.Reading(b'{"ID":1,"co2":450}', 'port', time.time_ns())], [lines.append])
+
+    assert lines == ['{"ID":1,"co2":450}']
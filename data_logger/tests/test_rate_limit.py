@@ -0,0 +1,77 @@
+"""Rate limiting and sampling of the hot path log messages."""
+import logging
+import time
+
+import config
+from config import RateLimitFilter
+
+
+def record(msg: str = "Invalid JSON data from %s: %s", args: tuple = ("port", "line"),
+           level: int = logging.WARNING, name: str = "config.hot") -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def passing(rate_limit: RateLimitFilter, records: list) -> list[str]:
+    return [r.getMessage() for r in records if rate_limit.filter(r)]
+
+
+def test_burst_passes_then_one_in_sample_every():
+    rate_limit = RateLimitFilter(interval=60, burst=3, sample_every=5)
+
+    messages = passing(rate_limit, [record(args=("port", i)) for i in range(14)])
+
+    assert messages == [
+        "Invalid JSON data from port: 0",
+        "Invalid JSON data from port: 1",
+        "Invalid JSON data from port: 2",
+        "Invalid JSON data from port: 7 (4 similar messages suppressed)",
+        "Invalid JSON data from port: 12 (4 similar messages suppressed)",
+    ]
+    assert rate_limit.suppressed == 9
+
+
+def test_sample_every_zero_suppresses_all_over_the_burst():
+    rate_limit = RateLimitFilter(interval=60, burst=2, sample_every=0)
+
+    assert len(passing(rate_limit, [record() for _ in range(100)])) == 2
+    assert rate_limit.suppressed == 98
+
+
+def test_messages_are_limited_separately():
+    rate_limit = RateLimitFilter(interval=60, burst=1, sample_every=0)
+
+    messages = passing(rate_limit, [
+        record("first %s: %s"), record("first %s: %s"),
+        record("second %s: %s"), record("first %s: %s", level=logging.ERROR),
+        record("first %s: %s", name="config.other"),
+    ])
+
+    assert len(messages) == 4
+
+
+def test_window_restarts_after_the_interval():
+    rate_limit = RateLimitFilter(interval=0.05, burst=1, sample_every=0)
+
+    assert passing(rate_limit, [record(args=("port", i)) for i in range(3)]) == ["Invalid JSON data from port: 0"]
+    time.sleep(0.06)
+
+    # the first record of the new window reports the suppressed ones
+    assert passing(rate_limit, [record(args=("port", 3)), record(args=("port", 4))]) == [
+        "Invalid JSON data from port: 3 (2 similar messages suppressed)"]
+
+
+def test_hot_path_logger_is_rate_limited(caplog):
+    hot_path_logger = config.hot_path_logger
+    rate_limit = RateLimitFilter(interval=60, burst=2, sample_every=0)
+    hot_path_logger.removeFilter(config.hot_path_filter)
+    hot_path_logger.addFilter(rate_limit)
+    try:
+        with caplog.at_level(logging.WARNING, logger=hot_path_logger.name):
+            for i in range(5):
+                hot_path_logger.warning("Dropping %d bytes without a line end", i)
+    finally:
+        hot_path_logger.removeFilter(rate_limit)
+        hot_path_logger.addFilter(config.hot_path_filter)
+
+    assert [r.getMessage() for r in caplog.records] == [
+        "Dropping 0 bytes without a line end", "Dropping 1 bytes without a line end"]
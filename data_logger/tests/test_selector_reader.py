@@ -0,0 +1,74 @@
+"""Selector reader engine, reading simulated boxes on pseudo-terminals."""
+import os
+import queue
+import time
+
+import pytest
+
+from serial_reader import SelectorReaderThread
+from simulator import SimulatedBox
+
+
+class FailingOnceReader(SelectorReaderThread):
+    """Selector reader failing on its first read, like a bug in the decode path."""
+
+    failed = False
+
+    def _read_port(self, port):
+        if not self.failed:
+            self.failed = True
+            raise RuntimeError("bug")
+        super()._read_port(port)
+
+
+def wait_until(condition: callable, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def box(ports_dir):
+    box = SimulatedBox(7, os.path.join(ports_dir, 'box_sim7'), interval=0.05, time_sync=False)
+    box.start()
+    assert wait_until(lambda: os.path.exists(box.link_path))
+    yield box
+    box.stop_event.set()
+    box.join(5)
+
+
+def test_reader_survives_an_unexpected_error(box):
+    reading_queue = queue.Queue()
+    reader = FailingOnceReader(reading_queue, reconnect_delay=0.1)
+    reader.start()
+    try:
+        reader.add_port(box.link_path)
+        assert reading_queue.get(timeout=10).port == box.link_path
+
+        assert reader.failed
+        assert reader.is_alive()
+        reader.remove_port(box.link_path)
+        assert not reader.has_port(box.link_path)
+    finally:
+        reader.stop()
+
+
+def test_remove_port_gives_up_on_a_stuck_reader(box):
+    reader = SelectorReaderThread(queue.Queue())
+    reader.REMOVE_TIMEOUT = 0.2
+    reader.start()
+    try:
+        reader.add_port(box.link_path)
+        assert wait_until(lambda: reader.ports.get(box.link_path) and reader.ports[box.link_path].ser)
+        # the reader no longer handles the commands
+        reader._handle_commands = lambda: time.sleep(1)
+
+        start = time.monotonic()
+        reader.remove_port(box.link_path)
+        assert time.monotonic() - start < 1
+    finally:
+        del reader._handle_commands
+        reader.stop()
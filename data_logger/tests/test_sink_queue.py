@@ -0,0 +1,117 @@
+"""Data handler queues, their overflow policies and the spill file."""
+import threading
+import time
+
+import pytest
+
+from serial_reader import DataHandlerThread, SpillFile
+
+
+class SlowSink:
+    """Callback blocked until released, recording the items it got."""
+
+    def __init__(self):
+        self.items = []
+        self.release = threading.Event()
+
+    def __call__(self, item):
+        self.release.wait(10)
+        self.items.append(item)
+
+
+def wait_until(condition: callable, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def fill(thread: DataHandlerThread, sink: SlowSink, count: int):
+    thread.start()
+    thread.put(0)
+    # the first item is being handled, the next ones wait in the queue
+    assert wait_until(lambda: thread.queue.empty())
+    for item in range(1, count):
+        thread.put(item)
+
+
+def test_drop_oldest_keeps_the_newest_items(tmp_path):
+    sink = SlowSink()
+    thread = DataHandlerThread(sink, max_size=3, overflow_policy='drop_oldest', spill_path=str(tmp_path))
+    fill(thread, sink, 6)
+    sink.release.set()
+    thread.stop()
+
+    assert sink.items == [0, 3, 4, 5]
+    assert thread.dropped == 2
+
+
+def test_spill_keeps_all_the_items_in_order(tmp_path):
+    sink = SlowSink()
+    thread = DataHandlerThread(sink, max_size=3, overflow_policy='spill', spill_path=str(tmp_path))
+    fill(thread, sink, 20)
+    assert len(thread.spill_file)
+    assert thread.depth == 19
+
+    sink.release.set()
+    thread.stop()
+
+    assert sink.items == list(range(20))
+
+
+def test_spilled_items_are_handled_without_delay(tmp_path):
+    sink = SlowSink()
+    thread = DataHandlerThread(sink, max_size=2, overflow_policy='spill', spill_path=str(tmp_path))
+    fill(thread, sink, 10)
+    start = time.monotonic()
+    sink.release.set()
+
+    assert wait_until(lambda: len(sink.items) == 10)
+    # not a queue timeout per read of the spill
+    assert time.monotonic() - start < 0.5
+    thread.stop()
+
+
+def test_unknown_policy_blocks(tmp_path):
+    thread = DataHandlerThread(print, overflow_policy='unknown', spill_path=str(tmp_path))
+
+    assert thread.overflow_policy == DataHandlerThread.OVERFLOW_BLOCK
+
+
+@pytest.fixture
+def spill_path(tmp_path) -> str:
+    return str(tmp_path / "sink.spill")
+
+
+def test_handled_items_are_not_replayed_after_a_restart(spill_path):
+    spill = SpillFile(spill_path)
+    for item in range(5):
+        spill.append(item)
+    assert spill.read(2) == [0, 1]
+    spill.commit()
+    # not committed, the app crashed while handling them
+    assert spill.read(2) == [2, 3]
+    spill.close()
+
+    spill = SpillFile(spill_path)
+    assert len(spill) == 3
+    assert spill.read(10) == [2, 3, 4]
+    spill.commit()
+    spill.close()
+
+    assert SpillFile(spill_path).read(10) == []
+
+
+def test_spill_file_is_truncated_once_handled(spill_path):
+    spill = SpillFile(spill_path)
+    spill.append({"ID": 1})
+    assert spill.read(10) == [{"ID": 1}]
+    spill.commit()
+
+    spill.append({"ID": 2})
+    assert spill.read(10) == [{"ID": 2}]
+    spill.commit()
+    spill.close()
+    assert not len(SpillFile(spill_path))
@@ -0,0 +1,125 @@
+"""Influx spool and the batch writer retrying, spooling and replaying the points."""
+import threading
+import time
+
+import pytest
+
+from datalog import InfluxBatchWriter
+from spool import InfluxSpool
+
+
+class FakeWriteApi:
+    """Write API recording the written points, failing while down."""
+
+    def __init__(self):
+        self.down = False
+        self.points = []
+        self.attempts = 0
+        self.lock = threading.Lock()
+
+    def write(self, bucket: str, record: list[str]):
+        with self.lock:
+            self.attempts += 1
+            if self.down:
+                raise ConnectionError("Influx is down")
+            self.points.extend(record)
+
+
+def points(start: int, count: int) -> list[str]:
+    return [f"box,ID=1 co2={i} {i}" for i in range(start, start + count)]
+
+
+def wait_until(condition: callable, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = InfluxSpool(str(tmp_path / "spool.db"), max_bytes=10**6, max_age=3600)
+    yield spool
+    spool.close()
+
+
+def assert_totals(spool: InfluxSpool):
+    assert spool.size_bytes == spool._payload_bytes()
+    assert spool.points == spool._count_points()
+
+
+def test_totals_follow_the_stored_and_removed_batches(spool):
+    spool.put(points(0, 3))
+    spool.put(points(3, 2))
+    assert len(spool) == 5
+    assert_totals(spool)
+
+    batches = spool.peek(3)
+    assert [lines for _, lines in batches] == [points(0, 3)]
+    spool.remove([batch_id for batch_id, _ in batches])
+
+    assert len(spool) == 2
+    assert_totals(spool)
+
+
+def test_oldest_batches_are_evicted_over_the_limits(spool):
+    spool.put(points(0, 10))
+    spool.max_bytes = spool.size_bytes * 3 // 2
+    spool.put(points(10, 10))
+    assert len(spool) == 10
+    assert spool.peek(100)[0][1] == points(10, 10)
+    assert_totals(spool)
+
+    spool.max_age = -1
+    spool.put(points(20, 1))
+    assert len(spool) == 0
+    assert_totals(spool)
+
+
+def test_spool_is_kept_over_a_restart(tmp_path, spool):
+    spool.put(points(0, 4))
+    spool.close()
+
+    reopened = InfluxSpool(spool.path)
+    try:
+        assert len(reopened) == 4
+        assert reopened.peek(10)[0][1] == points(0, 4)
+    finally:
+        reopened.close()
+
+
+def test_failed_batches_are_spooled_and_replayed(spool):
+    write_api = FakeWriteApi()
+    write_api.down = True
+    writer = InfluxBatchWriter(write_api, 'bucket', batch_size=5, flush_interval=0.05, max_retries=1,
+                               retry_backoff=0.01, retry_max_delay=0.2, spool=spool, replay_rate=1000)
+    writer.start()
+    try:
+        for line in points(0, 10):
+            writer.add(line)
+        assert wait_until(lambda: len(spool) == 10)
+        # retried once, then Influx is known to be down and the next batch is spooled right away
+        assert write_api.attempts == 2
+
+        write_api.down = False
+        assert wait_until(lambda: len(spool) == 0)
+        for line in points(10, 5):
+            writer.add(line)
+        assert wait_until(lambda: len(write_api.points) == 15)
+    finally:
+        writer.stop()
+    assert sorted(write_api.points) == sorted(points(0, 15))
+
+
+def test_points_are_written_on_stop():
+    write_api = FakeWriteApi()
+    writer = InfluxBatchWriter(write_api, 'bucket', batch_size=100, flush_interval=60)
+    writer.start()
+    for line in points(0, 3):
+        writer.add(line)
+
+    writer.stop()
+
+    assert write_api.points == points(0, 3)
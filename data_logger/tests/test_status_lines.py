@@ -0,0 +1,68 @@
+"""Status lines of the boxes, told apart from the data and logged rate limited."""
+import logging
+import queue
+
+import pytest
+
+from datalog import StatusLineLog, is_json_line
+from serial_reader import PortLineHandler
+
+
+@pytest.fixture
+def status_log(caplog) -> pytest.LogCaptureFixture:
+    caplog.set_level(logging.INFO, logger='config.status')
+    return caplog
+
+
+def test_json_lines_are_told_apart_from_the_status_lines():
+    assert is_json_line(b'{"ID":1}')
+    assert is_json_line(memoryview(b'{"ID":1}'))
+    assert is_json_line('{"ID":1}')
+    assert not is_json_line(b'Still waiting for time sync.')
+    assert not is_json_line(b'')
+
+
+def test_status_lines_never_reach_the_reading_queue(status_log):
+    reading_queue = queue.Queue()
+    handler = PortLineHandler('/dev/box_1', reading_queue)
+
+    handler.handle_line(b'SHT30 OK', lambda data: None)
+    handler.handle_line(b'{"ID":1,"co2":450}', lambda data: None)
+
+    assert reading_queue.get_nowait().line == b'{"ID":1,"co2":450}'
+    assert reading_queue.empty()
+    assert handler.status_lines.count == 1
+
+
+def test_repeated_status_line_is_logged_once_per_interval(status_log):
+    log = StatusLineLog('/dev/box_1', log_interval=3600)
+    for _ in range(5):
+        log.add("SHT30 OK")
+
+    assert [record.getMessage() for record in status_log.records] == ["/dev/box_1: SHT30 OK"]
+    assert log.count == 5
+    assert log.lines["SHT30 OK"][1] == 4
+
+
+def test_repeats_are_reported_after_the_interval(status_log):
+    log = StatusLineLog('/dev/box_1', log_interval=0)
+    log.add("SHT30 OK")
+    log.add("SHT30 OK")
+
+    assert status_log.records[-1].getMessage() == "/dev/box_1: SHT30 OK (repeated 1 times)"
+
+
+def test_garbage_lines_are_only_counted(status_log):
+    log = StatusLineLog('/dev/box_1', log_interval=3600)
+    for i in range(100):
+        log.add(f"\x00garbage {i}")
+
+    assert len(status_log.records) == StatusLineLog.MAX_NEW_LINES
+    assert log.unlogged == 100 - StatusLineLog.MAX_NEW_LINES
+    assert log.count == 100
+
+    # reported with the first new line of the next interval
+    log.log_interval = 0
+    log.add("SHT30 OK")
+    assert status_log.records[-2].getMessage() == "/dev/box_1: 90 other new status lines not logged"
+    assert status_log.records[-1].getMessage() == "/dev/box_1: SHT30 OK"
@@ -0,0 +1,79 @@
+"""Supervisor of the worker processes, with the workers on pipes or spawned."""
+import multiprocessing
+import time
+
+import metrics
+from supervisor import PipeDataLogger, Supervisor, WorkerProcess
+
+
+def wait_until(condition: callable, timeout: float = 30) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def exited_worker(messages: list) -> WorkerProcess:
+    """Worker whose process sent the messages and exited."""
+    worker = WorkerProcess(0, restart_delay=1)
+    worker.connection, writer = multiprocessing.Pipe(duplex=False)
+    for message in messages:
+        writer.send(message)
+    writer.close()
+    return worker
+
+
+def test_batches_sent_before_the_exit_are_received():
+    supervisor = Supervisor(processes=1)
+    worker = exited_worker([('readings', [({"ID": 1}, 1), ({"ID": 2}, 2)]), ('readings', [({"ID": 3}, 3)])])
+
+    supervisor.drain(worker)
+
+    assert worker.connection is None
+    assert [supervisor.reading_queue.get_nowait().data["ID"] for _ in range(3)] == [1, 2, 3]
+
+
+def test_worker_metrics_are_merged():
+    registry = metrics.MetricsRegistry()
+    lines = registry.counter('test_lines_total', "Lines.", ('port',))
+    lines.labels('/dev/box_1').inc(2)
+
+    registry.merge('worker0', {'test_lines_total': {('/dev/box_1',): 3, ('/dev/box_2',): 5}})
+    assert 'test_lines_total{port="/dev/box_1"} 5' in registry.render()
+    assert 'test_lines_total{port="/dev/box_2"} 5' in registry.render()
+
+    # the worker exited, its counts are kept and the next one counts from zero
+    registry.retire('worker0')
+    registry.merge('worker0', {'test_lines_total': {('/dev/box_2',): 1}})
+    assert 'test_lines_total{port="/dev/box_2"} 6' in registry.render()
+
+
+def test_pipe_data_logger_sends_its_metrics():
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    pipe_logger = PipeDataLogger(writer, batch_size=1)
+    metrics.PORT_RECONNECTS.labels('/dev/box_sim9').inc()
+
+    pipe_logger.log_results({"ID": 9}, 9)
+    pipe_logger.send_metrics()
+    pipe_logger.close()
+
+    assert reader.recv() == ('readings', [({"ID": 9}, 9)])
+    kind, snapshot = reader.recv()
+    assert kind == 'metrics'
+    assert snapshot['box_logger_port_reconnects_total'][('/dev/box_sim9',)] >= 1
+
+
+def test_killed_worker_is_restarted(ports_dir):
+    supervisor = Supervisor(processes=1, restart_delay=0.1)
+    supervisor.start()
+    try:
+        worker = supervisor.workers[0]
+        pid = worker.process.pid
+        worker.process.kill()
+
+        assert wait_until(lambda: worker.process is not None and worker.process.pid != pid)
+        assert worker.process.is_alive()
+    finally:
+        supervisor.stop()
@@ -0,0 +1,158 @@
+"""Time sync between the port threads and a fake Arduino on a pseudo-terminal."""
+import json
+import os
+import pty
+import queue
+import select
+import threading
+import time
+import tty
+from datetime import datetime
+
+import pytest
+
+from serial_reader import SerialPortThread, TimeSyncResponder
+
+
+class FakeArduino(threading.Thread):
+    """A box on a pseudo-terminal, polling for the time like requestTime() of the firmware.
+
+    Every poll interval it prints the sync request and reads what the host
+    sent, once a timestamp is received it's acknowledged and the box sends
+    a reading with its send time every interval.
+    """
+
+    def __init__(self, poll_interval: float = 0.5, interval: float = 0.05):
+        super().__init__(name="FakeArduino", daemon=True)
+        self.poll_interval = poll_interval
+        self.interval = interval
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)
+        self.stop_event = threading.Event()
+        self.received_time = None
+        self.synced_at = None
+        self.polls = 0
+
+    def send(self, line: str):
+        os.write(self.master, (line + "\r\n").encode('utf-8'))
+
+    def available(self) -> str:
+        readable, _, _ = select.select([self.master], [], [], 0)
+        return os.read(self.master, 4096).decode('utf-8') if readable else ""
+
+    def run(self):
+        self.send("Initialized scheduler")
+        while not self.stop_event.is_set() and self.received_time is None:
+            self.polls += 1
+            self.send("Serial up. Initializing.")
+            answer = self.available()
+            if answer:
+                self.received_time = answer.splitlines()[0]
+                self.synced_at = datetime.now()
+                self.send(f"Received time: {self.received_time}")
+                break
+            self.send("Still waiting for time sync.")
+            self.stop_event.wait(self.poll_interval)
+        while not self.stop_event.wait(self.interval):
+            self.send(json.dumps({"ID": 1, "co2": 450, "sent_ns": time.time_ns()}, separators=(',', ':')))
+
+    def close(self):
+        self.stop_event.set()
+        self.join(5)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@pytest.fixture
+def box():
+    box = FakeArduino()
+    box.start()
+    yield box
+    box.close()
+
+
+def read_readings(port_name: str, count: int, timeout: float = 10) -> tuple[list, SerialPortThread]:
+    """Read the first readings of a port with a port thread."""
+    reading_queue = queue.Queue()
+    thread = SerialPortThread(port_name, threading.Event(), reading_queue)
+    thread.start()
+    try:
+        readings = [reading_queue.get(timeout=timeout) for _ in range(count)]
+    finally:
+        thread.stop()
+    return readings, thread
+
+
+def test_box_is_answered_with_the_host_clock(box):
+    readings, thread = read_readings(box.port_name, 3)
+
+    assert box.received_time is not None
+    received = datetime.fromisoformat(box.received_time)
+    assert abs((box.synced_at - received).total_seconds()) < 2
+    assert thread.line_handler.time_sync.synced
+    assert all(json.loads(reading.line)["ID"] == 1 for reading in readings)
+
+
+def test_readings_are_stamped_after_they_were_sent(box):
+    readings, _ = read_readings(box.port_name, 20)
+
+    for reading in readings:
+        sent_ns = json.loads(reading.line)["sent_ns"]
+        # not shifted before the send time by the wait for the box's poll
+        assert sent_ns - 1_000_000 <= reading.ts < sent_ns + 500_000_000
+        assert reading.port == box.port_name
+
+
+def test_sync_requests_are_answered_once_per_retry_interval():
+    responder = TimeSyncResponder('port', retry_interval=60)
+    written = []
+
+    assert responder.handle_status_line("Serial up. Initializing.", written.append)
+    assert responder.handle_status_line("Still waiting for time sync.", written.append)
+    assert len(written) == 1
+    datetime.fromisoformat(written[0].decode('ascii').strip())
+    assert not responder.synced
+
+    assert responder.handle_status_line("Received time: 2024-01-01T00:00:00", written.append)
+    assert responder.synced
+    assert not responder.handle_status_line("SHT30 OK", written.append)
+
+
+class FailingOnceQueue(queue.Queue):
+    """Reading queue failing on the first reading, like a sink with a bug."""
+
+    def __init__(self):
+        super().__init__()
+        self.failed = False
+
+    def put(self, item, *args, **kwargs):
+        if not self.failed:
+            self.failed = True
+            raise ValueError("bad reading")
+        super().put(item, *args, **kwargs)
+
+
+class CountingPortThread(SerialPortThread):
+    """Port thread counting how many times it opened the port."""
+
+    connects = 0
+
+    def connect_port(self, port_name: str):
+        self.connects += 1
+        return super().connect_port(port_name)
+
+
+def test_line_errors_dont_reopen_the_port(box):
+    reading_queue = FailingOnceQueue()
+    thread = CountingPortThread(box.port_name, threading.Event(), reading_queue)
+    thread.start()
+    try:
+        readings = [reading_queue.get(timeout=10) for _ in range(3)]
+    finally:
+        thread.stop()
+
+    assert reading_queue.failed
+    assert len(readings) == 3
+    # reopening the port would reset the box
+    assert thread.connects == 1